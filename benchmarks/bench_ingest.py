@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_position_sheet
+from eln.ingest import (build_clean_df, calculate_maturity, clean_name_str, clean_percentage,
+                        clean_ticker_symbol, parse_nc_months)
+
+# ==========================================
+# ⏱️ 讀檔正規化：逐列 apply vs 整欄向量化
+# ==========================================
+# python benchmarks/bench_ingest.py [筆數 ...]
+# 兩種寫法結果是否一致由 tests/test_ingest.py 檢查，這裡只計時
+
+
+def rowwise_reference(df, clean_df):
+    # 舊版逐列寫法，只重算被向量化的欄位
+    ref = pd.DataFrame(index=clean_df.index)
+    ref['Name'] = df['理專'].apply(clean_name_str)
+    ref['KO_Pct'] = df['KO價'].apply(clean_percentage)
+    ref['KI_Pct'] = df['KI價'].apply(clean_percentage)
+    ref['Strike_Pct'] = df['執行價'].apply(clean_percentage)
+    ref['NC_Months'] = df['KO類型'].apply(parse_nc_months)
+    for i in range(1, 6):
+        ref[f'T{i}_Code'] = df[f'標的{i}'].apply(clean_ticker_symbol)
+
+    tmp = pd.DataFrame({'IssueDate': pd.to_datetime(df['發行日']), 'TenureStr': df['天期'],
+                        'MaturityDate': pd.NaT, 'ValuationDate': pd.NaT})
+    for idx, row in tmp.iterrows():
+        if pd.isna(row['MaturityDate']):
+            calc_date = calculate_maturity(row, 'IssueDate', 'TenureStr')
+            tmp.at[idx, 'MaturityDate'] = calc_date
+            if pd.isna(row['ValuationDate']): tmp.at[idx, 'ValuationDate'] = calc_date
+    ref['MaturityDate'] = tmp['MaturityDate']
+    ref['ValuationDate'] = tmp['ValuationDate']
+    ref['Tenure'] = tmp['TenureStr'].apply(str)
+    return ref
+
+
+def run(n_rows):
+    df = make_position_sheet(n_rows)
+
+    t0 = time.perf_counter()
+    clean_df, _ = build_clean_df(df)
+    t_vec = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rowwise_reference(df, clean_df)
+    t_row = time.perf_counter() - t0
+
+    print(f"{n_rows:>7} 筆 | 逐列 {t_row:7.3f}s | 向量化 (整張表) {t_vec:7.3f}s | 加速 {t_row / t_vec:5.1f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(x) for x in sys.argv[1:]] or [1_000, 10_000, 50_000]
+    for n in sizes: run(n)
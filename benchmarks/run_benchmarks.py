@@ -0,0 +1,180 @@
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_position_sheet, make_price_history, make_universe, write_price_fixtures
+from eln.engine import (build_notifications, collect_tickers, download_windows, fetch_history, filter_results,
+                        page_slice, prepare_products, results_frame, table_columns)
+from eln.ingest import clean_ticker_series
+from eln.prices import CsvProvider, PriceStore
+from eln.reader import read_book_stream
+from eln.scenarios import shock_levels, shock_matrix, stress_book
+from eln.state import BarrierStateStore
+
+# ==========================================
+# ⏱️ 全流程壓測 (離線：合成部位表 + 假股價檔)
+# ==========================================
+# python benchmarks/run_benchmarks.py                 # 完整網格
+# python benchmarks/run_benchmarks.py --quick         # 只跑最小一格
+# python benchmarks/run_benchmarks.py --save-baseline # 在舊版本上跑一次，存成本機基準
+# python benchmarks/run_benchmarks.py --baseline      # 改完程式後在同一台機器上與本機基準比較，變慢就 exit 1
+# 基準與每次的結果都存在 benchmarks/results/ (不納入版控)：秒數與機器有關，別台機器的基準比較沒有意義
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "results")
+BASELINE_PATH = os.path.join(RESULTS_DIR, "baseline.json")
+
+PRODUCTS = [200, 1000, 5000]
+UNDERLYINGS = [20, 200]
+YEARS = [1, 3]
+STAGES = ["ingest", "prices_cold", "prices_warm", "evaluate", "evaluate_resume", "notify", "render", "stress"]
+TODAY = pd.Timestamp("2026-06-30 15:00")
+
+
+def case_key(case):
+    return f"p{case['products']}_u{case['underlyings']}_y{case['years']}"
+
+
+def _timed(timings, stage, fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    timings[stage] = time.perf_counter() - t0
+    return out
+
+
+def _book_bytes(df):
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def render_page(results, page_size=100):
+    # 與畫面相同：型別表格 → 篩選 → 取一頁 → 轉成送給瀏覽器的 Arrow 表
+    import pyarrow as pa
+    df = results_frame(results)
+    page_df, _ = page_slice(filter_results(df), 1, page_size)
+    return pa.Table.from_pandas(page_df[table_columns(page_df)], preserve_index=False)
+
+
+def run_case(n_products, n_underlyings, years, workdir, seed=0):
+    # 準備資料 (不計時)：部位表與股價檔都依參數決定，重跑結果一致
+    universe = make_universe(n_underlyings)
+    start = TODAY.normalize() - pd.DateOffset(years=years)
+    span = max((TODAY.normalize() - start).days - 30, 1)
+    sheet = make_position_sheet(n_products, seed=seed, tickers=universe, trade_start=start, trade_span_days=span)
+    book = _book_bytes(sheet)
+    codes = clean_ticker_series(pd.Series(universe)).tolist()
+    fixtures = write_price_fixtures(os.path.join(workdir, "prices"),
+                                    make_price_history(codes, start - pd.Timedelta(days=14), TODAY, seed=seed))
+
+    timings = {}
+    clean_df, _ = _timed(timings, "ingest", read_book_stream, book)
+    tickers = collect_tickers(clean_df)
+    start_date = download_windows(clean_df, TODAY)
+
+    store = PriceStore(os.path.join(workdir, "prices.sqlite"), provider=CsvProvider(fixtures))
+    _timed(timings, "prices_cold", fetch_history, store, tickers, start_date, TODAY)
+    history = _timed(timings, "prices_warm", fetch_history, store, tickers, start_date, TODAY)
+
+    products, barrier_results = _timed(timings, "evaluate", prepare_products, clean_df, history, TODAY)
+    state_store = BarrierStateStore(os.path.join(workdir, "state.sqlite"))
+    prepare_products(clean_df, history, TODAY, state_store)  # 先存檢查點
+    _timed(timings, "evaluate_resume", prepare_products, clean_df, history, TODAY, state_store)
+
+    results, _, _ = _timed(timings, "notify", build_notifications, products, barrier_results, TODAY)
+    _timed(timings, "render", render_page, results)
+    _timed(timings, "stress", stress_book, products, barrier_results, shock_matrix(tickers, shock_levels()), TODAY)
+    return timings
+
+
+def run_grid(cases, repeat=1):
+    # 先跑一個小案例暖機 (載入 openpyxl 等模組)，否則第一格的讀檔時間含一次性成本，與基準比較會誤報
+    with tempfile.TemporaryDirectory() as workdir: run_case(20, 5, 1, workdir)
+    rows = []
+    for case in cases:
+        best = {}
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as workdir:
+                t = run_case(case['products'], case['underlyings'], case['years'], workdir)
+            best = {s: min(best.get(s, np.inf), t[s]) for s in STAGES}
+        rows.append({**case, 'key': case_key(case), 'seconds': best})
+        print(f"{case_key(case):>16} | " + " | ".join(f"{s} {best[s]:7.3f}s" for s in STAGES), flush=True)
+    return rows
+
+
+def compare(rows, baseline, tolerance, min_seconds):
+    # 比基準慢 tolerance 倍以上 (且差距超過 min_seconds，避免微秒級雜訊) 才算退步
+    base = {r['key']: r['seconds'] for r in baseline['cases']}
+    regressions = []
+    for r in rows:
+        if r['key'] not in base: continue
+        for s, sec in r['seconds'].items():
+            old = base[r['key']].get(s)
+            if old is None: continue
+            if sec > old * tolerance and sec - old > min_seconds:
+                regressions.append(f"{r['key']} {s}: {old:.3f}s → {sec:.3f}s ({sec / old:.1f}x)")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ELN 全流程離線壓測")
+    parser.add_argument("--products", type=int, nargs="+", default=PRODUCTS)
+    parser.add_argument("--underlyings", type=int, nargs="+", default=UNDERLYINGS)
+    parser.add_argument("--years", type=int, nargs="+", default=YEARS)
+    parser.add_argument("--quick", action="store_true", help="只跑最小一格 (冒煙測試)")
+    parser.add_argument("--repeat", type=int, default=1, help="每格重跑幾次取最快")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_PATH, metavar="JSON",
+                        help=f"與基準結果比較 (不給路徑時用 {os.path.relpath(BASELINE_PATH)})")
+    parser.add_argument("--save-baseline", action="store_true", help=f"結果另存為 {os.path.relpath(BASELINE_PATH)}")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="比基準慢幾倍視為退步")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="差距小於此秒數不算退步")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.baseline and not os.path.exists(args.baseline):
+        print(f"❌ 找不到基準 {os.path.relpath(args.baseline)}：請先在改動前的版本執行 --save-baseline")
+        return 2
+    if args.quick: args.products, args.underlyings, args.years = PRODUCTS[:1], UNDERLYINGS[:1], YEARS[:1]
+    cases = [{'products': p, 'underlyings': u, 'years': y}
+             for p, u, y in itertools.product(args.products, args.underlyings, args.years)]
+
+    rows = run_grid(cases, args.repeat)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+        'machine': platform.machine(), 'repeat': args.repeat, 'cases': rows,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out_path = os.path.join(RESULTS_DIR, f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    for path in [out_path] + ([BASELINE_PATH] if args.save_baseline else []):
+        with open(path, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"💾 {os.path.relpath(path)}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f: baseline = json.load(f)
+        env = {k: report[k] for k in ('python', 'pandas', 'numpy', 'machine')}
+        diff = {k: (baseline.get(k), v) for k, v in env.items() if baseline.get(k) != v}
+        if diff: print("⚠️ 基準的執行環境不同，結果僅供參考: " + ", ".join(f"{k} {a} → {b}" for k, (a, b) in diff.items()))
+        regressions = compare(rows, baseline, args.tolerance, args.min_seconds)
+        for line in regressions: print(f"❌ 變慢: {line}")
+        if regressions: return 1
+        print("✅ 與基準相比沒有退步")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
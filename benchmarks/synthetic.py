@@ -0,0 +1,91 @@
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 🧪 合成部位表 / 股價 (離線壓測用)
+# ==========================================
+
+RAW_TICKERS = [
+    "AAPL UW", "NVDA UQ", "TSLA US", "MSFT UN", "UNH US", "JPM UN", "AMZN UQ", "META UW",
+    "2330 TT", "2317 TT", "7203 JT", "6758 JT", "0700 HK", "9988 HK", "QQQ UP", "SPY",
+]
+
+# 表頭版型：standard 為一般部位表；subheader 第一列多一行「進場價」副表頭；
+# positional 只有「標的1」有名稱，其餘標的靠相鄰位置推算
+LAYOUTS = ("standard", "subheader", "positional")
+
+
+def make_universe(n_underlyings):
+    # 前 16 檔用真實代號，不夠再依美/台/日/港輪流補合成代號
+    tickers = RAW_TICKERS[:n_underlyings]
+    suffixes = ["US", "TT", "JT", "HK"]
+    n = 0
+    while len(tickers) < n_underlyings:
+        sfx = suffixes[n % 4]
+        tickers.append(f"SYN{n:04d} US" if sfx == "US" else f"{8000 + n} {sfx}")
+        n += 1
+    return tickers
+
+
+def make_position_sheet(n_rows, seed=0, tickers=None, n_assets=5, layout="standard",
+                        trade_start="2021-01-04", trade_span_days=1500):
+    # 欄位順序與常見 FCN/DRA 部位表相同：標的i 後面緊接 進場價i
+    if layout not in LAYOUTS: raise ValueError(f"unknown layout: {layout}")
+    rng = np.random.default_rng(seed)
+    tickers = list(tickers or RAW_TICKERS)
+    trade = pd.Timestamp(trade_start) + pd.to_timedelta(rng.integers(0, trade_span_days, n_rows), unit="D")
+
+    sheet = {
+        "債券代號": [f"ELN{n:06d}" for n in range(n_rows)],
+        "商品類型": rng.choice(["FCN", "DRA", "fcn"], n_rows),
+        "理專": rng.choice(["王小明", "李四 ", "", None, "nan", "Amy Chen"], n_rows),
+        "Email": rng.choice(["a@x.com", "b@x.com;c@x.com", "", "d@x.com，e@x.com"], n_rows),
+        "交易日": trade,
+        "發行日": trade + pd.Timedelta(days=7),
+        "天期": rng.choice(["6M", "1Y", "12", "9 m", "2y", None, "18M"], n_rows),
+        "執行價": rng.choice(["80%", "85", "90%", "1,00%", None, 75.0], n_rows),
+        "KO價": rng.choice(["100%", "103%", 98, "", "abc"], n_rows),
+        "KI價": rng.choice(["60%", "65%", 55.5, None], n_rows),
+        "KO類型": rng.choice(["NC3", "NC 1", "Daily", "", None, "lock:6", "Non-Call 2"], n_rows),
+        "KI類型": rng.choice(["AKI", "EKI"], n_rows),
+    }
+    n_used = rng.integers(1, n_assets + 1, n_rows)
+    for i in range(n_assets):
+        codes = rng.choice(tickers, n_rows).astype(object)
+        codes[n_used <= i] = None
+        sheet[f"標的{i+1}"] = codes
+        sheet[f"進場價{i+1}"] = [None] * n_rows
+    df = pd.DataFrame(sheet)
+
+    if layout == "positional":
+        df = df.rename(columns={f"標的{i+1}": f"Underlying {i+1}" for i in range(1, n_assets)})
+    elif layout == "subheader":
+        sub = pd.DataFrame([{c: ("進場價" if c.startswith("進場價") else None) for c in df.columns}])
+        df = pd.concat([sub, df], ignore_index=True)
+    return df
+
+
+def make_price_history(tickers, start, end, seed=0, gap_rate=0.02):
+    # 每檔代號的亂數種子由代號決定，擴大標的池不會改變既有代號的走勢
+    days = pd.bdate_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize())
+    cols = {}
+    for t in tickers:
+        rng = np.random.default_rng([seed, zlib.crc32(t.encode("utf-8"))])
+        vol = rng.uniform(0.15, 0.6) / np.sqrt(252)
+        steps = rng.normal(-0.5 * vol * vol, vol, len(days))
+        px = rng.uniform(20, 800) * np.exp(np.cumsum(steps))
+        px[rng.random(len(days)) < gap_rate] = np.nan  # 各市場假日不同
+        cols[t] = px.round(2)
+    return pd.DataFrame(cols, index=days)
+
+
+def write_price_fixtures(folder, history):
+    # 輸出成 CsvProvider 讀的格式：<代號>.csv (Date, Close)
+    os.makedirs(folder, exist_ok=True)
+    for t in history.columns:
+        s = history[t].dropna()
+        s.rename_axis("Date").rename("Close").to_csv(os.path.join(folder, f"{t}.csv"))
+    return folder
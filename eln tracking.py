@@ -1,12 +1,24 @@
+import time
+SCRIPT_T0 = time.perf_counter()  # 本次執行的起點 (載入模組 / 第一列結果的計時基準)
+import sys
+COLD_START = 'eln.engine' not in sys.modules  # 這個 process 第一次跑
 import streamlit as st
+import numpy as np
 import pandas as pd
-import yfinance as yf
-from datetime import datetime, timedelta
-import re
-from dateutil.relativedelta import relativedelta
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from datetime import datetime
+import hashlib
+import os
+
+# 只載入畫面一開始就要用的模組；寄信、壓力測試、蒙地卡羅、盤中監控、匯出用到時才 import
+from eln.books import books_download_windows, flatten, iter_backtest, notify_books, plan_books, union_tickers
+from eln.engine import (MAX_ASSETS, admin_subject, admin_summary_text, build_notifications, fetch_history,
+                        filter_results, notified_products, page_count, page_slice, results_frame, table_columns,
+                        underlying_codes)
+from eln.reader import read_book_stream
+from eln.prices import PriceStore, report_frame
+from eln.metrics import RunMetrics, RunProfiler, profiler_kinds
+from eln.state import DEFAULT_STATE_PATH
+IMPORTS_DONE = time.perf_counter()
 
 # --- 設定網頁 ---
 st.set_page_config(page_title="ELN 智能戰情室 (Email 旗艦版)", layout="wide")
@@ -19,19 +31,29 @@ try:
     GMAIL_PASSWORD = st.secrets.get("GMAIL_PASSWORD", "")
     # 如果沒設定 Admin Email，就預設寄回給寄件者自己
     ADMIN_EMAIL = st.secrets.get("ADMIN_EMAIL", GMAIL_ACCOUNT)
+    # 寄信併發數與速率 (Gmail 建議保守設定)
+    SMTP_WORKERS = int(st.secrets.get("SMTP_WORKERS", 3))
+    SMTP_RATE_PER_SEC = float(st.secrets.get("SMTP_RATE_PER_SEC", 2.0))
+    # 選填：各階段耗時寫到 JSON lines / Prometheus textfile 給監控收集
+    METRICS_JSONL = st.secrets.get("METRICS_JSONL", "")
+    METRICS_PROM = st.secrets.get("METRICS_PROM", "")
 except Exception:
     st.error("⚠️ Secrets 設定讀取異常，Email 功能可能無法使用。")
     GMAIL_ACCOUNT = ""
     GMAIL_PASSWORD = ""
     ADMIN_EMAIL = ""
+    SMTP_WORKERS = 3
+    SMTP_RATE_PER_SEC = 2.0
+    METRICS_JSONL = ""
+    METRICS_PROM = ""
 
 # ==========================================
 # 🔄 狀態初始化
 # ==========================================
 if 'last_processed_file' not in st.session_state:
     st.session_state['last_processed_file'] = None
-if 'is_sent' not in st.session_state:
-    st.session_state['is_sent'] = False
+if 'run_ts' not in st.session_state:
+    st.session_state['run_ts'] = None
 
 # --- 側邊欄 ---
 with st.sidebar:
@@ -46,540 +68,464 @@ with st.sidebar:
     real_today = datetime.now()
     st.info(f"📅 今天日期：{real_today.strftime('%Y-%m-%d')}")
     st.caption("鎖定為真實日期")
+    if st.button("🔄 重新抓取最新股價", help="結果會快取到當天結束，按此重新下載並重算。"):
+        st.session_state['run_ts'] = None
+    read_all_sheets = st.checkbox("讀取所有工作表", value=False, help="Excel 有多個分頁時一併讀取 (認不出表頭的分頁會略過)。")
 
     st.markdown("---")
     st.header("🔔 通知過濾")
     lookback_days = st.slider("只通知幾天內發生的事件？", min_value=1, max_value=30, value=3)
     notify_ki_daily = st.checkbox("KI/DRA 是否每天提醒？", value=True, help="打勾：持續跌破/暫停計息期間每天都會通知。")
+    digest_mode = st.checkbox("同一收件人彙整成一封", value=True, help="理專負責多檔商品時只收到一封彙整信，而不是每檔一封。")
 
-    st.info("💡 **Email 版功能**\n✅ UNH/US 代號修復\n✅ DRA 每日計息支援\n✅ NC 智慧判讀\n✅ 管理員摘要優先發送")
-
-# --- 函數區 ---
-
-# 🌟 [修復版] 代號清洗器 (支援 US 結尾)
-def clean_ticker_symbol(ticker):
-    if pd.isna(ticker): return ""
-    t = str(ticker).strip().upper()
-    
-    # 使用 Regex 移除美股常見後綴 (包含 US)
-    t = re.sub(r'\s+(UW|UN|UQ|UP|US)$', '', t)
-    
-    # 其他國家後綴轉換
-    if t.endswith(" JT"): return t.replace(" JT", ".T") 
-    if t.endswith(" TT"): return t.replace(" TT", ".TW") 
-    if t.endswith(" HK"): return t.replace(" HK", ".HK") 
-    return t
-
-def send_email_gmail(to_email, subject, body_text):
-    if not GMAIL_ACCOUNT or not GMAIL_PASSWORD or not to_email: return False
-    if "@" not in str(to_email): return False
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = GMAIL_ACCOUNT
-        msg['To'] = str(to_email).strip()
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body_text, 'plain'))
-
-        server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        server.login(GMAIL_ACCOUNT, GMAIL_PASSWORD)
-        server.send_message(msg)
-        server.quit()
-        return True
-    except Exception as e:
-        print(f"Email 發送失敗 ({to_email}): {e}")
-        return False
-
-# 🌟 NC 智慧判讀
-def parse_nc_months(ko_type_val):
-    s = str(ko_type_val).upper().strip()
-    if pd.isna(ko_type_val) or s == "" or s == "NAN": return 1 
-    match = re.search(r'(?:NC|LOCK|NON-CALL)\s*[:\-]?\s*(\d+)', s)
-    if match: return int(match.group(1))
-    if "DAILY" in s: return 1
-    return 1
-
-# 🌟 自動推算到期日
-def calculate_maturity(row, issue_date_col, tenure_col):
-    if 'MaturityDate' in row and pd.notna(row['MaturityDate']):
-        return row['MaturityDate']
-    
-    issue_date = row.get(issue_date_col)
-    tenure_str = str(row.get(tenure_col, ""))
-    
-    if pd.isna(issue_date) or issue_date == pd.NaT:
-        return pd.NaT
-        
-    try:
-        months_to_add = 0
-        match_m = re.search(r'(\d+)\s*M', tenure_str, re.IGNORECASE)
-        match_y = re.search(r'(\d+)\s*Y', tenure_str, re.IGNORECASE)
-        
-        if match_m:
-            months_to_add = int(match_m.group(1))
-        elif match_y:
-            months_to_add = int(match_y.group(1)) * 12
-        elif tenure_str.isdigit():
-            months_to_add = int(tenure_str)
-        
-        if months_to_add > 0:
-            return issue_date + relativedelta(months=months_to_add)
-    except: pass
-    return pd.NaT
+    st.markdown("---")
+    st.header("🎲 機率試算")
+    mc_enabled = st.checkbox("蒙地卡羅 KO/KI/接股機率", value=False, help="以歷史波動度與相關係數模擬未來路徑，結果加在監控列表。")
+    mc_paths = st.select_slider("模擬路徑數", options=[500, 1000, 2000, 5000, 10000], value=2000, disabled=not mc_enabled)
+    mc_seed = st.number_input("亂數種子", min_value=0, value=0, step=1, disabled=not mc_enabled)
 
-def clean_percentage(val):
-    if pd.isna(val) or str(val).strip() == "": return None
-    try:
-        s = str(val).replace('%', '').replace(',', '').strip()
-        return float(s)
-    except: return None
-
-def clean_name_str(val):
-    if pd.isna(val): return "貴賓"
-    s = str(val).strip()
-    if s.lower() == 'nan' or s == "": return "貴賓"
-    return s
-
-# 🌟 升級版欄位搜尋 (無視空格)
-def find_col_index(columns, include_keywords, exclude_keywords=None):
-    for idx, col_name in enumerate(columns):
-        col_str = str(col_name).strip().lower().replace(" ", "")
-        if exclude_keywords:
-            if any(ex in col_str for ex in exclude_keywords): continue
-        if any(inc in col_str for inc in include_keywords):
-            return idx, col_name
-    return None, None
+    st.markdown("---")
+    st.header("📡 盤中監控")
+    watch_enabled = st.checkbox("定時輪詢最新報價", value=False, help="只重算報價穿越 KO/KI/執行價的商品，新狀態即時列出。")
+    watch_interval = st.select_slider("輪詢間隔 (秒)", options=[30, 60, 120, 300], value=60, disabled=not watch_enabled)
 
-# --- 主畫面 ---
-st.title("📊 ELN 智能戰情室 - Email 旗艦版")
+    st.markdown("---")
+    with st.expander("⏱️ 執行效能", expanded=False):
+        profile_kind = st.selectbox("效能剖析", ["關閉"] + profiler_kinds(), help="記錄整次執行的呼叫細節，完成後可下載。")
+        metrics_slot = st.container()
 
-uploaded_file = st.file_uploader("請上傳 Excel (支援 FCN/DRA, 新舊格式)", type=['xlsx', 'csv'], key="uploader")
+    st.info("💡 **Email 版功能**\n✅ UNH/US 代號修復\n✅ DRA 每日計息支援\n✅ NC 智慧判讀\n✅ 管理員摘要優先發送")
 
-if uploaded_file:
-    if st.session_state['last_processed_file'] != uploaded_file.name:
-        st.session_state['last_processed_file'] = uploaded_file.name
-        st.session_state['is_sent'] = False
+# --- 函數區 ---
 
-if uploaded_file is not None:
-    try:
-        try:
-            df = pd.read_excel(uploaded_file, sheet_name=0, header=0, engine='openpyxl')
-        except:
-            uploaded_file.seek(0)
-            df = pd.read_csv(uploaded_file)
-
-        df = df.dropna(how='all')
-        if df.iloc[0].astype(str).str.contains("進場價").any():
-            df = df.iloc[1:].reset_index(drop=True)
-            
-        cols = df.columns.tolist()
-        
-        # 欄位定位
-        id_idx, _ = find_col_index(cols, ["債券", "代號", "id", "商品代號"]) or (0, "")
-        type_idx, _ = find_col_index(cols, ["商品類型", "ProductType", "type"], exclude_keywords=["ko", "ki"]) 
-        strike_idx, _ = find_col_index(cols, ["strike", "執行", "履約"])
-        ko_idx, _ = find_col_index(cols, ["ko", "提前"], exclude_keywords=["strike", "執行", "ki", "type"])
-        ko_type_idx, _ = find_col_index(cols, ["ko類型", "kotype"]) or find_col_index(cols, ["類型", "type"], exclude_keywords=["ki", "ko", "商品"])
-        ki_idx, _ = find_col_index(cols, ["ki", "下檔"], exclude_keywords=["ko", "type"])
-        ki_type_idx, _ = find_col_index(cols, ["ki類型", "kitype"])
-        t1_idx, _ = find_col_index(cols, ["標的1", "ticker1"])
-        
-        trade_date_idx, _ = find_col_index(cols, ["交易日"])
-        issue_date_idx, _ = find_col_index(cols, ["發行日"])
-        final_date_idx, _ = find_col_index(cols, ["最終", "評價"])
-        maturity_date_idx, _ = find_col_index(cols, ["到期", "maturity"])
-        tenure_idx, _ = find_col_index(cols, ["天期", "term", "tenure"])
-        
-        name_idx, _ = find_col_index(cols, ["理專", "姓名", "客戶"])
-        email_idx, email_col_name = find_col_index(cols, ["email", "e-mail", "mail", "信箱"])
+def get_mailer():
+    from eln.mailer import Mailer
+    return Mailer(GMAIL_ACCOUNT, GMAIL_PASSWORD, workers=SMTP_WORKERS, rate_per_sec=SMTP_RATE_PER_SEC)
 
-        if email_idx is not None:
-            st.toast(f"✅ 成功辨識 Email 欄位: {email_col_name}", icon="✉️")
+@st.cache_resource
+def get_outbox_worker():
+    # 整個 server 共用一個寄信佇列與背景寄送執行緒，不隨重跑或分頁關閉消失
+    from eln.outbox import Outbox, OutboxWorker
+    return OutboxWorker(Outbox(), get_mailer)
 
-        if t1_idx is None:
-            st.error("❌ 無法辨識「標的1」欄位，請檢查 Excel 表頭。")
-            st.stop()
+@st.cache_resource
+def get_symbol_master():
+    # 代號主檔：手動對照與「已知無資料」紀錄跨重跑、跨分頁共用
+    from eln.symbols import SymbolMaster
+    return SymbolMaster()
 
-        # 建立資料表
-        clean_df = pd.DataFrame()
-        clean_df['ID'] = df.iloc[:, id_idx]
-        if name_idx is not None: clean_df['Name'] = df.iloc[:, name_idx].apply(clean_name_str)
-        else: clean_df['Name'] = "貴賓"
-        
-        if email_idx is not None: 
-            clean_df['Email'] = df.iloc[:, email_idx].astype(str).replace('nan', '').str.strip()
-        else: 
-            clean_df['Email'] = ""
-        
-        # 抓取商品類型
-        if type_idx is not None:
-            clean_df['Product_Type'] = df.iloc[:, type_idx].astype(str).fillna("FCN")
+# ==========================================
+# ⚡ 分段快取 (以檔案內容雜湊為 key)
+# ==========================================
+# Streamlit 每次互動都會重跑整支程式，各階段依其相依參數快取：
+# 讀檔 (每個部位檔各自快取) → 股價 (全部部位檔的標的聯集抓一次) → 回測 → 通知過濾。
+# 拉 slider 只會重算最後的通知過濾。回測結果放 session_state，第一次算時邊算邊顯示。
+# 運算邏輯都在 eln.engine，這裡只負責快取與畫面。
+
+@st.cache_data(show_spinner="📥 讀取 Excel...", max_entries=8)
+def stage_ingest(file_hash, all_sheets, _file_bytes):
+    return read_book_stream(_file_bytes, all_sheets=all_sheets)
+
+
+@st.cache_data(show_spinner="⏳ 下載股價...", max_entries=8)
+def stage_prices(windows, run_ts):
+    # windows: ((代號, 起始日), ...)，每個代號只抓自己需要的區間
+    # 已知沒有資料的代號 (代號主檔) 不請求
+    price_store = PriceStore()
+    history_data = fetch_history(price_store, [t for t, _ in windows], dict(windows), run_ts, get_symbol_master())
+    return history_data, price_store.last_download_rows, price_store.last_report
+
+
+PREVIEW_ROWS = 200
+
+
+def stage_evaluate(data_key, run_ts, books, history_data, lookback_days, notify_ki_daily, metrics):
+    # 同一組部位 (data_key)、同一個 run_ts 只回測一次；第一次時一批一批算，
+    # 已到期 / 已出場 / KI 已破的商品先算先顯示，並即時更新進度
+    eval_key = (data_key, run_ts)
+    if st.session_state.get('eval_key') == eval_key:
+        return st.session_state['evaluated']
+
+    planned = plan_books(books, history_data, run_ts)
+    total = sum(len(p) for p in planned.values())
+    barriers = {book: [None] * len(p) for book, p in planned.items()}
+    bar = st.progress(0.0, text=f"⚙️ 回測中... 0 / {total} 檔")
+    preview = st.empty()
+    rows = []
+    done = 0
+    for book, positions, barrier_results in iter_backtest(planned, history_data, run_ts, DEFAULT_STATE_PATH):
+        for i, r in zip(positions, barrier_results): barriers[book][i] = r
+        done += len(positions)
+        bar.progress(done / total, text=f"⚙️ 回測中... {done} / {total} 檔")
+        if len(rows) >= PREVIEW_ROWS: continue
+        batch_rows, _, _ = build_notifications([planned[book][i] for i in positions], barrier_results, run_ts,
+                                               lookback_days, notify_ki_daily)
+        for r in batch_rows: r['Book'] = book
+        rows += batch_rows
+        preview_df = results_frame(rows[:PREVIEW_ROWS])
+        preview.dataframe(preview_df[table_columns(preview_df)], column_config=table_column_config(), hide_index=True,
+                          use_container_width=True)
+        metrics.mark("first_row")
+    bar.empty()
+    preview.empty()
+
+    evaluated = {book: (planned[book], barriers[book]) for book in books}
+    st.session_state['eval_key'] = eval_key
+    st.session_state['evaluated'] = evaluated
+    return evaluated
+
+
+@st.cache_data(max_entries=32)
+def stage_notify(data_key, run_ts, lookback_days, notify_ki_daily, digest, _evaluated):
+    return notify_books(_evaluated, run_ts, lookback_days, notify_ki_daily, digest)
+
+
+@st.cache_data(show_spinner="🎲 蒙地卡羅模擬中...", max_entries=8)
+def stage_montecarlo(data_key, run_ts, n_paths, seed, _products, _barrier_results, _history_data):
+    from eln.montecarlo import simulate_probabilities
+    return simulate_probabilities(_products, _barrier_results, _history_data, run_ts, n_paths, seed)
+
+
+@st.cache_data(max_entries=32)
+def stage_table(data_key, run_ts, lookback_days, notify_ki_daily, _results):
+    return results_frame(_results)
+
+
+def table_column_config():
+    # 原生欄位格式取代 Styler：數字保持數字，只在前端格式化
+    cfg = {
+        '燈號': st.column_config.TextColumn("", width="small"),
+        '狀態分類': st.column_config.TextColumn("狀態"),
+        '最差表現%': st.column_config.NumberColumn("最差表現", format="%.2f%%"),
+        'KO機率%': st.column_config.NumberColumn("KO機率", format="%.1f%%", help="蒙地卡羅估計的提前出場機率"),
+        'KI機率%': st.column_config.NumberColumn("KI機率", format="%.1f%%", help="到期前 (或到期時) 跌破 KI 的機率"),
+        '接股機率%': st.column_config.NumberColumn("接股機率", format="%.1f%%", help="到期時以股票交割的機率"),
+        'KI已破': st.column_config.CheckboxColumn("KI已破"),
+        'DRA暫停': st.column_config.CheckboxColumn("DRA暫停"),
+        '交易日': st.column_config.DateColumn("交易日", format="YYYY-MM-DD"),
+        '狀態': st.column_config.TextColumn("狀態說明"),
+    }
+    for i in range(1, MAX_ASSETS + 1):
+        cfg[f'T{i}_Code'] = st.column_config.TextColumn(f"標的{i}")
+        cfg[f'T{i}_Perf'] = st.column_config.NumberColumn(f"表現{i}", format="%.2f%%")
+        cfg[f'T{i}_Price'] = st.column_config.NumberColumn(f"現價{i}", format="%.2f")
+        cfg[f'T{i}_Flag'] = st.column_config.TextColumn(f"KO/KI {i}")
+    return cfg
+
+
+def show_metrics(metrics, profiler):
+    # 側邊欄「執行效能」：本次各階段耗時與筆數 (快取命中的階段會接近 0 秒)
+    if METRICS_JSONL: metrics.write_jsonl(METRICS_JSONL)
+    if METRICS_PROM: metrics.write_prometheus(METRICS_PROM)
+    with metrics_slot:
+        st.caption(f"本次重跑共 {metrics.total_seconds():.2f} 秒")
+        m = metrics.marks
+        if 'table' in m:
+            st.caption(f"{'冷啟動' if COLD_START else '重跑'}：載入模組 {m['imports']:.2f}s，"
+                       f"第一列 {m['first_row']:.2f}s，完整表格 {m['table']:.2f}s")
+        st.dataframe(metrics.to_frame().round({'seconds': 3}), hide_index=True, use_container_width=True)
+        if profiler is not None:
+            profiler.stop()
+            file_name, data, mime = profiler.report()
+            st.download_button("🔬 下載效能剖析", data, file_name=file_name, mime=mime)
+
+
+def watch_panel(watch_key, products, barrier_results, tickers, run_ts, lookback_days, notify_ki_daily):
+    from eln.watch import IntradayWatcher, YahooQuoteFeed
+    # 以 st.fragment 定時重跑：watcher 留在 session_state，每次只處理這一輪的報價變動
+    if st.session_state.get('watch_key') != watch_key:
+        st.session_state['watch_key'] = watch_key
+        st.session_state['watcher'] = IntradayWatcher(products, barrier_results, run_ts, lookback_days, notify_ki_daily)
+        st.session_state['watch_events'] = []
+    watcher = st.session_state['watcher']
+    ts, quotes = YahooQuoteFeed(tickers).poll()
+    before = watcher.evaluations
+    events = watcher.on_quotes(quotes, ts)
+    st.session_state['watch_events'] = events + st.session_state['watch_events']
+    st.caption(f"最後更新 {ts.strftime('%H:%M:%S')}：{len(quotes)}/{len(tickers)} 檔報價，本輪重算 "
+               f"{watcher.evaluations - before} 檔商品，累計 {len(st.session_state['watch_events'])} 則事件")
+    if st.session_state['watch_events']:
+        st.dataframe(pd.DataFrame([{'時間': e['ts'], '債券代號': e['id'], 'Name': e['name'], '狀態': e['status']}
+                                   for e in st.session_state['watch_events']]), hide_index=True, use_container_width=True)
+
+
+def outbox_panel(batch):
+    # 以 st.fragment 定時重跑：只讀佇列進度，寄送在背景執行緒進行，畫面不會卡住
+    worker = get_outbox_worker()
+    progress = worker.outbox.progress(batch)
+    if not progress['total']: return
+    done = progress['sent'] + progress['failed']
+    if progress['pending'] or progress['sending']:
+        if not worker.running: worker.start()
+        st.progress(done / progress['total'], text=f"📤 背景寄送中... ({done}/{progress['total']})，關閉分頁也會繼續寄")
+    else:
+        st.success(f"✅ 今日已寄出 {progress['sent']} 封信件" + (f"，{progress['failed']} 封失敗" if progress['failed'] else ""))
+    if progress['failed']:
+        with st.expander(f"⚠️ {progress['failed']} 封寄送失敗"):
+            st.dataframe(pd.DataFrame(worker.outbox.failures(batch)), use_container_width=True)
+            if st.button("🔁 重試失敗的信件"):
+                worker.outbox.retry_failed(batch)
+                worker.start()
+                st.rerun(scope="fragment")
+    if worker.last_error: st.caption(f"上次寄送中斷：{worker.last_error}")
+
+
+def symbols_panel():
+    # 資料品質：確認沒有資料而暫時略過的代號，以及手動對照 (存檔後以新的對照重新抓價)
+    master = get_symbol_master()
+    bad = master.quality_frame()
+    skipping = int((bad['狀態'] == '略過中').sum())
+    with st.expander("🩺 代號資料品質" + (f"：{skipping} 檔已知無資料，暫停抓取" if skipping else ""), expanded=False):
+        if bad.empty:
+            st.caption("沒有已知無資料的代號。")
         else:
-            clean_df['Product_Type'] = "FCN"
-
-        clean_df['TradeDate'] = pd.to_datetime(df.iloc[:, trade_date_idx], errors='coerce') if trade_date_idx else pd.NaT
-        clean_df['IssueDate'] = pd.to_datetime(df.iloc[:, issue_date_idx], errors='coerce') if issue_date_idx else pd.Timestamp.min
-        
-        if maturity_date_idx: clean_df['MaturityDate'] = pd.to_datetime(df.iloc[:, maturity_date_idx], errors='coerce')
-        else: clean_df['MaturityDate'] = pd.NaT
-            
-        clean_df['ValuationDate'] = pd.to_datetime(df.iloc[:, final_date_idx], errors='coerce') if final_date_idx else pd.NaT
-        clean_df['TenureStr'] = df.iloc[:, tenure_idx] if tenure_idx else ""
-
-        # 自動推算日期
-        for idx, row in clean_df.iterrows():
-            if pd.isna(row['MaturityDate']):
-                calc_date = calculate_maturity(row, 'IssueDate', 'TenureStr')
-                clean_df.at[idx, 'MaturityDate'] = calc_date
-                if pd.isna(row['ValuationDate']): clean_df.at[idx, 'ValuationDate'] = calc_date
-
-        def calc_tenure_display(row):
-            if row['TenureStr'] != "": return str(row['TenureStr'])
-            if pd.notna(row['MaturityDate']) and pd.notna(row['IssueDate']):
-                days = (row['MaturityDate'] - row['IssueDate']).days
-                return f"{int(round(days/30))}M" 
-            return "-"
-        clean_df['Tenure'] = clean_df.apply(calc_tenure_display, axis=1)
-
-        # 參數處理
-        clean_df['KO_Pct'] = df.iloc[:, ko_idx].apply(clean_percentage)
-        clean_df['KI_Pct'] = df.iloc[:, ki_idx].apply(clean_percentage)
-        clean_df['Strike_Pct'] = df.iloc[:, strike_idx].apply(clean_percentage) if strike_idx else 100.0
-        
-        clean_df['KO_Type'] = df.iloc[:, ko_type_idx] if ko_type_idx else "NC1" 
-        clean_df['KI_Type'] = df.iloc[:, ki_type_idx] if ki_type_idx else "AKI"
-
-        # 標的代號與初始價處理
-        for i in range(1, 6):
-            if i == 1: tx_idx = t1_idx
-            else:
-                tx_idx, _ = find_col_index(cols, [f"標的{i}"])
-                if tx_idx is None: 
-                    possible_idx = t1_idx + (i-1)*2
-                    if possible_idx < len(df.columns): tx_idx = possible_idx
-            
-            if tx_idx is not None and tx_idx < len(df.columns):
-                raw_ticker = df.iloc[:, tx_idx]
-                clean_df[f'T{i}_Code'] = raw_ticker.apply(clean_ticker_symbol)
-                
-                # 自動補價邏輯
-                if tx_idx + 1 < len(df.columns):
-                    sample_val = df.iloc[0, tx_idx+1]
-                    try:
-                        float(sample_val)
-                        clean_df[f'T{i}_Initial'] = pd.to_numeric(df.iloc[:, tx_idx + 1], errors='coerce').fillna(0)
-                    except:
-                        clean_df[f'T{i}_Initial'] = 0
-                else:
-                    clean_df[f'T{i}_Initial'] = 0
-            else:
-                clean_df[f'T{i}_Code'] = ""
-                clean_df[f'T{i}_Initial'] = 0
+            st.caption(f"供應商確認沒有資料的代號 {master.ttl_days:g} 天內不再請求，之後自動重試。")
+            st.dataframe(bad, hide_index=True, use_container_width=True)
+            if st.button("🔁 立即重新檢查這些代號"):
+                master.recheck()
+                st.session_state['run_ts'] = None
+                st.rerun()
+        st.markdown("**手動對照** (原始代號或轉換後代號 → 正確的 Yahoo 代號)")
+        with st.form("symbol_overrides"):
+            edited = st.data_editor(master.overrides_frame()[['代號', '改用', '備註']], num_rows="dynamic",
+                                    hide_index=True, use_container_width=True)
+            if st.form_submit_button("💾 儲存對照並重新抓價"):
+                master.replace_overrides(edited[['代號', '改用', '備註']].fillna("").itertuples(index=False, name=None))
+                st.session_state['run_ts'] = None
+                st.rerun()
+
+
+# 上次沒寄完的佇列 (分頁關閉、重啟) 自動接著寄
+if GMAIL_ACCOUNT and GMAIL_PASSWORD:
+    outbox_backlog = get_outbox_worker().outbox.progress()
+    if outbox_backlog['pending'] or outbox_backlog['sending']:
+        get_outbox_worker().start()
+        st.sidebar.caption(f"📤 背景寄送中：尚有 {outbox_backlog['pending'] + outbox_backlog['sending']} 封")
 
-        clean_df = clean_df.dropna(subset=['ID'])
+# --- 主畫面 ---
+st.title("📊 ELN 智能戰情室 - Email 旗艦版")
 
-        # 4. 下載股價
-        today_ts = pd.Timestamp(real_today)
-        min_trade_date = clean_df['TradeDate'].min()
-        
-        if pd.isna(min_trade_date): start_download_date = today_ts - timedelta(days=30)
-        else: start_download_date = min_trade_date - timedelta(days=7)
+uploaded_files = st.file_uploader("請上傳 Excel (支援 FCN/DRA, 新舊格式，可一次多檔)", type=['xlsx', 'csv'],
+                                  key="uploader", accept_multiple_files=True)
+
+if uploaded_files:
+    # 部位檔名稱 (檔名去副檔名) → 內容；同名檔案加序號
+    file_blobs = {}
+    for f in uploaded_files:
+        name = base = os.path.splitext(f.name)[0]
+        n = 1
+        while name in file_blobs:
+            n += 1
+            name = f"{base} ({n})"
+        file_blobs[name] = f.getvalue()
+    file_hashes = {name: hashlib.sha256(blob).hexdigest() for name, blob in file_blobs.items()}
+    file_hash = hashlib.sha256("|".join(f"{n}:{h}" for n, h in file_hashes.items()).encode("utf-8")).hexdigest()
+    if st.session_state['last_processed_file'] != file_hash:
+        st.session_state['last_processed_file'] = file_hash
+        st.session_state['run_ts'] = None
+    # 同一份檔案在同一天內固定使用第一次執行的時間點，重跑時才會命中快取
+    run_ts = st.session_state.get('run_ts')
+    if run_ts is None or run_ts.date() != real_today.date():
+        run_ts = pd.Timestamp(real_today)
+        st.session_state['run_ts'] = run_ts
+
+if uploaded_files:
+    metrics = RunMetrics(t0=SCRIPT_T0)
+    metrics.mark("imports", IMPORTS_DONE)
+    profiler = RunProfiler(profile_kind).start() if profile_kind != "關閉" else None
+    try:
+        books = {}
+        with metrics.stage("ingest") as rec:
+            for name, blob in file_blobs.items():
+                try:
+                    books[name], email_col_name = stage_ingest(file_hashes[name], read_all_sheets, blob)
+                except ValueError as e:
+                    st.error(f"{name}: {e}" if len(file_blobs) > 1 else str(e))
+                    continue
+                if email_col_name is not None:
+                    st.toast(f"✅ {name} 成功辨識 Email 欄位: {email_col_name}", icon="✉️")
+            rec['rows'] = sum(len(df) for df in books.values())
+            rec['books'] = len(books)
+        if not books:
+            st.stop()
+        # 代號主檔的手動對照在抓價前套用
+        books = {name: get_symbol_master().apply(df) for name, df in books.items()}
+        # 回測之後各階段的快取 key：同一組檔案但讀取工作表的方式或手動對照不同，讀進來的部位就不同
+        data_key = hashlib.sha256(repr((file_hash, read_all_sheets, sorted(get_symbol_master().overrides().items())))
+                                  .encode("utf-8")).hexdigest()
 
-        all_tickers = []
-        for i in range(1, 6):
-            if f'T{i}_Code' in clean_df.columns:
-                ts = clean_df[f'T{i}_Code'].dropna().unique().tolist()
-                all_tickers.extend([t for t in ts if t != ""])
-        all_tickers = list(set(all_tickers))
+        # 4. 下載股價 (所有部位檔的標的聯集，只抓一次)
+        windows = books_download_windows(books, run_ts)
+        all_tickers = union_tickers(books)
 
         if not all_tickers:
             st.error("❌ 找不到有效的標的代號。")
             st.stop()
 
-        st.info(f"⏳ 下載美股資料... ({start_download_date.strftime('%Y-%m-%d')} ~ 今日)")
+        st.info(f"⏳ 下載美股資料... ({min(windows.values()).strftime('%Y-%m-%d')} ~ 今日，各標的依其商品的交易日起抓)")
         
         try:
-            history_data = yf.download(all_tickers, start=start_download_date, end=today_ts + timedelta(days=1))['Close']
+            with metrics.stage("prices") as rec:
+                history_data, downloaded_rows, coverage = stage_prices(tuple((t, windows[t]) for t in all_tickers), run_ts)
+                rec['tickers'] = len(all_tickers)
+                rec['downloaded_rows'] = downloaded_rows
+                rec['price_bytes'] = history_data.nbytes
+                rec['missing_tickers'] = sum(1 for r in coverage if r['status'] == 'missing')
+            st.caption(f"💾 本地股價庫命中，本次僅下載 {downloaded_rows} 筆新資料")
         except Exception as e:
             st.error(f"美股連線失敗: {e}")
             st.stop()
 
-        # 5. 核心運算
-        results = []
-        individual_messages = [] 
-        admin_summary_list = []
-        lookback_date = today_ts - timedelta(days=lookback_days)
-
-        for index, row in clean_df.iterrows():
-            ko_thresh_val = row['KO_Pct'] if pd.notna(row['KO_Pct']) else 100.0
-            ki_thresh_val = row['KI_Pct'] if pd.notna(row['KI_Pct']) else 60.0
-            strike_thresh_val = row['Strike_Pct'] if pd.notna(row['Strike_Pct']) else 100.0
-            
-            ko_thresh = ko_thresh_val / 100.0
-            ki_thresh = ki_thresh_val / 100.0
-            strike_thresh = strike_thresh_val / 100.0
-            nc_months = parse_nc_months(row['KO_Type'])
-            nc_end_date = row['IssueDate'] + relativedelta(months=nc_months)
-            
-            is_dra = "DRA" in str(row['Product_Type']).upper()
-            
-            assets = []
-            
-            # 填入標的與自動抓價
-            for i in range(1, 6):
-                code = row.get(f'T{i}_Code', "")
-                if code == "": continue
-                
-                initial = float(row.get(f'T{i}_Initial', 0))
-                
-                if initial == 0:
-                    trade_date = row['TradeDate']
-                    if pd.notna(trade_date):
-                        try:
-                            if len(all_tickers) == 1: s = history_data
-                            else: s = history_data[code]
-                            price_on_trade = s[s.index >= trade_date].head(1)
-                            if not price_on_trade.empty:
-                                initial = float(price_on_trade.iloc[0])
-                        except: initial = 0
-                
-                if initial > 0:
-                    assets.append({
-                        'code': code, 'initial': initial, 'strike_price': initial * strike_thresh, 
-                        'locked_ko': False, 'hit_ki': False, 'perf': 0.0, 'price': 0.0,
-                        'ko_record': '', 'ki_record': ''
-                    })
-            
-            if not assets: continue
+        # 個別代號抓不到不會中斷，列出缺資料的代號與區間
+        gaps = report_frame(coverage)
+        if not gaps.empty:
+            with st.expander(f"⚠️ {len(gaps)} 檔標的股價不完整 (可按「重新抓取最新股價」重試)"):
+                st.dataframe(gaps, hide_index=True, use_container_width=True)
+        symbols_panel()
 
-            # 抓現價
-            for asset in assets:
-                try:
-                    if len(all_tickers) == 1: s = history_data
-                    else: s = history_data[asset['code']]
-                    valid_s = s[s.index <= today_ts].dropna()
-                    if not valid_s.empty:
-                        curr = float(valid_s.iloc[-1])
-                        asset['price'] = curr
-                        asset['perf'] = curr / asset['initial']
-                except: asset['price'] = 0
-
-            product_status = "Running"
-            early_redemption_date = None
-            is_aki = "AKI" in str(row['KI_Type']).upper()
-
-            # 回測
-            if row['IssueDate'] <= today_ts:
-                backtest_data = history_data[(history_data.index >= row['IssueDate']) & (history_data.index <= today_ts)]
-                if not backtest_data.empty:
-                    for date, prices in backtest_data.iterrows():
-                        if product_status == "Early Redemption": break
-                        is_post_nc = date >= nc_end_date
-                        all_locked = True
-                        for asset in assets:
-                            try:
-                                if len(all_tickers) == 1: price = float(prices)
-                                else: price = float(prices[asset['code']])
-                            except: price = float('nan')
-                            if pd.isna(price) or price == 0:
-                                if not asset['locked_ko']: all_locked = False
-                                continue
-                            
-                            perf = price / asset['initial']
-                            date_str = date.strftime('%Y/%m/%d')
-                            
-                            if is_aki and perf < ki_thresh and not asset['hit_ki']:
-                                asset['hit_ki'] = True
-                                asset['ki_record'] = f"@{price:.2f} ({date_str})"
-                            
-                            if not asset['locked_ko']:
-                                if is_post_nc and perf >= ko_thresh:
-                                    asset['locked_ko'] = True 
-                                    asset['ko_record'] = f"@{price:.2f} ({date_str})"
-                            
-                            if not asset['locked_ko']: all_locked = False
-                        
-                        if all_locked:
-                            product_status = "Early Redemption"
-                            early_redemption_date = date
-
-            locked_list = []; waiting_list = []; hit_ki_list = []; shadow_ko_list = []
-            detail_cols = {}
-            asset_detail_str = "" 
-            any_below_strike_today = False
-            dra_fail_list = []
-
-            for i, asset in enumerate(assets):
-                if asset['price'] > 0:
-                    if not is_aki and asset['perf'] < ki_thresh: asset['hit_ki'] = True 
-                    if is_dra and asset['perf'] < strike_thresh:
-                        any_below_strike_today = True
-                        dra_fail_list.append(asset['code'])
-
-                if asset['locked_ko']: locked_list.append(asset['code'])
-                else: waiting_list.append(asset['code'])
-                if asset['hit_ki']: hit_ki_list.append(asset['code'])
-                
-                p_pct = round(asset['perf']*100, 2) if asset['price'] > 0 else 0.0
-                status_icon = "✅" if asset['locked_ko'] else "⚠️" if asset['hit_ki'] else ""
-                
-                if is_dra and asset['price'] > 0:
-                    if asset['perf'] < strike_thresh: status_icon += "🛑無息"
-                    else: status_icon += "💸"
-
-                price_display = round(asset['price'], 2) if asset['price'] > 0 else "N/A"
-                initial_display = round(asset['initial'], 2)
-                
-                cell_text = f"【{asset['code']}】\n原: {initial_display}\n現: {price_display}\n({p_pct}%) {status_icon}"
-                if asset['locked_ko']: cell_text += f"\nKO {asset['ko_record']}"
-                if asset['hit_ki']: cell_text += f"\nKI {asset['ki_record']}"
-                detail_cols[f"T{i+1}_Detail"] = cell_text
-                
-                asset_detail_str += f"{asset['code']}: {p_pct}% {status_icon} (原:{initial_display})\n"
-
-            hit_any_ki = any(a['hit_ki'] for a in assets)
-            all_above_strike_now = all((a['perf'] >= strike_thresh if a['price'] > 0 else False) for a in assets)
-            
-            valid_assets = [a for a in assets if a['perf'] > 0]
-            if valid_assets:
-                worst_asset = min(valid_assets, key=lambda x: x['perf'])
-                worst_perf = worst_asset['perf']
-            else:
-                worst_perf = 0
-            
-            final_status = ""
-            line_status_short = "" 
-            need_notify = False
-
-            # 狀態判斷
-            if today_ts < row['IssueDate']:
-                final_status = "⏳ 未發行"
-            elif product_status == "Early Redemption":
-                final_status = f"🎉 提前出場\n({early_redemption_date.strftime('%Y-%m-%d')})"
-                if early_redemption_date >= lookback_date:
-                    line_status_short = "🎉 恭喜！已提前出場 (KO)"
-                    need_notify = True
-                else:
-                    line_status_short = f"🎉 已於 {early_redemption_date.strftime('%Y-%m-%d')} 提前出場 (舊)"
-                    need_notify = False
-            elif pd.notna(row['ValuationDate']) and today_ts >= row['ValuationDate']:
-                is_recent = row['ValuationDate'] >= lookback_date
-                if all_above_strike_now:
-                     final_status = "💰 到期獲利"
-                     line_status_short = "💰 到期獲利"
-                elif hit_any_ki:
-                     final_status = f"😭 到期接股"
-                     line_status_short = f"😭 到期接股"
-                else:
-                     final_status = "🛡️ 到期保本"
-                     line_status_short = "🛡️ 到期保本"
-                need_notify = is_recent
-                if not is_recent: line_status_short += " (舊)"
-            else:
-                if today_ts < nc_end_date:
-                    final_status = f"🔒 NC閉鎖期\n(至 {nc_end_date.strftime('%Y-%m-%d')})"
-                else:
-                    final_status = f"👀 比價中"
-                
-                if hit_any_ki:
-                    final_status += f"\n⚠️ KI已破"
-                    line_status_short = f"⚠️ 注意：KI 已跌破 ({','.join(hit_ki_list)})"
-                    need_notify = notify_ki_daily
-                
-                if is_dra:
-                    if any_below_strike_today:
-                        final_status += f"\n🛑 DRA暫停計息 ({','.join(dra_fail_list)}跌破)"
-                        if notify_ki_daily: 
-                            line_status_short = f"⚠️ DRA 暫停計息 ({','.join(dra_fail_list)} 跌破執行價)"
-                            need_notify = True
-                    else:
-                        final_status += "\n💸 DRA計息中 (全數高於執行價)"
-
-            if line_status_short:
-                admin_summary_list.append(f"● {row['ID']} ({row['Name']}): {line_status_short}")
-
-            emails = [x.strip() for x in re.split(r'[;,，]', str(row.get('Email', ''))) if x.strip()]
-            
-            mat_date_str = row['MaturityDate'].strftime('%Y-%m-%d') if pd.notna(row['MaturityDate']) else "-"
-            common_msg_body = (
-                f"Hi {row['Name']} 您好，\n"
-                f"您的結構型商品 {row['ID']} ({row['Product_Type']}) 最新狀態：\n\n"
-                f"【{line_status_short}】\n\n"
-                f"{asset_detail_str}"
-                f"📅 到期日: {mat_date_str}\n"
-                f"------------------\n"
-                f"貼心通知"
-            )
-
-            if need_notify and line_status_short and emails:
-                for mail in emails:
-                    if "@" in mail:
-                        subject = f"【ELN通知】{row['ID']} 最新狀態"
-                        mail_body = common_msg_body + "\n(本信件由系統自動發送)"
-                        individual_messages.append({'target': mail, 'subj': subject, 'msg': mail_body})
-
-            row_res = {
-                "債券代號": row['ID'], "Name": row['Name'], "Type": row['Product_Type'],
-                "狀態": final_status, "最差表現": f"{round(worst_perf*100, 2)}%",
-                "交易日": row['TradeDate'].strftime('%Y-%m-%d') if pd.notna(row['TradeDate']) else "-",
-                "NC月份": f"{nc_months}M",
-            }
-            row_res.update(detail_cols)
-            results.append(row_res)
+        # 5. 核心運算
+        with metrics.stage("evaluate") as rec:
+            evaluated = stage_evaluate(data_key, run_ts, books, history_data, lookback_days, notify_ki_daily, metrics)
+            # 各部位檔依序接起來，與合併表格的列順序一致
+            products = [p for ps, _ in evaluated.values() for p in ps]
+            barrier_results = [b for _, bs in evaluated.values() for b in bs]
+            rec['products'] = len(products)
+            rec['books'] = len(books)
+        with metrics.stage("notify") as rec:
+            book_runs = stage_notify(data_key, run_ts, lookback_days, notify_ki_daily, digest_mode, evaluated)
+            results = flatten(book_runs, 'results')
+            individual_messages = flatten(book_runs, 'individual_messages')
+            rec['messages'] = len(individual_messages)
+            rec['products_notified'] = notified_products(individual_messages)
 
         # 6. 顯示結果
         if not results:
             st.warning("⚠️ 無資料")
         else:
-            final_df = pd.DataFrame(results)
-            
-            def color_status(val):
-                if "提前" in str(val) or "獲利" in str(val) or "計息中" in str(val): return 'background-color: #d4edda; color: green'
-                if "接股" in str(val) or "KI" in str(val) or "暫停" in str(val): return 'background-color: #f8d7da; color: red'
-                if "未發行" in str(val) or "NC" in str(val): return 'background-color: #fff3cd; color: #856404'
-                return ''
-
-            t_cols = [c for c in final_df.columns if '_Detail' in c]; t_cols.sort()
-            display_cols = ['債券代號', 'Type', 'Name', '狀態', '最差表現'] + t_cols + ['交易日']
+            table_df = stage_table(data_key, run_ts, lookback_days, notify_ki_daily, results)
+            if mc_enabled:
+                with metrics.stage("montecarlo") as rec:
+                    probs = stage_montecarlo(data_key, run_ts, mc_paths, int(mc_seed), products, barrier_results, history_data)
+                    rec['paths'] = mc_paths
+                    rec['products'] = int(probs.notna().all(axis=1).sum())
+                table_df = pd.concat([table_df, probs], axis=1)
             
             st.subheader("📋 監控列表")
-            st.dataframe(final_df[display_cols].style.applymap(color_status, subset=['狀態']), height=600, use_container_width=True)
+            f1, f2, f3, f4 = st.columns(4) if len(books) > 1 else (*st.columns(3), None)
+            sel_status = f1.multiselect("狀態", list(table_df['狀態分類'].cat.categories))
+            sel_names = f2.multiselect("理專", list(table_df['Name'].cat.categories))
+            sel_codes = f3.multiselect("標的", underlying_codes(table_df))
+            sel_books = f4.multiselect("部位檔", list(books)) if f4 is not None else None
+            view_df = filter_results(table_df, sel_status, sel_names, sel_codes, sel_books)
+
+            p1, p2, p3 = st.columns([1, 1, 4])
+            page_size = p1.selectbox("每頁筆數", [50, 100, 200, 500], index=1)
+            n_pages = page_count(len(view_df), page_size)
+            page = p2.number_input("頁數", min_value=1, max_value=n_pages, value=1, step=1, key=f"page_{n_pages}")
+            page_df, n_pages = page_slice(view_df, page, page_size)
+            p3.caption(f"共 {len(view_df)} / {len(table_df)} 筆，第 {page} / {n_pages} 頁")
+
+            # 只把目前這一頁送到瀏覽器
+            with metrics.stage("render") as rec:
+                st.dataframe(page_df[table_columns(page_df)], column_config=table_column_config(),
+                             hide_index=True, height=600, use_container_width=True)
+                rec['rows'] = len(page_df)
+                rec['total_rows'] = len(table_df)
+
+            metrics.mark("first_row")
+            metrics.mark("table")
+
+            # 匯出完整結果 (不受篩選/分頁影響)；按下載時才產生檔案
+            from eln.export import EXPORT_FORMATS, export_bytes, export_columns
+            from eln.montecarlo import PROB_COLUMNS
+            d1, d2 = st.columns([1, 5])
+            export_fmt = d1.selectbox("匯出格式", list(EXPORT_FORMATS), label_visibility="collapsed")
+            export_cols = export_columns(extra=PROB_COLUMNS if mc_enabled else (), book=len(books) > 1)
+            d2.download_button(f"💾 匯出完整結果 ({len(table_df)} 筆)",
+                               lambda: export_bytes(table_df, export_fmt, export_cols),
+                               file_name=f"eln_results_{run_ts.strftime('%Y%m%d')}.{export_fmt}",
+                               mime=EXPORT_FORMATS[export_fmt], on_click="ignore")
+
+            with st.expander("🧪 壓力測試 (情境分析)"):
+                from eln.scenarios import MARKETS, shock_levels, shock_matrix, stress_book
+                s1, s2, s3 = st.columns(3)
+                scope = s1.selectbox("衝擊對象", ["全部標的", "依市場", "單一標的"])
+                target = None
+                if scope == "依市場": target = s2.selectbox("市場", list(MARKETS))
+                elif scope == "單一標的": target = s2.selectbox("標的", all_tickers)
+                lo_pct, hi_pct = s3.slider("衝擊範圍 (%)", min_value=-50, max_value=50, value=(-30, 30), step=5)
+                levels = shock_levels(lo_pct / 100, hi_pct / 100, hi_pct - lo_pct + 1)
+
+                with metrics.stage("stress") as rec:
+                    detail, summary = stress_book(products, barrier_results, shock_matrix(all_tickers, levels, target), run_ts)
+                    rec['scenarios'] = len(levels)
+                    rec['products'] = int(summary['products'].max()) if len(summary) else 0
+
+                if detail.empty:
+                    st.info("目前沒有比價中的商品。")
+                else:
+                    chart = summary[['ko_trigger', 'ki_hit', 'dra_paused']].rename(
+                        columns={'ko_trigger': 'KO 觸發', 'ki_hit': 'KI 已破', 'dra_paused': 'DRA 暫停計息'})
+                    chart.index = (chart.index * 100).round(1)
+                    chart.index.name = "衝擊 (%)"
+                    st.caption(f"比價中商品 {int(summary['products'].max())} 檔，各情境下的檔數")
+                    st.line_chart(chart)
+
+                    pick = st.select_slider("檢視情境", options=list(levels), value=levels[np.abs(levels).argmin()],
+                                            format_func=lambda v: f"{v * 100:+.0f}%")
+                    st.dataframe(detail[np.isclose(detail['shock'], pick)].drop(columns='shock'), hide_index=True,
+                                 use_container_width=True, column_config={
+                                     'worst_perf': st.column_config.NumberColumn("最差表現", format="%.2f%%"),
+                                     'ko_gap': st.column_config.NumberColumn("距 KO", format="%+.2f%%"),
+                                     'ki_gap': st.column_config.NumberColumn("距 KI", format="%+.2f%%"),
+                                     'ko_trigger': st.column_config.CheckboxColumn("KO 觸發"),
+                                     'ki_hit': st.column_config.CheckboxColumn("KI 已破"),
+                                     'dra_accrual': st.column_config.CheckboxColumn("DRA 計息"),
+                                 })
+
+            if watch_enabled:
+                with st.expander("📡 盤中監控", expanded=True):
+                    st.fragment(run_every=watch_interval)(watch_panel)(
+                        (data_key, run_ts, lookback_days, notify_ki_daily), products, barrier_results,
+                        all_tickers, run_ts, lookback_days, notify_ki_daily)
 
             st.markdown("### 📢 發送操作")
-            
-            if st.session_state['is_sent']:
-                st.success("✅ Email 發送完成！")
-                if st.button("🔄 重置"):
-                    st.session_state['is_sent'] = False
-                    st.rerun()
-            else:
-                count = len(individual_messages)
-                btn_label = f"📧 發送 Email (預計: {count} 則)"
-                
-                if st.button(btn_label, type="primary"):
-                    
-                    # 1. 🟢 優先發送管理員摘要 (Email)
-                    if admin_summary_list and ADMIN_EMAIL:
-                        summary_text = f"今日摘要报告 ({real_today.strftime('%Y/%m/%d')})\n----------------\n" + "\n".join(admin_summary_list)
-                        if count > 0: summary_text += f"\n\n(系統將發送 {count} 封客戶信件)"
-                        else: summary_text += f"\n\n(今日無須發送客戶信件)"
-                        
-                        send_email_gmail(ADMIN_EMAIL, f"【ELN 戰情快報 (Admin)】 {real_today.strftime('%Y/%m/%d')}", summary_text)
-                        st.toast("✅ 管理員摘要信件已發送", icon="📧")
-
-                    # 2. 🟡 發送個別信件
-                    success_cnt = 0
-                    bar = st.progress(0, text="正在寄送客戶通知...")
-                    
-                    for idx, item in enumerate(individual_messages):
-                        if send_email_gmail(item['target'], item['subj'], item['msg']):
-                            success_cnt += 1
-                        bar.progress((idx+1)/count)
-                    
-                    bar.empty()
-
-                    st.session_state['is_sent'] = True
-                    st.success(f"🎉 成功寄出 {success_cnt} 封信件！")
-                    st.balloons()
+            # 同一份檔案同一天為一批：進度存在寄信佇列 (SQLite)，重新整理或重開分頁仍看得到
+            outbox_batch = f"{real_today:%Y-%m-%d}:{file_hash[:16]}"
+            count = len(individual_messages)
+            product_count = notified_products(individual_messages) if digest_mode else None
+            btn_label = f"📧 發送 Email (預計: {count} 則)"
+            if digest_mode: btn_label = f"📧 發送 Email (預計: {count} 封，涵蓋 {product_count} 檔商品)"
+
+            if st.button(btn_label, type="primary", disabled=not (GMAIL_ACCOUNT and GMAIL_PASSWORD),
+                         help="信件排入寄信佇列後在背景寄出；同一商品同一事件同一天只會寄一次。"):
+                from eln.outbox import PRIORITY_ADMIN
+                outbox = get_outbox_worker().outbox
+                with metrics.stage("send") as rec:
+                    # 1. 🟢 管理員摘要優先 (每個部位檔一封)
+                    for book, run in book_runs.items():
+                        if not (run['admin_summary_list'] and ADMIN_EMAIL): continue
+                        msgs = run['individual_messages']
+                        summary_text = admin_summary_text(run['admin_summary_list'], len(msgs), real_today,
+                                                          notified_products(msgs) if digest_mode else None)
+                        outbox.enqueue([{'target': ADMIN_EMAIL, 'id': f"admin:{book}", 'msg': summary_text,
+                                         'subj': admin_subject(real_today, book if len(book_runs) > 1 else None)}],
+                                       real_today, outbox_batch, PRIORITY_ADMIN)
+                    # 2. 🟡 個別信件
+                    queued = outbox.enqueue(individual_messages, real_today, outbox_batch)
+                    rec['messages'] = queued
+                get_outbox_worker().start()
+                if queued: st.toast(f"📤 已排入 {queued} 封，背景寄送中", icon="📧")
+                else: st.info("今天這些通知都已排入或寄出過，不會重複寄送。")
+
+            if GMAIL_ACCOUNT and GMAIL_PASSWORD:
+                outbox_active = get_outbox_worker().running or get_outbox_worker().outbox.progress(outbox_batch)['pending'] > 0
+                st.fragment(run_every=2 if outbox_active else None)(outbox_panel)(outbox_batch)
+
+        show_metrics(metrics, profiler)
 
     except Exception as e:
         st.error(f"發生錯誤：{e}")
+    finally:
+        # st.stop() 與例外都會跳過 show_metrics，剖析器一定要關掉，否則整個 process 之後都在剖析
+        if profiler is not None: profiler.stop()
@@ -0,0 +1 @@
+# ELN 智能戰情室 - 運算模組
@@ -0,0 +1,5 @@
+import sys
+
+from eln.cli import main
+
+sys.exit(main())
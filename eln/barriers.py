@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+
+from eln.history import as_price_history
+
+# ==========================================
+# ⚡ 向量化 KO/KI 回測引擎
+# ==========================================
+# 每個標的建一次區間查詢索引 (eln.history.TickerIndex)，引用同一標的的所有商品一起查：
+# 各自從發行日 (或檢查點) 起找「首次 KI 日」、「NC 後首次 KO 日」，成本為 O(log 天數)，
+# 不隨同一標的的商品數重掃價格；提前出場日再以 NumPy 陣列運算求出。
+# 結果與逐日 iterrows 回測完全一致。
+
+# 價位比較放寬的相對誤差：先用 收盤價 vs 進場價 x 門檻 找候選日，再以原本的 perf 判斷確認
+LEVEL_TOL = 1e-9
+
+
+
+def as_price_frame(history_data, tickers):
+    # yf.download 單一標的時會回傳 Series，統一轉成 DataFrame (PriceHistory 原樣傳回)
+    if isinstance(history_data, pd.Series):
+        name = tickers[0] if len(tickers) == 1 else history_data.name
+        return history_data.to_frame(name=name)
+    return history_data
+
+
+def _date_positions(dates, values):
+    # 每個日期對應到「第一個 >= 該日」的交易日位置；NaT 視為永遠不到
+    values = pd.DatetimeIndex(values)
+    return np.where(values.isna(), len(dates), dates.searchsorted(values, side='left')).astype(np.int64)
+
+
+def latest_prices(history_data, today_ts):
+    # 每個標的在今天 (含) 以前的最後一筆有效收盤價
+    return as_price_history(history_data).latest(today_ts)
+
+
+def _record(price, date):
+    return f"@{price:.2f} ({date.strftime('%Y/%m/%d')})"
+
+
+def _usable_state(state, settle_ts):
+    # 檢查點晚於本次結算日 (例如回頭重算過去日期) 就不能沿用
+    return state is not None and pd.notna(state.get('last_date')) and (settle_ts is None or state['last_date'] <= settle_ts)
+
+
+def _first_crossing(ix, lo, hi, initial, thresh, below):
+    # 每個查詢 (同一標的的不同商品) 從 lo 起第一個 perf < thresh (below) 或 perf >= thresh 的位置，找不到為 hi；
+    # 候選日若只是浮點誤差造成的假訊號，從下一天接著找
+    level = initial * thresh * ((1 + LEVEL_TOL) if below else (1 - LEVEL_TOL))
+    find = ix.first_below if below else ix.first_at_or_above
+    pos = np.asarray(lo, dtype=np.int64).copy()
+    todo = np.flatnonzero(pos < hi)
+    while len(todo):
+        pos[todo] = find(pos[todo], hi[todo], level[todo])
+        todo = todo[pos[todo] < hi[todo]]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            perf = ix.values[pos[todo]] / initial[todo]
+        miss = ~(perf < thresh[todo]) if below else ~(perf >= thresh[todo])
+        todo = todo[miss]
+        pos[todo] += 1
+    return pos
+
+
+def evaluate_barriers(history_data, products, today_ts, states=None, settle_ts=None):
+    """
+    products: list of dict，每筆需包含
+        codes / initials  : 標的代號與進場價 (最多 5 檔)
+        ko_thresh / ki_thresh : 比例 (例如 1.0 / 0.6)
+        is_aki            : 是否為 AKI (每日觀察 KI)
+        issue_date / nc_end_date
+    states: 與 products 對齊的前次檢查點 (或 None)，只回測檢查點之後的新交易日。
+    settle_ts: 檢查點截止日，之後的收盤價可能還會修正，不寫入檢查點；
+               商品的檢查點也不超過其標的最後一筆有效收盤價 (這次沒抓到或只抓到一部分的標的之後可能補上)。
+    回傳 list of dict：early_redemption_date 以及每個標的的
+    locked_ko / hit_ki / ko_record / ki_record；有 settle_ts 時另附 state (新檢查點)。
+    """
+    history = as_price_history(history_data)
+    n_days = int(history.index.searchsorted(pd.Timestamp(today_ts), side='right'))
+    dates = history.index[:n_days]
+    states = states if states is not None else [None] * len(products)
+    states = [st if _usable_state(st, settle_ts) else None for st in states]
+    settle_pos = dates.searchsorted(pd.Timestamp(settle_ts), side='right') - 1 if settle_ts is not None else -1
+
+    m = len(products)
+    n_slots = max([len(p['codes']) for p in products] + [1])
+    initials = np.full((m, n_slots), np.nan)
+    used = np.zeros((m, n_slots), dtype=bool)
+    prev_locked = np.zeros((m, n_slots), dtype=bool)
+    prev_hit = np.zeros((m, n_slots), dtype=bool)
+    resume_pos = np.zeros(m, dtype=np.int64)
+    by_code = {}  # 標的 → 引用它的 (商品, 欄位)
+    for j, p in enumerate(products):
+        for k, (code, initial) in enumerate(zip(p['codes'], p['initials'])):
+            initials[j, k] = initial
+            used[j, k] = True
+            by_code.setdefault(code, []).append((j, k))
+        st = states[j]
+        if st is not None:
+            resume_pos[j] = dates.searchsorted(st['last_date'], side='right')
+            for k, a in enumerate(st['assets']):
+                prev_locked[j, k] = a['locked_ko']
+                prev_hit[j, k] = a['hit_ki']
+            # 已提前出場的商品狀態不會再變
+            if st['early_redemption_date'] is not None: resume_pos[j] = n_days
+
+    ko = np.array([p['ko_thresh'] for p in products], dtype=np.float64)
+    ki = np.array([p['ki_thresh'] for p in products], dtype=np.float64)
+    is_aki = np.array([bool(p['is_aki']) for p in products], dtype=bool)
+
+    # 回測區間：max(發行日, 檢查點隔天) ~ 今天 (尚未發行者區間為空)
+    issue_pos = _date_positions(dates, [p['issue_date'] for p in products])
+    not_issued = np.array([not (pd.notna(p['issue_date']) and p['issue_date'] <= today_ts) for p in products], dtype=bool)
+    issue_pos[not_issued] = n_days
+    start_pos = np.maximum(issue_pos, resume_pos)
+    nc_pos = _date_positions(dates, [p['nc_end_date'] for p in products])
+
+    # 每個標的查一次索引 (同一標的的所有商品一起查)；結果為聯集日期上的位置，找不到為 n_days
+    first_ki = np.full((m, n_slots), n_days, dtype=np.int64)
+    first_ko = np.full((m, n_slots), n_days, dtype=np.int64)
+    ki_price = np.full((m, n_slots), np.nan)
+    ko_price = np.full((m, n_slots), np.nan)
+    ck_pos = np.full(m, settle_pos, dtype=np.int64)  # 各商品檢查點可以記到的位置
+    for code, slots in by_code.items():
+        ix = history.ticker_index(code)
+        jj, kk = np.array(slots, dtype=np.int64).T
+        n = int(ix.locate(n_days)) if ix is not None else 0
+        valid = np.flatnonzero(np.isfinite(ix.values[:n]) & (ix.values[:n] != 0)) if n else []
+        last_pos = int(ix.upos[valid[-1]]) if len(valid) else -1
+        np.minimum.at(ck_pos, jj, last_pos)
+        if not n: continue
+        hi = np.full(len(jj), n, dtype=np.int64)
+        init = initials[jj, kk]
+        for below, q, lo_pos, thresh, first, price in (
+                (True, is_aki[jj] & ~prev_hit[jj, kk], start_pos[jj], ki[jj], first_ki, ki_price),
+                (False, ~prev_locked[jj, kk], np.maximum(start_pos[jj], nc_pos[jj]), ko[jj], first_ko, ko_price)):
+            lo = np.where(q, ix.locate(lo_pos), hi)
+            pos = _first_crossing(ix, lo, hi, init, thresh, below)
+            hit = pos < hi
+            first[jj[hit], kk[hit]] = ix.upos[pos[hit]]
+            price[jj[hit], kk[hit]] = ix.values[pos[hit]]
+
+    # 所有標的都鎖定 KO 的那一天即為提前出場日 (先前已鎖定者視為 -1)
+    eff_ko = np.where(prev_locked, -1, first_ko)
+    all_locked = np.where(used, eff_ko < n_days, True).all(axis=1) & used.any(axis=1)
+    er_pos = np.where(all_locked, np.where(used, eff_ko, -1).max(axis=1), n_days)
+
+    # 提前出場後回測即停止，之後的 KI 不列計
+    new_hit = (first_ki < n_days) & (first_ki <= er_pos[:, None])
+    new_locked = first_ko < n_days
+
+    stamps = dates.to_list()  # 逐筆取 Timestamp 時比 DatetimeIndex[i] 快很多
+    out = []
+    for j, p in enumerate(products):
+        st = states[j]
+        if st is not None and st['early_redemption_date'] is not None:
+            res = {'early_redemption_date': st['early_redemption_date'],
+                   'assets': [dict(a) for a in st['assets']]}
+            if settle_ts is not None: res['state'] = st
+            out.append(res)
+            continue
+
+        assets = []; ck_assets = []
+        for k in range(len(p['codes'])):
+            prev = st['assets'][k] if st is not None else {'ko_record': '', 'ki_record': ''}
+            a = {'locked_ko': bool(prev_locked[j, k] or new_locked[j, k]),
+                 'hit_ki': bool(prev_hit[j, k] or new_hit[j, k]),
+                 'ko_record': prev['ko_record'] if prev_locked[j, k] else '',
+                 'ki_record': prev['ki_record'] if prev_hit[j, k] else ''}
+            if new_locked[j, k]:
+                a['ko_record'] = _record(ko_price[j, k], stamps[first_ko[j, k]])
+            if new_hit[j, k]:
+                a['ki_record'] = _record(ki_price[j, k], stamps[first_ki[j, k]])
+            assets.append(a)
+
+            # 檢查點：只記到 settle 日 (且各標的都有資料的日期) 為止
+            ck_locked = bool(prev_locked[j, k] or first_ko[j, k] <= ck_pos[j])
+            ck_hit = bool(prev_hit[j, k] or (new_hit[j, k] and first_ki[j, k] <= ck_pos[j]))
+            ck_assets.append({'locked_ko': ck_locked, 'hit_ki': ck_hit,
+                              'ko_record': a['ko_record'] if ck_locked else '',
+                              'ki_record': a['ki_record'] if ck_hit else ''})
+
+        er_date = stamps[er_pos[j]] if er_pos[j] < n_days else None
+        res = {'early_redemption_date': er_date, 'assets': assets}
+        if settle_ts is not None:
+            # 檢查點沒有往前推進 (例如某標的這次完全沒資料) 就沿用舊的
+            if ck_pos[j] >= resume_pos[j]:
+                res['state'] = {'last_date': stamps[ck_pos[j]],
+                                'early_redemption_date': er_date if er_pos[j] <= ck_pos[j] else None,
+                                'assets': ck_assets}
+            else:
+                res['state'] = st
+        out.append(res)
+    return out
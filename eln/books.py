@@ -0,0 +1,234 @@
+import gc
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from eln.barriers import evaluate_barriers
+from eln.engine import (build_digests, build_notifications, build_products, collect_tickers, download_windows,
+                        fetch_history, merge_windows, notified_products, priority_order, settle_date)
+from eln.history import PriceHistory, as_price_history
+from eln.metrics import RunMetrics
+from eln.state import BarrierStateStore, terms_key
+
+# ==========================================
+# 📚 多部位檔：一次抓價、多 process 平行回測
+# ==========================================
+# 各部位檔 (各 desk 一份) 的標的取聯集，只抓一次股價；
+# 股價 (PriceHistory 的陣列) 放進共享記憶體，worker process 直接掛上同一塊 buffer，不必各自複製一份。
+# 回測 (最重的一段) 切成批次分派到多個 process，要緊的商品 (已到期 / 已出場 / KI 已破) 先算；
+# 檢查點與通知過濾都回到主 process 做；
+# 每個部位檔各自一份管理員摘要，表格加上 Book 欄合併。
+# 批次模式 (iter_books) 一個部位檔算完就交出去匯出 / 寄送，不必等全部部位檔。
+
+
+BATCH_PRODUCTS = 256
+PARALLEL_MIN_PRODUCTS = 2000
+
+
+class SharedPrices:
+    # 建立者負責釋放 (close 時 unlink)；spec 很小，可以 pickle 給 worker
+    # 共享的是 PriceHistory 的 days / values 兩條陣列 (不補 NaN)，offsets 等小陣列直接放在 spec
+    def __init__(self, history):
+        history = as_price_history(history)
+        days, values = history.days, history.values
+        at = -(-days.nbytes // 8) * 8  # values 對齊 8 bytes
+        self._shm = shared_memory.SharedMemory(create=True, size=max(at + values.nbytes, 1))
+        np.ndarray(days.shape, dtype=days.dtype, buffer=self._shm.buf)[:] = days
+        np.ndarray(values.shape, dtype=values.dtype, buffer=self._shm.buf, offset=at)[:] = values
+        self.spec = {'name': self._shm.name, 'n': len(days), 'at': at, 'dtype': values.dtype.str, 'tickers': history.tickers,
+                     'offsets': history.offsets, 'decimals': history.decimals}
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): self.close()
+
+
+def attach_prices(spec):
+    # 回傳 (SharedMemory, PriceHistory)；PriceHistory 直接指向共享 buffer，用完要先丟掉再 close
+    shm = shared_memory.SharedMemory(name=spec['name'])
+    days = np.ndarray((spec['n'],), dtype=np.int32, buffer=shm.buf)
+    values = np.ndarray((spec['n'],), dtype=np.dtype(spec['dtype']), buffer=shm.buf, offset=spec['at'])
+    days.flags.writeable = False
+    values.flags.writeable = False
+    return shm, PriceHistory(spec['tickers'], spec['offsets'], days, values, spec['decimals'])
+
+
+def _backtest_task(task):
+    shm, history_data = attach_prices(task['prices'])
+    try:
+        return evaluate_barriers(history_data, task['products'], task['today_ts'],
+                                 states=task['states'], settle_ts=task['settle_ts'])
+    finally:
+        del history_data
+        gc.collect()
+        shm.close()
+
+
+def plan_books(books, history_data, today_ts):
+    # 每個部位檔整理成商品 (定進場價、抓現價；很快)，回測留給 iter_backtest
+    return {book: build_products(df, history_data, today_ts) for book, df in books.items()}
+
+
+def iter_backtest(planned, history_data, today_ts, state_path=None, workers=None, batch_size=BATCH_PRODUCTS,
+                  interleave=True):
+    """
+    planned: plan_books 的結果 {部位檔名稱: products}。
+    一批一批產出 (部位檔名稱, 商品位置 list, barrier_results)，先算已到期 / 已出場 / KI 已破的商品，
+    畫面可以邊算邊顯示。workers > 1 時各批分派到多個 process (股價放共享記憶體)。
+    有 state_path 時沿用並更新回測檢查點 (只在主 process 寫入)。
+    interleave=False 時依部位檔順序算 (前一個部位檔的批次先送出)，部位檔一個一個完成。
+    """
+    today_ts = pd.Timestamp(today_ts)
+    state_store = BarrierStateStore(state_path) if state_path else None
+    settle_ts = settle_date(today_ts) if state_store is not None else None
+
+    tasks = []
+    for book, products in planned.items():
+        keys = [terms_key(p) for p in products] if state_store is not None else None
+        states = state_store.load(keys) if state_store is not None else [None] * len(products)
+        order = priority_order(products, today_ts, states)
+        for start in range(0, len(order), batch_size):
+            positions = order[start:start + batch_size]
+            tasks.append({'book': book, 'rank': start // batch_size, 'positions': positions, 'products': [products[i] for i in positions],
+                          'states': [states[i] for i in positions],
+                          'keys': [keys[i] for i in positions] if keys is not None else None})
+    # 各部位檔的第 1 批先算，再輪到第 2 批…，前幾批就涵蓋每個部位檔最要緊的商品
+    if interleave: tasks.sort(key=lambda t: t['rank'])
+
+    def finish(task, barrier_results):
+        if state_store is not None:
+            state_store.save(task['keys'], [p['row']['ID'] for p in task['products']],
+                             [r.pop('state') for r in barrier_results])
+        return task['book'], task['positions'], barrier_results
+
+    # 商品不多時開 process 的成本比回測本身還高
+    if workers is None: workers = (os.cpu_count() or 1) if sum(map(len, planned.values())) >= PARALLEL_MIN_PRODUCTS else 1
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        for task in tasks:
+            yield finish(task, evaluate_barriers(history_data, task['products'], today_ts,
+                                                 states=task['states'], settle_ts=settle_ts))
+        return
+
+    with SharedPrices(history_data) as shared, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_backtest_task, {'prices': shared.spec, 'products': t['products'], 'states': t['states'],
+                                                'today_ts': today_ts, 'settle_ts': settle_ts}): t for t in tasks}
+        for fut in as_completed(futures):
+            yield finish(futures[fut], fut.result())
+
+
+def evaluate_books(books, history_data, today_ts, state_path=None, workers=None):
+    """
+    books: {部位檔名稱: clean_df}，共用同一份 history_data。
+    回傳 {部位檔名稱: (products, barrier_results)}，順序同 books。
+    workers: process 數，預設為 CPU 數 (商品少於 PARALLEL_MIN_PRODUCTS 時為 1)；1 則在目前的 process 內依序執行。
+    """
+    planned = plan_books(books, history_data, today_ts)
+    barriers = {book: [None] * len(products) for book, products in planned.items()}
+    for book, positions, barrier_results in iter_backtest(planned, history_data, today_ts, state_path, workers):
+        for i, r in zip(positions, barrier_results): barriers[book][i] = r
+    return {book: (planned[book], barriers[book]) for book in books}
+
+
+def union_tickers(books):
+    return sorted({t for df in books.values() for t in collect_tickers(df)})
+
+
+def books_download_windows(books, today_ts):
+    # 同 download_windows，同一標的取所有部位檔中最早的起始日
+    return merge_windows(*(download_windows(df, today_ts) for df in books.values()))
+
+
+def notify_books(evaluated, today_ts, lookback_days=3, notify_ki_daily=True, digest=False):
+    # 每個部位檔各自做通知過濾 (彙整信也以部位檔為單位)；結果列加上 Book
+    out = {}
+    for book, (products, barrier_results) in evaluated.items():
+        results, individual_messages, admin_summary_list = build_notifications(
+            products, barrier_results, today_ts, lookback_days, notify_ki_daily)
+        for r in results: r['Book'] = book
+        if digest: individual_messages = build_digests(individual_messages, today_ts)
+        out[book] = {'results': results, 'individual_messages': individual_messages,
+                     'admin_summary_list': admin_summary_list}
+    return out
+
+
+def fetch_books(books, price_store, today_ts, metrics=None, symbols=None):
+    """
+    全部部位檔的標的聯集只抓一次價；回傳 (books, history_data)。
+    symbols (SymbolMaster)：抓價前套用手動對照 (回傳的 books 為套用後)、略過已知無資料的代號。
+    """
+    today_ts = pd.Timestamp(today_ts)
+    metrics = metrics or RunMetrics()
+    if symbols is not None: books = {book: symbols.apply(df) for book, df in books.items()}
+    all_tickers = union_tickers(books)
+    if not all_tickers:
+        raise ValueError("❌ 找不到有效的標的代號。")
+    with metrics.stage("prices", books=len(books)) as rec:
+        history_data = fetch_history(price_store, all_tickers, books_download_windows(books, today_ts), today_ts, symbols)
+        rec['tickers'] = len(all_tickers)
+        rec['downloaded_rows'] = price_store.last_download_rows
+        rec['price_bytes'] = history_data.nbytes
+        rec['missing_tickers'] = sum(1 for r in price_store.last_report if r['status'] == 'missing')
+        rec['skipped_tickers'] = sum(1 for r in price_store.last_report if r['status'] == 'skipped')
+    return books, history_data
+
+
+def iter_books(books, history_data, today_ts, lookback_days=3, notify_ki_daily=True, state_path=None,
+               metrics=None, digest=False, workers=None, coverage=None):
+    """
+    依 books 的順序，每個部位檔回測 + 通知過濾完就產出 (部位檔名稱, run dict)，欄位同 run_book；
+    呼叫端可以先匯出 / 寄送這個部位檔再處理下一個，不必把全部部位檔的結果留在記憶體。
+    coverage: 抓價的覆蓋報告 (PriceStore.last_report)，放進每個 run dict。
+    """
+    today_ts = pd.Timestamp(today_ts)
+    metrics = metrics or RunMetrics()
+    planned = plan_books(books, history_data, today_ts)
+    barriers = {book: [None] * len(products) for book, products in planned.items()}
+    left = {book: len(products) for book, products in planned.items()}
+    batches = iter_backtest(planned, history_data, today_ts, state_path, workers, interleave=False)
+    try:
+        for book in books:
+            with metrics.stage("evaluate", book=book) as rec:
+                # 平行時其他部位檔的批次可能先回來，先放著
+                while left[book]:
+                    done, positions, barrier_results = next(batches)
+                    for i, r in zip(positions, barrier_results): barriers[done][i] = r
+                    left[done] -= len(positions)
+                products, barrier_results = planned.pop(book), barriers.pop(book)
+                rec['products'] = len(products)
+                rec['price_days'] = len(history_data)
+            with metrics.stage("notify", book=book) as rec:
+                run = notify_books({book: (products, barrier_results)}, today_ts, lookback_days, notify_ki_daily,
+                                   digest)[book]
+                rec['messages'] = len(run['individual_messages'])
+                rec['products_notified'] = notified_products(run['individual_messages'])
+                rec['events'] = len(run['admin_summary_list'])
+            run.update({'tickers': collect_tickers(books[book]), 'metrics': metrics, 'coverage': coverage,
+                        'products': products, 'barrier_results': barrier_results, 'history_data': history_data})
+            yield book, run
+    finally:
+        batches.close()
+
+
+def run_books(books, price_store, today_ts, lookback_days=3, notify_ki_daily=True, state_path=None,
+              metrics=None, digest=False, workers=None, symbols=None):
+    """
+    多部位檔版的 run_book：回傳 {部位檔名稱: run dict}，各 run dict 的欄位同 run_book，
+    其中 coverage / history_data 為全部部位檔共用。symbols (SymbolMaster)：抓價前套用手動對照、略過已知無資料的代號。
+    """
+    metrics = metrics or RunMetrics()
+    books, history_data = fetch_books(books, price_store, today_ts, metrics, symbols)
+    return dict(iter_books(books, history_data, today_ts, lookback_days, notify_ki_daily, state_path, metrics, digest,
+                           workers, price_store.last_report))
+
+
+def flatten(runs, key):
+    # 各部位檔的 list 依序接起來 (與合併表格的列順序一致)
+    return [x for run in runs.values() for x in run[key]]
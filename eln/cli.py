@@ -0,0 +1,252 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from eln.books import PARALLEL_MIN_PRODUCTS, fetch_books, iter_books
+from eln.engine import admin_subject, admin_summary_text, notified_products
+from eln.export import ResultExporter, export_columns, export_format, export_results
+from eln.mailer import Mailer
+from eln.metrics import RunMetrics, RunProfiler
+from eln.montecarlo import PROB_COLUMNS, simulate_probabilities
+from eln.outbox import DEFAULT_OUTBOX_PATH, PRIORITY_ADMIN, Outbox, OutboxWorker
+from eln.prices import DEFAULT_DB_PATH, CsvProvider, PriceStore, report_frame
+from eln.reader import read_book_stream
+from eln.state import DEFAULT_STATE_PATH
+from eln.symbols import DEAD_TTL_DAYS, DEFAULT_SYMBOLS_PATH, SymbolMaster
+from eln.watch import IntradayWatcher, ReplayFeed, YahooQuoteFeed, run_watch
+
+# ==========================================
+# 🖥️ 排程 / 命令列模式 (不載入 Streamlit)
+# ==========================================
+# 例：python -m eln 部位A.xlsx 部位B.xlsx -o results.csv --send
+# Email 設定改讀環境變數：GMAIL_ACCOUNT / GMAIL_PASSWORD / ADMIN_EMAIL
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="eln", description="ELN 智能戰情室 - 批次監控")
+    parser.add_argument("books", nargs="+", help="部位檔 (xlsx / csv)，可一次多檔")
+    parser.add_argument("-o", "--output", help="結果輸出檔 (.xlsx / .parquet / .csv 分批寫出，或 .json)")
+    parser.add_argument("--all-sheets", action="store_true", help="讀取 Excel 所有工作表")
+    parser.add_argument("--lookback-days", type=int, default=3, help="只通知幾天內發生的事件")
+    parser.add_argument("--no-ki-daily", action="store_true", help="KI/DRA 不要每天提醒")
+    parser.add_argument("--today", help="評價日 (YYYY-MM-DD)，預設為現在")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="本地股價庫路徑")
+    parser.add_argument("--prices-dir", help="離線模式：改讀此目錄下的 <代號>.csv (欄位 Date, Close)，不連網抓價")
+    parser.add_argument("--symbols", default=DEFAULT_SYMBOLS_PATH, help="代號主檔路徑 (代號轉換、手動對照、無資料紀錄)")
+    parser.add_argument("--symbol-ttl-days", type=float, default=DEAD_TTL_DAYS, help="確認無資料的代號幾天內不再請求")
+    parser.add_argument("--recheck-symbols", action="store_true", help="清除無資料紀錄，這次全部重新請求")
+    parser.add_argument("--override", action="append", default=[], metavar="CODE=SYMBOL",
+                        help="新增手動對照 (原始或轉換後代號=正確代號，可重複；SYMBOL 留空則刪除)，存入代號主檔")
+    parser.add_argument("--fetch-workers", type=int, default=4, help="同時抓價的批數")
+    parser.add_argument("--eval-workers", type=int,
+                        help=f"平行回測的 process 數 (預設為 CPU 數；商品少於 {PARALLEL_MIN_PRODUCTS} 檔時為 1，在目前的 process 內執行)")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH, help="回測檢查點路徑")
+    parser.add_argument("--full-replay", action="store_true", help="不使用檢查點，從發行日完整回測")
+    parser.add_argument("--send", action="store_true", help="寄出管理員摘要與客戶通知")
+    parser.add_argument("--outbox", default=DEFAULT_OUTBOX_PATH, help="寄信佇列路徑 (中斷後重跑會接著寄，已寄過的不重寄)")
+    parser.add_argument("--mc-paths", type=int, default=0, help="蒙地卡羅路徑數 (0 = 不試算 KO/KI/接股機率)")
+    parser.add_argument("--mc-seed", type=int, default=0, help="蒙地卡羅亂數種子")
+    parser.add_argument("--mc-workers", type=int, help="蒙地卡羅 process 數 (預設為 CPU 數)")
+    parser.add_argument("--per-product", action="store_true", help="每檔商品各寄一封 (預設同一收件人彙整成一封)")
+    parser.add_argument("--metrics-jsonl", help="各階段耗時附加寫入此 JSON lines 檔")
+    parser.add_argument("--metrics-prom", help="各階段耗時寫成 Prometheus textfile (*.prom)")
+    parser.add_argument("--profile", help="整次執行的 cProfile 結果存到此檔 (.prof)")
+    parser.add_argument("--watch", type=float, metavar="SECONDS", help="批次跑完後進入盤中監控，每隔幾秒輪詢報價")
+    parser.add_argument("--watch-replay", metavar="CSV", help="盤中監控改用本地報價檔回放 (時間 x 代號)")
+    parser.add_argument("--watch-polls", type=int, help="盤中監控最多輪詢幾次 (預設不限)")
+    args = parser.parse_args(argv)
+    # 不認得的副檔名直接報錯，不要默默寫成 CSV
+    if args.output and not args.output.lower().endswith(".json") and export_format(args.output) is None:
+        parser.error(f"不支援的輸出格式：{args.output} (請用 .xlsx / .parquet / .csv / .json)")
+    return args
+
+
+def write_results(final_df, path):
+    # .json 整張寫出；其他格式走 ResultExporter 分批寫
+    final_df.to_json(path, orient="records", force_ascii=False, indent=1)
+
+
+def env_mailer():
+    return Mailer(os.environ.get("GMAIL_ACCOUNT", ""), os.environ.get("GMAIL_PASSWORD", ""),
+                  workers=int(os.environ.get("SMTP_WORKERS", 3)),
+                  rate_per_sec=float(os.environ.get("SMTP_RATE_PER_SEC", 2.0)))
+
+
+def send_book(worker, run, today_ts, admin_email, metrics, book, digest=True):
+    # 管理員摘要與客戶通知先排入寄信佇列 (今天已排過的略過)，再把佇列寄完
+    count = len(run['individual_messages'])
+    product_count = notified_products(run['individual_messages']) if digest else None
+    outbox = worker.outbox
+    batch = f"{today_ts:%Y-%m-%d}:{book}"
+    with metrics.stage("send", book=book) as rec:
+        if run['admin_summary_list'] and admin_email:
+            outbox.enqueue([{'target': admin_email, 'subj': admin_subject(today_ts, book), 'id': f"admin:{book}",
+                             'msg': admin_summary_text(run['admin_summary_list'], count, today_ts, product_count)}],
+                           today_ts, batch, PRIORITY_ADMIN)
+        rec['queued'] = outbox.enqueue(run['individual_messages'], today_ts, batch)
+        worker.run()
+        progress = outbox.progress(batch)
+        rec['messages'] = progress['total']
+        rec['failed'] = progress['failed']
+    return progress, outbox.failures(batch)
+
+
+def write_metrics(metrics, args):
+    if args.metrics_jsonl: metrics.write_jsonl(args.metrics_jsonl)
+    if args.metrics_prom: metrics.write_prometheus(args.metrics_prom)
+
+
+def watch_books(watchers, args, worker):
+    # 盤中監控：只有報價穿越 KO / KI / 執行價的商品會重算，新狀態立即印出 (與寄送)
+    if args.watch_replay: feed = ReplayFeed.from_csv(args.watch_replay)
+    else: feed = YahooQuoteFeed(sorted({a['code'] for w in watchers.values() for p in w.products for a in p['assets']}))
+    interval = 0 if args.watch_replay else args.watch
+
+    def on_event(ev):
+        print(f"📡 {ev['ts']:%H:%M:%S} {ev['book']}: {ev['status']}", flush=True)
+        if worker is not None and ev['messages']:
+            # 同一天同一事件只寄一次 (盤中來回穿越不會重複通知)
+            if not worker.outbox.enqueue(ev['messages'], ev['ts'], f"{ev['ts']:%Y-%m-%d}:watch:{ev['book']}"): return
+            failed = worker.run()[1]
+            if failed: print(f"❌ {ev['book']} {ev['id']}: {failed} 封寄送失敗", file=sys.stderr)
+
+    print(f"📡 盤中監控中 ({len(watchers)} 個部位檔，Ctrl+C 結束)")
+    try:
+        events = run_watch(watchers, feed, interval, args.watch_polls, on_event)
+    except KeyboardInterrupt:
+        events = None
+    evaluations = sum(w.evaluations for w in watchers.values())
+    print(f"📡 監控結束：{'' if events is None else f'{len(events)} 則事件，'}累計重算 {evaluations} 次")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.profile: return run_batch(args)
+    profiler = RunProfiler().start()
+    try:
+        return run_batch(args)
+    finally:
+        profiler.stop()
+        with open(args.profile, "wb") as f: f.write(profiler.report()[1])
+        print(f"🔬 效能剖析已存到 {args.profile}")
+
+
+def run_batch(args):
+    today_ts = pd.Timestamp(args.today) if args.today else pd.Timestamp(datetime.now())
+    provider = CsvProvider(args.prices_dir) if args.prices_dir else None
+    price_store = PriceStore(args.db, provider=provider, workers=args.fetch_workers)
+    state_path = None if args.full_replay else args.state
+    symbols = SymbolMaster(args.symbols, args.symbol_ttl_days)
+    for item in args.override:
+        code, sep, symbol = item.partition("=")
+        if not sep or not code.strip():
+            print(f"❌ --override 格式應為 CODE=SYMBOL：{item}", file=sys.stderr)
+            return 2
+        symbols.set_override(code, symbol)
+    if args.recheck_symbols: symbols.recheck()
+
+    worker = None
+    if args.send:
+        mailer = env_mailer()
+        if not (mailer.account and mailer.password):
+            print("❌ Email 未設定 (請設定 GMAIL_ACCOUNT / GMAIL_PASSWORD)", file=sys.stderr)
+            return 2
+        worker = OutboxWorker(Outbox(args.outbox), env_mailer)
+        # 上次中斷留下的信先寄完
+        resumed = worker.run()
+        if sum(resumed): print(f"📧 續寄上次未完成的佇列：成功 {resumed[0]} 封，失敗 {resumed[1]} 封")
+    admin_email = os.environ.get("ADMIN_EMAIL", os.environ.get("GMAIL_ACCOUNT", ""))
+
+    metrics = RunMetrics()
+    exit_code = 0
+    books = {}
+    for path in args.books:
+        book = os.path.splitext(os.path.basename(path))[0]
+        try:
+            with metrics.stage("ingest", book=book) as rec:
+                with open(path, "rb") as f:
+                    books[book], _ = read_book_stream(f.read(), all_sheets=args.all_sheets)
+                rec['rows'] = len(books[book])
+        except Exception as e:
+            print(f"❌ {path}: {e}", file=sys.stderr)
+            exit_code = 1
+    if not books: return exit_code or 1
+
+    # 所有部位檔的標的聯集只抓一次價
+    try:
+        books, history_data = fetch_books(books, price_store, today_ts, metrics, symbols)
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    gaps = report_frame(price_store.last_report)
+    for _, g in gaps.iterrows():
+        if g['狀態'] == 'skipped':
+            print(f"⏭️ {g['代號']} {g['錯誤']}", file=sys.stderr)
+            continue
+        print(f"⚠️ {g['代號']} 股價{'缺少' if g['狀態'] == 'missing' else '不完整'} "
+              f"{g['缺少區間']} {g['錯誤']}".rstrip(), file=sys.stderr)
+
+    frames = []
+    watchers = {}
+    # xlsx / parquet / csv 每個部位檔算完就分批寫出、寄送，不必等全部部位檔算完再併成一張表
+    exporter = None
+    if args.output and not args.output.lower().endswith(".json"):
+        exporter = ResultExporter(args.output, export_format(args.output),
+                                  export_columns(extra=PROB_COLUMNS if args.mc_paths > 0 else (), book=True))
+    runs = iter_books(books, history_data, today_ts, args.lookback_days, not args.no_ki_daily, state_path, metrics,
+                      digest=not args.per_product, workers=args.eval_workers, coverage=price_store.last_report)
+    try:
+        for book, run in runs:
+            probs = None
+            if args.mc_paths > 0:
+                with metrics.stage("montecarlo", book=book) as rec:
+                    probs = simulate_probabilities(run['products'], run['barrier_results'], run['history_data'],
+                                                   today_ts, args.mc_paths, args.mc_seed, args.mc_workers)
+                    rec['paths'] = args.mc_paths
+                    rec['products'] = int(probs.notna().all(axis=1).sum())
+            if exporter is not None:
+                with metrics.stage("export", book=book) as rec:
+                    export_results(exporter, run['results'], probs)
+                    rec['rows'] = len(run['results'])
+            elif args.output:
+                book_df = pd.DataFrame(run['results'])
+                if probs is not None: book_df = pd.concat([book_df, probs], axis=1)
+                frames.append(book_df[['Book'] + [c for c in book_df.columns if c != 'Book']])
+            if args.watch is not None or args.watch_replay:
+                watchers[book] = IntradayWatcher(run['products'], run['barrier_results'], today_ts,
+                                                 args.lookback_days, not args.no_ki_daily)
+            print(f"📊 {book}: {len(run['results'])} 檔商品，{len(run['admin_summary_list'])} 則事件，"
+                  f"{len(run['individual_messages'])} 封客戶通知")
+
+            if worker is not None:
+                progress, failures = send_book(worker, run, today_ts, admin_email, metrics, book, not args.per_product)
+                print(f"📧 {book}: 今日已寄出 {progress['sent']}/{progress['total']} 封")
+                for f in failures: print(f"❌ {f['target']} {f['subj']}: {f['error']}", file=sys.stderr)
+                if failures: exit_code = 1
+            # 算下一個部位檔之前先放掉這一個的結果 (盤中監控需要的另外留在 watchers)
+            del run, probs
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        if exporter is not None: exporter.close()
+        return 1
+
+    if exporter is not None:
+        exporter.close()
+        print(f"💾 已輸出 {args.output} ({exporter.rows} 筆)")
+    elif args.output and frames:
+        with metrics.stage("export") as rec:
+            write_results(pd.concat(frames, ignore_index=True), args.output)
+            rec['rows'] = sum(len(f) for f in frames)
+        print(f"💾 已輸出 {args.output}")
+    write_metrics(metrics, args)
+    print(f"⏱️ 總耗時 {metrics.total_seconds():.2f}s (" +
+          ", ".join(f"{r['stage']} {r['seconds']:.2f}s" for r in metrics.stages) + ")")
+    if watchers: watch_books(watchers, args, worker)
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
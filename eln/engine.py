@@ -0,0 +1,476 @@
+from datetime import timedelta
+import re
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from eln.barriers import as_price_frame, evaluate_barriers
+from eln.history import as_price_history
+from eln.ingest import parse_nc_months
+from eln.metrics import RunMetrics
+from eln.prices import REFRESH_DAYS
+from eln.state import terms_key
+
+# ==========================================
+# ⚙️ 運算引擎 (不依賴 Streamlit，可供排程/CLI 使用)
+# ==========================================
+
+
+def collect_tickers(clean_df):
+    all_tickers = []
+    for i in range(1, 6):
+        if f'T{i}_Code' in clean_df.columns:
+            ts = clean_df[f'T{i}_Code'].dropna().unique().tolist()
+            all_tickers.extend([t for t in ts if t != ""])
+    return sorted(set(all_tickers))
+
+
+def download_windows(clean_df, today_ts):
+    # 每個標的各自的起始日：引用它的商品中最早的交易日 / 發行日往前 7 天，
+    # 再取到該月 1 號 (起始日相近的代號併成同一批抓)；沒有日期的標的抓最近 30 天
+    # 沒有發行日欄位時 ingest 以 Timestamp.min 佔位，不是真的日期 (減 7 天會溢位)
+    issue = clean_df['IssueDate'].where(clean_df['IssueDate'] > pd.Timestamp.min)
+    first = pd.concat([clean_df['TradeDate'], issue], axis=1).min(axis=1)
+    refs = pd.concat([pd.DataFrame({'code': clean_df[f'T{i}_Code'], 'first': first})
+                      for i in range(1, 6) if f'T{i}_Code' in clean_df.columns], ignore_index=True)
+    refs = refs[refs['code'].notna() & (refs['code'] != "")]
+    starts = (refs.groupby('code')['first'].min() - timedelta(days=7)).dt.to_period('M').dt.to_timestamp()
+    fallback = pd.Timestamp(today_ts).normalize() - timedelta(days=30)
+    return {code: (d if pd.notna(d) else fallback) for code, d in starts.items()}
+
+
+def merge_windows(*windows):
+    # 多份 download_windows 合併：同一標的取最早的起始日
+    out = {}
+    for w in windows:
+        for code, d in w.items(): out[code] = min(out[code], d) if code in out else d
+    return out
+
+
+def fetch_history(price_store, tickers, start_date, today_ts, symbols=None):
+    # start_date 可為單一日期或 download_windows 的 {代號: 起始日}；回傳 PriceHistory
+    # symbols (SymbolMaster)：已知沒有資料的代號不請求，抓完記下各代號有沒有資料
+    skip = symbols.dead(tickers) if symbols is not None else None
+    history_data = price_store.get_history(list(tickers), start_date, pd.Timestamp(today_ts).normalize(), skip)
+    if symbols is not None: symbols.record(price_store.last_report)
+    return as_price_history(as_price_frame(history_data, list(tickers)))
+
+
+def prepare_products(clean_df, history_data, today_ts, state_store=None):
+    products = build_products(clean_df, history_data, today_ts)
+    return products, backtest(products, history_data, today_ts, state_store)
+
+
+def build_products(clean_df, history_data, today_ts):
+    history = as_price_history(history_data)
+    last_prices = history.latest(today_ts)
+
+    # 5-1. 整理每檔商品的條件與標的
+    products = []
+    for index, row in clean_df.iterrows():
+        ko_thresh_val = row['KO_Pct'] if pd.notna(row['KO_Pct']) else 100.0
+        ki_thresh_val = row['KI_Pct'] if pd.notna(row['KI_Pct']) else 60.0
+        strike_thresh_val = row['Strike_Pct'] if pd.notna(row['Strike_Pct']) else 100.0
+        
+        ko_thresh = ko_thresh_val / 100.0
+        ki_thresh = ki_thresh_val / 100.0
+        strike_thresh = strike_thresh_val / 100.0
+        nc_months = int(row['NC_Months']) if 'NC_Months' in row else parse_nc_months(row['KO_Type'])
+        nc_end_date = row['IssueDate'] + relativedelta(months=nc_months)
+        
+        is_dra = "DRA" in str(row['Product_Type']).upper()
+        is_aki = "AKI" in str(row['KI_Type']).upper()
+        
+        assets = []
+        
+        # 填入標的與自動抓價
+        for i in range(1, 6):
+            code = row.get(f'T{i}_Code', "")
+            if code == "": continue
+            
+            initial = float(row.get(f'T{i}_Initial', 0))
+            
+            if initial == 0:
+                trade_date = row['TradeDate']
+                if pd.notna(trade_date):
+                    # 交易日 (含) 之後的第一筆收盤價，查標的索引 O(log n)
+                    ix = history.ticker_index(code)
+                    hit = ix.first_on_or_after(trade_date) if ix is not None else None
+                    if hit is not None: initial = hit[1]
+            
+            if initial > 0:
+                assets.append({
+                    'code': code, 'initial': initial, 'strike_price': initial * strike_thresh, 
+                    'locked_ko': False, 'hit_ki': False, 'perf': 0.0, 'price': 0.0,
+                    'ko_record': '', 'ki_record': ''
+                })
+        
+        if not assets: continue
+
+        # 抓現價
+        for asset in assets:
+            curr = last_prices.get(asset['code'], float('nan'))
+            if pd.notna(curr):
+                asset['price'] = float(curr)
+                asset['perf'] = asset['price'] / asset['initial']
+
+        products.append({
+            'row': row, 'assets': assets, 'codes': [a['code'] for a in assets],
+            'initials': [a['initial'] for a in assets],
+            'ko_thresh': ko_thresh, 'ki_thresh': ki_thresh, 'strike_thresh': strike_thresh,
+            'nc_months': nc_months, 'nc_end_date': nc_end_date, 'issue_date': row['IssueDate'],
+            'is_dra': is_dra, 'is_aki': is_aki,
+        })
+
+    return products
+
+
+def settle_date(today_ts):
+    # 檢查點只記到這天為止，之後的收盤價可能還會修正
+    return pd.Timestamp(today_ts).normalize() - timedelta(days=REFRESH_DAYS)
+
+
+def backtest(products, history_data, today_ts, state_store=None):
+    # 5-2. 回測 (整批向量化；有檢查點時只跑新交易日)
+    if state_store is None:
+        return evaluate_barriers(history_data, products, today_ts)
+
+    keys = [terms_key(p) for p in products]
+    barrier_results = evaluate_barriers(history_data, products, today_ts,
+                                        states=state_store.load(keys), settle_ts=settle_date(today_ts))
+    state_store.save(keys, [p['row']['ID'] for p in products], [r.pop('state') for r in barrier_results])
+    return barrier_results
+
+
+def priority_order(products, today_ts, states=None):
+    # 先算值得先看的商品：已到期、(檢查點上) 已提前出場或 KI 已破、現價已跌破 KI；其餘維持原順序
+    states = states if states is not None else [None] * len(products)
+    later = []
+    for p, st in zip(products, states):
+        val = p['row'].get('ValuationDate')
+        hit = (pd.notna(val) and today_ts >= val) or any(a['price'] > 0 and a['perf'] < p['ki_thresh'] for a in p['assets'])
+        if st is not None:
+            hit = hit or st['early_redemption_date'] is not None or any(a['hit_ki'] for a in st['assets'])
+        later.append(not hit)
+    return sorted(range(len(products)), key=later.__getitem__)
+
+
+def build_notifications(products, barrier_results, today_ts, lookback_days=3, notify_ki_daily=True):
+    results = []
+    individual_messages = [] 
+    admin_summary_list = []
+    lookback_date = today_ts - timedelta(days=lookback_days)
+
+    # 5-3. 狀態判斷與通知
+    for prod, barrier in zip(products, barrier_results):
+        row = prod['row']; assets = prod['assets']
+        ki_thresh = prod['ki_thresh']; strike_thresh = prod['strike_thresh']
+        nc_months = prod['nc_months']; nc_end_date = prod['nc_end_date']
+        is_dra = prod['is_dra']; is_aki = prod['is_aki']
+
+        for asset, state in zip(assets, barrier['assets']):
+            asset.update(state)
+
+        early_redemption_date = barrier['early_redemption_date']
+        product_status = "Early Redemption" if early_redemption_date is not None else "Running"
+
+        locked_list = []; waiting_list = []; hit_ki_list = []; shadow_ko_list = []
+        detail_cols = {}
+        asset_detail_str = "" 
+        any_below_strike_today = False
+        dra_fail_list = []
+
+        for i, asset in enumerate(assets):
+            if asset['price'] > 0:
+                if not is_aki and asset['perf'] < ki_thresh: asset['hit_ki'] = True 
+                if is_dra and asset['perf'] < strike_thresh:
+                    any_below_strike_today = True
+                    dra_fail_list.append(asset['code'])
+
+            if asset['locked_ko']: locked_list.append(asset['code'])
+            else: waiting_list.append(asset['code'])
+            if asset['hit_ki']: hit_ki_list.append(asset['code'])
+            
+            p_pct = round(asset['perf']*100, 2) if asset['price'] > 0 else 0.0
+            status_icon = "✅" if asset['locked_ko'] else "⚠️" if asset['hit_ki'] else ""
+            
+            if is_dra and asset['price'] > 0:
+                if asset['perf'] < strike_thresh: status_icon += "🛑無息"
+                else: status_icon += "💸"
+
+            price_display = round(asset['price'], 2) if asset['price'] > 0 else "N/A"
+            initial_display = round(asset['initial'], 2)
+            
+            cell_text = f"【{asset['code']}】\n原: {initial_display}\n現: {price_display}\n({p_pct}%) {status_icon}"
+            if asset['locked_ko']: cell_text += f"\nKO {asset['ko_record']}"
+            if asset['hit_ki']: cell_text += f"\nKI {asset['ki_record']}"
+            detail_cols[f"T{i+1}_Detail"] = cell_text
+
+            # 表格用的型別欄位 (數字不轉字串，前端可排序/格式化)
+            flag = status_icon
+            if asset['locked_ko']: flag += f" KO {asset['ko_record']}"
+            if asset['hit_ki']: flag += f" KI {asset['ki_record']}"
+            detail_cols[f"T{i+1}_Code"] = asset['code']
+            detail_cols[f"T{i+1}_Perf"] = p_pct if asset['price'] > 0 else float('nan')
+            detail_cols[f"T{i+1}_Price"] = round(asset['price'], 2) if asset['price'] > 0 else float('nan')
+            detail_cols[f"T{i+1}_Flag"] = flag.strip()
+            detail_cols[f"T{i+1}_KO"] = asset['ko_record'] if asset['locked_ko'] else ""
+            detail_cols[f"T{i+1}_KI"] = asset['ki_record'] if asset['hit_ki'] else ""
+            
+            asset_detail_str += f"{asset['code']}: {p_pct}% {status_icon} (原:{initial_display})\n"
+
+        hit_any_ki = any(a['hit_ki'] for a in assets)
+        all_above_strike_now = all((a['perf'] >= strike_thresh if a['price'] > 0 else False) for a in assets)
+        
+        valid_assets = [a for a in assets if a['perf'] > 0]
+        if valid_assets:
+            worst_asset = min(valid_assets, key=lambda x: x['perf'])
+            worst_perf = worst_asset['perf']
+        else:
+            worst_perf = 0
+        
+        final_status = ""
+        line_status_short = "" 
+        need_notify = False
+        dra_paused = False
+
+        # 狀態判斷
+        if today_ts < row['IssueDate']:
+            final_status = "⏳ 未發行"
+        elif product_status == "Early Redemption":
+            final_status = f"🎉 提前出場\n({early_redemption_date.strftime('%Y-%m-%d')})"
+            if early_redemption_date >= lookback_date:
+                line_status_short = "🎉 恭喜！已提前出場 (KO)"
+                need_notify = True
+            else:
+                line_status_short = f"🎉 已於 {early_redemption_date.strftime('%Y-%m-%d')} 提前出場 (舊)"
+                need_notify = False
+        elif pd.notna(row['ValuationDate']) and today_ts >= row['ValuationDate']:
+            is_recent = row['ValuationDate'] >= lookback_date
+            if all_above_strike_now:
+                 final_status = "💰 到期獲利"
+                 line_status_short = "💰 到期獲利"
+            elif hit_any_ki:
+                 final_status = f"😭 到期接股"
+                 line_status_short = f"😭 到期接股"
+            else:
+                 final_status = "🛡️ 到期保本"
+                 line_status_short = "🛡️ 到期保本"
+            need_notify = is_recent
+            if not is_recent: line_status_short += " (舊)"
+        else:
+            if today_ts < nc_end_date:
+                final_status = f"🔒 NC閉鎖期\n(至 {nc_end_date.strftime('%Y-%m-%d')})"
+            else:
+                final_status = f"👀 比價中"
+            
+            if hit_any_ki:
+                final_status += f"\n⚠️ KI已破"
+                line_status_short = f"⚠️ 注意：KI 已跌破 ({','.join(hit_ki_list)})"
+                need_notify = notify_ki_daily
+            
+            if is_dra:
+                if any_below_strike_today:
+                    dra_paused = True
+                    final_status += f"\n🛑 DRA暫停計息 ({','.join(dra_fail_list)}跌破)"
+                    if notify_ki_daily: 
+                        line_status_short = f"⚠️ DRA 暫停計息 ({','.join(dra_fail_list)} 跌破執行價)"
+                        need_notify = True
+                else:
+                    final_status += "\n💸 DRA計息中 (全數高於執行價)"
+
+        if line_status_short:
+            admin_summary_list.append(f"● {row['ID']} ({row['Name']}): {line_status_short}")
+
+        emails = [x.strip() for x in re.split(r'[;,，]', str(row.get('Email', ''))) if x.strip()]
+        
+        mat_date_str = row['MaturityDate'].strftime('%Y-%m-%d') if pd.notna(row['MaturityDate']) else "-"
+        common_msg_body = (
+            f"Hi {row['Name']} 您好，\n"
+            f"您的結構型商品 {row['ID']} ({row['Product_Type']}) 最新狀態：\n\n"
+            f"【{line_status_short}】\n\n"
+            f"{asset_detail_str}"
+            f"📅 到期日: {mat_date_str}\n"
+            f"------------------\n"
+            f"貼心通知"
+        )
+
+        if need_notify and line_status_short and emails:
+            for mail in emails:
+                if "@" in mail:
+                    subject = f"【ELN通知】{row['ID']} 最新狀態"
+                    mail_body = common_msg_body + "\n(本信件由系統自動發送)"
+                    individual_messages.append({
+                        'target': mail, 'subj': subject, 'msg': mail_body,
+                        'id': row['ID'], 'name': row['Name'], 'event': line_status_short,
+                        'section': digest_section(row, line_status_short, asset_detail_str, mat_date_str),
+                    })
+
+        row_res = {
+            "債券代號": row['ID'], "Name": row['Name'], "Type": row['Product_Type'],
+            "狀態": final_status, "最差表現": f"{round(worst_perf*100, 2)}%",
+            "交易日": row['TradeDate'].strftime('%Y-%m-%d') if pd.notna(row['TradeDate']) else "-",
+            "NC月份": f"{nc_months}M",
+            "狀態分類": final_status.split("\n")[0], "KI已破": hit_any_ki, "DRA暫停": dra_paused,
+            "最差表現%": round(worst_perf*100, 2),
+        }
+        row_res.update(detail_cols)
+        results.append(row_res)
+
+    return results, individual_messages, admin_summary_list
+
+
+def digest_section(row, line_status_short, asset_detail_str, mat_date_str):
+    # 彙整信中每檔商品一段，內容同單檔通知
+    return (
+        f"■ {row['ID']} ({row['Product_Type']})\n"
+        f"【{line_status_short}】\n"
+        f"{asset_detail_str}"
+        f"📅 到期日: {mat_date_str}\n"
+    )
+
+
+def build_digests(individual_messages, today_ts):
+    # 同一個收件人 (不分大小寫) 的所有通知併成一封，同一檔商品只列一次
+    groups = {}
+    for m in individual_messages:
+        key = m['target'].strip().lower()
+        g = groups.setdefault(key, {'target': m['target'].strip(), 'names': [], 'ids': [], 'sections': [], 'parts': []})
+        if m['id'] in g['ids']: continue
+        g['ids'].append(m['id']); g['names'].append(m['name']); g['sections'].append(m['section'])
+        # 彙整前的各則通知 (不含信件內文)，寄信佇列依此逐則去重
+        g['parts'].append({k: m.get(k) for k in ('target', 'id', 'name', 'event', 'section')})
+
+    digests = []
+    for g in groups.values():
+        names = set(g['names'])
+        name = g['names'][0] if len(names) == 1 else "貴賓"
+        msg = (
+            f"Hi {name} 您好，\n"
+            f"您有 {len(g['ids'])} 檔結構型商品最新狀態：\n\n"
+            + "\n".join(g['sections']) +
+            f"------------------\n"
+            f"貼心通知\n(本信件由系統自動發送)"
+        )
+        subj = f"【ELN通知】{g['ids'][0]} 最新狀態" if len(g['ids']) == 1 else \
+               f"【ELN通知】{len(g['ids'])} 檔商品最新狀態 ({today_ts.strftime('%Y/%m/%d')})"
+        digests.append({'target': g['target'], 'subj': subj, 'msg': msg, 'ids': g['ids'], 'parts': g['parts']})
+    return digests
+
+
+def notified_products(messages):
+    return len({i for m in messages for i in m.get('ids', [m.get('id')])})
+
+
+def admin_summary_text(admin_summary_list, client_count, today_ts, product_count=None):
+    summary_text = f"今日摘要报告 ({today_ts.strftime('%Y/%m/%d')})\n----------------\n" + "\n".join(admin_summary_list)
+    if client_count > 0 and product_count is not None:
+        summary_text += f"\n\n(系統將發送 {client_count} 封彙整信件，涵蓋 {product_count} 檔商品)"
+    elif client_count > 0: summary_text += f"\n\n(系統將發送 {client_count} 封客戶信件)"
+    else: summary_text += f"\n\n(今日無須發送客戶信件)"
+    return summary_text
+
+
+def admin_subject(today_ts, book=None):
+    # 多個部位檔時每個部位檔一封，主旨帶部位檔名稱
+    return f"【ELN 戰情快報 (Admin)】{f' {book}' if book else ''} {today_ts.strftime('%Y/%m/%d')}"
+
+
+# ==========================================
+# 📋 監控表格 (型別欄位 + 伺服器端篩選/分頁)
+# ==========================================
+# 不再用 Styler 逐格上色：狀態燈號預先算好成一欄，數字維持數字，
+# 篩選與分頁在伺服器端做完，只把目前這一頁送到瀏覽器。
+
+# 判斷順序同舊版底色：綠 → 紅 → 黃
+STATUS_LIGHTS = [("🟢", ("提前", "獲利", "計息中")), ("🔴", ("接股", "KI", "暫停")), ("🟡", ("未發行", "NC"))]
+MAX_ASSETS = 5
+
+
+def results_frame(results):
+    df = pd.DataFrame(results)
+    if df.empty: return df
+    status = df['狀態'].astype(str)
+    conds = [status.str.contains("|".join(words), regex=True) for _, words in STATUS_LIGHTS]
+    df.insert(0, '燈號', np.select(conds, [light for light, _ in STATUS_LIGHTS], ""))
+    for col in ('Book', '燈號', '狀態分類', 'Type', 'Name'):
+        if col in df.columns: df[col] = df[col].astype('category')
+    df['交易日'] = pd.to_datetime(df['交易日'], errors='coerce')
+    return df
+
+
+def underlying_codes(df):
+    codes = set()
+    for i in range(1, MAX_ASSETS + 1):
+        if f'T{i}_Code' in df.columns: codes.update(c for c in df[f'T{i}_Code'].dropna().unique() if c)
+    return sorted(codes)
+
+
+def filter_results(df, statuses=None, names=None, underlyings=None, books=None):
+    mask = pd.Series(True, index=df.index)
+    if books: mask &= df['Book'].isin(books)
+    if statuses: mask &= df['狀態分類'].isin(statuses)
+    if names: mask &= df['Name'].isin(names)
+    if underlyings:
+        hit = pd.Series(False, index=df.index)
+        for i in range(1, MAX_ASSETS + 1):
+            if f'T{i}_Code' in df.columns: hit |= df[f'T{i}_Code'].isin(underlyings)
+        mask &= hit
+    return df[mask]
+
+
+def page_count(n_rows, page_size):
+    return max(1, -(-n_rows // page_size))
+
+
+def page_slice(df, page, page_size):
+    # page 從 1 開始，超出範圍時夾到最後一頁
+    n_pages = page_count(len(df), page_size)
+    page = min(max(1, int(page)), n_pages)
+    return df.iloc[(page - 1) * page_size: page * page_size], n_pages
+
+
+def table_columns(df):
+    t_cols = []
+    for i in range(1, MAX_ASSETS + 1):
+        t_cols += [c for c in (f'T{i}_Code', f'T{i}_Perf', f'T{i}_Price', f'T{i}_Flag') if c in df.columns]
+    mc_cols = [c for c in ('KO機率%', 'KI機率%', '接股機率%') if c in df.columns]
+    book_col = ['Book'] if 'Book' in df.columns and df['Book'].nunique() > 1 else []
+    return ['燈號'] + book_col + ['債券代號', 'Type', 'Name', '狀態分類', '最差表現%'] + mc_cols + t_cols + ['KI已破', 'DRA暫停', '交易日', '狀態']
+
+
+def run_book(clean_df, price_store, today_ts, lookback_days=3, notify_ki_daily=True, state_store=None,
+             metrics=None, digest=False, symbols=None, **labels):
+    # 一次跑完：股價 → 回測 → 通知，回傳 dict；各階段耗時記在 metrics (labels 例如 book=...)
+    # digest=True 時 individual_messages 改為每位收件人一封彙整信；symbols (SymbolMaster) 先套用手動對照
+    today_ts = pd.Timestamp(today_ts)
+    metrics = metrics or RunMetrics()
+    if symbols is not None: clean_df = symbols.apply(clean_df)
+    all_tickers = collect_tickers(clean_df)
+    if not all_tickers:
+        raise ValueError("❌ 找不到有效的標的代號。")
+    with metrics.stage("prices", **labels) as rec:
+        history_data = fetch_history(price_store, all_tickers, download_windows(clean_df, today_ts), today_ts, symbols)
+        rec['tickers'] = len(all_tickers)
+        rec['downloaded_rows'] = price_store.last_download_rows
+        rec['price_bytes'] = history_data.nbytes
+        rec['missing_tickers'] = sum(1 for r in price_store.last_report if r['status'] == 'missing')
+        rec['skipped_tickers'] = sum(1 for r in price_store.last_report if r['status'] == 'skipped')
+    with metrics.stage("evaluate", **labels) as rec:
+        products, barrier_results = prepare_products(clean_df, history_data, today_ts, state_store)
+        rec['products'] = len(products)
+        rec['price_days'] = len(history_data)
+    with metrics.stage("notify", **labels) as rec:
+        results, individual_messages, admin_summary_list = build_notifications(
+            products, barrier_results, today_ts, lookback_days, notify_ki_daily)
+        if digest: individual_messages = build_digests(individual_messages, today_ts)
+        rec['messages'] = len(individual_messages)
+        rec['products_notified'] = notified_products(individual_messages)
+        rec['events'] = len(admin_summary_list)
+    return {
+        'results': results, 'individual_messages': individual_messages,
+        'admin_summary_list': admin_summary_list, 'tickers': all_tickers, 'metrics': metrics,
+        'coverage': price_store.last_report,
+        'products': products, 'barrier_results': barrier_results, 'history_data': history_data,
+    }
@@ -0,0 +1,167 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from eln.engine import MAX_ASSETS, STATUS_LIGHTS, results_frame
+
+# ==========================================
+# 💾 監控結果匯出 (XLSX / Parquet / CSV，分批寫入)
+# ==========================================
+# 結果一批一批轉成 DataFrame 寫出，不先組出整張表再整張轉檔。
+# XLSX 用 xlsxwriter 的 constant_memory 模式 (寫完一列即落地)，
+# 狀態底色用條件式格式 (整欄一條規則)，不逐格設定樣式。
+# 欄位固定 (標的欄補到 MAX_ASSETS)，每一批的 schema 一致，Parquet 才能逐批附加。
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+    "csv": "text/csv",
+}
+BATCH_ROWS = 2000
+
+TEXT_COLUMNS = {'Book', '債券代號', 'Name', 'Type', '燈號', '狀態分類', '狀態', 'NC月份'}
+BOOL_COLUMNS = {'KI已破', 'DRA暫停'}
+DATE_COLUMNS = {'交易日'}
+
+# 條件式格式的底色 (同舊版表格)：綠 → 紅 → 黃，先符合的優先
+LIGHT_FORMATS = {
+    "🟢": {'bg_color': '#d4edda', 'font_color': 'green'},
+    "🔴": {'bg_color': '#f8d7da', 'font_color': 'red'},
+    "🟡": {'bg_color': '#fff3cd', 'font_color': '#856404'},
+}
+
+
+def export_columns(n_assets=MAX_ASSETS, extra=(), book=False):
+    cols = (['Book'] if book else []) + ['債券代號', 'Name', 'Type', '燈號', '狀態分類', '狀態', '最差表現%',
+                                         'KI已破', 'DRA暫停', '交易日', 'NC月份'] + list(extra)
+    for i in range(1, n_assets + 1):
+        cols += [f'T{i}_Code', f'T{i}_Price', f'T{i}_Perf', f'T{i}_KO', f'T{i}_KI']
+    return cols
+
+
+def _is_text(col):
+    return col in TEXT_COLUMNS or (col.startswith('T') and col.endswith(('_Code', '_KO', '_KI')))
+
+
+def conform(df, columns):
+    # 補齊 / 排好欄位並固定型別：文字 "" 補空、數字 float、日期 datetime
+    df = df.reindex(columns=columns)
+    for col in columns:
+        if col in BOOL_COLUMNS: df[col] = df[col].fillna(False).astype(bool)
+        elif col in DATE_COLUMNS: df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif _is_text(col): df[col] = df[col].astype(object).where(df[col].notna(), "").astype(str)
+        else: df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float64)
+    return df
+
+
+def arrow_schema(columns):
+    import pyarrow as pa
+    def typ(col):
+        if col in BOOL_COLUMNS: return pa.bool_()
+        if col in DATE_COLUMNS: return pa.timestamp('ns')
+        if _is_text(col): return pa.string()
+        return pa.float64()
+    return pa.schema([(c, typ(c)) for c in columns])
+
+
+class ResultExporter:
+    """
+    with ResultExporter(path 或 BytesIO, "xlsx", columns) as ex:
+        ex.write_frame(df)   # 可呼叫多次，依序附加
+    """
+
+    def __init__(self, target, fmt, columns):
+        if fmt not in EXPORT_FORMATS: raise ValueError(f"unsupported export format: {fmt}")
+        self.target = target
+        self.fmt = fmt
+        self.columns = list(columns)
+        self.rows = 0
+        self._fh = None
+        self._writer = None
+        self._open()
+
+    def _open(self):
+        if self.fmt == "csv":
+            self._fh = open(self.target, "wb") if isinstance(self.target, str) else self.target
+            self._fh.write("\ufeff".encode("utf-8"))  # Excel 開 CSV 才認得中文
+        elif self.fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._schema = arrow_schema(self.columns)
+            self._writer = pq.ParquetWriter(self.target, self._schema)
+        else:
+            import xlsxwriter
+            self._writer = xlsxwriter.Workbook(self.target, {'constant_memory': True})
+            self._sheet = self._writer.add_worksheet("ELN")
+            self._date_fmt = self._writer.add_format({'num_format': 'yyyy-mm-dd'})
+            self._sheet.write_row(0, 0, self.columns, self._writer.add_format({'bold': True}))
+            self._sheet.freeze_panes(1, 0)
+
+    def write_frame(self, df):
+        df = conform(df, self.columns)
+        if self.fmt == "csv":
+            self._fh.write(df.to_csv(index=False, header=self.rows == 0, date_format="%Y-%m-%d").encode("utf-8"))
+        elif self.fmt == "parquet":
+            import pyarrow as pa
+            self._writer.write_table(pa.Table.from_pandas(df, schema=self._schema, preserve_index=False))
+        else:
+            self._write_xlsx_rows(df)
+        self.rows += len(df)
+
+    def _write_xlsx_rows(self, df):
+        date_cols = [j for j, c in enumerate(self.columns) if c in DATE_COLUMNS]
+        for r, values in enumerate(df.itertuples(index=False, name=None), start=self.rows + 1):
+            for j, v in enumerate(values):
+                if j in date_cols:
+                    if pd.notna(v): self._sheet.write_datetime(r, j, v.to_pydatetime(), self._date_fmt)
+                elif isinstance(v, float) and np.isnan(v): continue
+                elif v != "": self._sheet.write(r, j, v)
+
+    def _status_formats(self):
+        # 整欄一條規則，依 STATUS_LIGHTS 的關鍵字上色
+        if not self.rows: return
+        for col in ('燈號', '狀態分類', '狀態'):
+            if col not in self.columns: continue
+            j = self.columns.index(col)
+            for light, words in STATUS_LIGHTS:
+                fmt = self._writer.add_format(LIGHT_FORMATS[light])
+                for word in ((light,) if col == '燈號' else words):
+                    self._sheet.conditional_format(1, j, self.rows, j, {
+                        'type': 'text', 'criteria': 'containing', 'value': word, 'format': fmt, 'stop_if_true': True})
+
+    def close(self):
+        if self.fmt == "csv":
+            if isinstance(self.target, str): self._fh.close()
+        elif self.fmt == "parquet":
+            self._writer.close()
+        else:
+            self._status_formats()
+            self._writer.close()
+
+    def __enter__(self): return self
+
+    def __exit__(self, *exc): self.close()
+
+
+def export_format(path):
+    ext = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+    return ext if ext in EXPORT_FORMATS else None
+
+
+def export_results(exporter, results, extra=None, book=None, batch_rows=BATCH_ROWS):
+    # results (list of dict) 每 batch_rows 檔轉成一批寫出；extra 為與 results 對齊的附加欄 (例如機率)
+    for start in range(0, len(results), batch_rows):
+        chunk = results_frame(results[start:start + batch_rows])
+        if extra is not None:
+            chunk = pd.concat([chunk, extra.iloc[start:start + batch_rows].reset_index(drop=True)], axis=1)
+        if book is not None: chunk.insert(0, 'Book', book)
+        exporter.write_frame(chunk)
+
+
+def export_bytes(df, fmt, columns, batch_rows=BATCH_ROWS):
+    # 網頁下載用：整張表分批寫進記憶體檔
+    buf = io.BytesIO()
+    with ResultExporter(buf, fmt, columns) as ex:
+        for start in range(0, len(df), batch_rows):
+            ex.write_frame(df.iloc[start:start + batch_rows])
+    return buf.getvalue()
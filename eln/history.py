@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 🧱 股價的緊湊存放 (每個代號各自一段，不補 NaN)
+# ==========================================
+# 日期 x 代號 的 DataFrame 以最早的商品為起點：一檔很舊的商品就讓所有代號都多出好幾年的 NaN。
+# 這裡每個代號只存自己有的 (日期, 收盤價)，全部接成一條陣列，offsets[i]:offsets[i+1] 為第 i 個代號的區段。
+# 日期存 int32 天數、收盤價存 float32 (約 7 位有效數字)，讀出時依各代號的量級四捨五入回原本的小數位。
+# 回測不再切矩陣：每個代號建一次區間查詢索引 (TickerIndex)，同一標的的所有商品共用，
+# 以 O(log n) 找出「某日之後第一次跌破 / 站上某價位」。
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+SIG_DIGITS = 7
+
+
+def _to_days(dates):
+    return (pd.DatetimeIndex(dates).values.astype('datetime64[D]') - EPOCH).astype(np.int32)
+
+
+def _to_dates(days):
+    return pd.DatetimeIndex((EPOCH + days.astype('timedelta64[D]')).astype('datetime64[ns]'))
+
+
+def _decimals(values):
+    # float32 約可還原 7 位有效數字：依這檔的最大價位決定小數位
+    values = np.abs(values[np.isfinite(values)])
+    top = values.max() if len(values) else 0.0
+    if top <= 0: return SIG_DIGITS - 1
+    return int(np.clip(SIG_DIGITS - 1 - np.floor(np.log10(top)), 0, 12))
+
+
+class PriceHistory:
+    """
+    tickers: 代號 list；offsets: 長度 len(tickers) + 1；days: 1970-01-01 起算的天數 (各區段內遞增)；
+    values: 收盤價 (float32 或 float64)；decimals: 各代號讀出時四捨五入的小數位 (-1 表示不處理)。
+    """
+
+    def __init__(self, tickers, offsets, days, values, decimals=None):
+        self.tickers = list(tickers)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.days = np.asarray(days, dtype=np.int32)
+        self.values = np.asarray(values)
+        self.decimals = (np.asarray(decimals, dtype=np.int8) if decimals is not None
+                         else np.full(len(self.tickers), -1, dtype=np.int8))
+        self._col = {t: i for i, t in enumerate(self.tickers)}
+        self._index = None
+        self._pos = None
+        self._ix = {}
+
+    @classmethod
+    def from_long(cls, long_df, tickers=None, dtype=np.float32):
+        # long_df：ticker / date / close 三欄 (同 SQLite 的 prices 表)；同代號同日重複時取最後一筆
+        long_df = long_df.dropna(subset=['close'])
+        tickers = list(dict.fromkeys(tickers)) if tickers is not None else sorted(long_df['ticker'].unique())
+        codes = pd.Categorical(long_df['ticker'], categories=tickers).codes.astype(np.int64)
+        days = _to_days(pd.to_datetime(long_df['date']))
+        closes = long_df['close'].to_numpy(dtype=np.float64)
+        keep = codes >= 0
+        codes, days, closes = codes[keep], days[keep], closes[keep]
+        order = np.lexsort((np.arange(len(codes)), days, codes))
+        codes, days, closes = codes[order], days[order], closes[order]
+        last = np.append((codes[1:] != codes[:-1]) | (days[1:] != days[:-1]), True)
+        codes, days, closes = codes[last], days[last], closes[last]
+        offsets = np.searchsorted(codes, np.arange(len(tickers) + 1), side='left')
+        decimals = None
+        if np.dtype(dtype) == np.float32:
+            decimals = [_decimals(closes[offsets[i]:offsets[i + 1]]) for i in range(len(tickers))]
+        return cls(tickers, offsets, days, closes.astype(dtype), decimals)
+
+    @classmethod
+    def from_frame(cls, frame, dtype=np.float64):
+        # 日期 x 代號 的 DataFrame (yf.download 的格式)；預設保留 float64，數值不變
+        long_df = frame.rename_axis(index='date').reset_index().melt(id_vars='date', var_name='ticker',
+                                                                       value_name='close')
+        return cls.from_long(long_df, list(frame.columns), dtype)
+
+    @property
+    def columns(self):
+        return self.tickers
+
+    @property
+    def index(self):
+        # 全部代號交易日的聯集 (排序)
+        if self._index is None:
+            self._index = _to_dates(np.unique(self.days))
+        return self._index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, code):
+        return code in self._col
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.days.nbytes + self.values.nbytes + self.decimals.nbytes
+
+    def _segment(self, i, lo=None, hi=None):
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return slice(a if lo is None else a + lo, b if hi is None else a + hi)
+
+    def _decode(self, i, values):
+        values = values.astype(np.float64)
+        return np.round(values, self.decimals[i]) if self.decimals[i] >= 0 else values
+
+    def arrays(self, code):
+        # (days, 收盤價 float64)；沒有這個代號時為兩個空陣列
+        i = self._col.get(code)
+        if i is None: return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64)
+        seg = self._segment(i)
+        return self.days[seg], self._decode(i, self.values[seg])
+
+    def __getitem__(self, code):
+        if code not in self._col: raise KeyError(code)
+        days, values = self.arrays(code)
+        return pd.Series(values, index=_to_dates(days).rename('Date'), name=code)
+
+    def latest(self, today_ts):
+        # 每個代號在今天 (含) 以前的最後一筆收盤價；沒有資料的代號為 NaN
+        cutoff = _to_days([pd.Timestamp(today_ts).normalize()])[0]
+        out = np.full(len(self.tickers), np.nan)
+        for i in range(len(self.tickers)):
+            seg = self._segment(i)
+            k = np.searchsorted(self.days[seg], cutoff, side='right')
+            if k: out[i] = self._decode(i, self.values[seg][k - 1:k])[0]
+        return pd.Series(out, index=self.tickers, dtype=float)
+
+    def _positions(self):
+        # 每筆資料在聯集日期上的位置 (與 values 對齊)
+        if self._pos is None:
+            self._pos = np.searchsorted(_to_days(self.index), self.days).astype(np.int32)
+        return self._pos
+
+    def ticker_index(self, code):
+        # 該代號的 TickerIndex (第一次用到時建立，之後沿用)；沒有這個代號時為 None
+        i = self._col.get(code)
+        if i is None: return None
+        if code not in self._ix:
+            seg = self._segment(i)
+            self._ix[code] = TickerIndex(self.days[seg], self._decode(i, self.values[seg]), self._positions()[seg])
+        return self._ix[code]
+
+    def block(self, codes, lo=0, hi=None):
+        # 聯集日期 [lo, hi) x codes 的 float64 矩陣，缺值 (含不存在的代號) 為 NaN
+        hi = len(self.index) if hi is None else hi
+        out = np.full((max(hi - lo, 0), len(codes)), np.nan)
+        pos = self._positions()
+        for c, code in enumerate(codes):
+            i = self._col.get(code)
+            if i is None: continue
+            seg = self._segment(i)
+            p = pos[seg]
+            a, b = np.searchsorted(p, lo, side='left'), np.searchsorted(p, hi, side='left')
+            if a < b: out[p[a:b] - lo, c] = self._decode(i, self.values[seg][a:b])
+        return out
+
+    def to_frame(self, end=None):
+        # 轉回 日期 x 代號 的 DataFrame (只給需要整張表的地方用，例如波動度校準)
+        dates = self.index
+        hi = dates.searchsorted(pd.Timestamp(end), side='right') if end is not None else len(dates)
+        frame = pd.DataFrame(self.block(self.tickers, 0, hi), index=dates[:hi].rename('Date'), columns=self.tickers)
+        frame.columns.name = None
+        return frame
+
+
+class TickerIndex:
+    """
+    單一代號的區間查詢索引：sparse table 存每個 2^k 長度區段的最小 / 最大收盤價，
+    O(n log n) 建表，查詢「位置 lo 起第一筆 < 價位 / >= 價位」以倍增跳躍，O(log n)。
+    查詢全部向量化：同一標的的所有商品 (各自的起點與價位) 一次查完。
+    days / values: 該代號的交易日與收盤價；upos: 各交易日在 PriceHistory 聯集日期上的位置。
+    """
+
+    def __init__(self, days, values, upos):
+        self.days = days
+        self.values = values
+        self.upos = upos
+        # 0 與 NaN 不是有效收盤價，不能觸發任何條件
+        valid = np.isfinite(values) & (values != 0)
+        self._mins = [np.where(valid, values, np.inf)]
+        self._maxs = [np.where(valid, values, -np.inf)]
+        k = 1
+        while (1 << k) <= len(values):
+            half = 1 << (k - 1)
+            self._mins.append(np.minimum(self._mins[-1][:-half], self._mins[-1][half:]))
+            self._maxs.append(np.maximum(self._maxs[-1][:-half], self._maxs[-1][half:]))
+            k += 1
+
+    def __len__(self):
+        return len(self.values)
+
+    def locate(self, upos):
+        # 聯集日期位置 → 本代號第一筆 >= 該位置的索引
+        return np.searchsorted(self.upos, upos, side='left')
+
+    def first_on_or_after(self, ts):
+        # (日期, 收盤價)：時間 >= ts 的第一筆 (交易日視為當天 00:00)；沒有則為 None
+        ts = pd.Timestamp(ts)
+        day = _to_days([ts.normalize()])[0] + (ts != ts.normalize())
+        i = int(np.searchsorted(self.days, day, side='left'))
+        if i >= len(self.values): return None
+        return _to_dates(self.days[i:i + 1])[0], float(self.values[i])
+
+    def _lift(self, tables, lo, hi, skip):
+        # 從 lo 往後，整段都「不符合」(skip) 的區段就跳過；回傳第一個符合的位置，找不到為 hi
+        p = np.asarray(lo, dtype=np.int64).copy()
+        hi = np.broadcast_to(np.asarray(hi, dtype=np.int64), p.shape)
+        if not len(self.values): return np.maximum(p, hi)
+        for k in range(len(tables) - 1, -1, -1):
+            step = 1 << k
+            ok = p + step <= hi
+            jump = ok & skip(tables[k][np.where(ok, p, 0)])
+            p = np.where(jump, p + step, p)
+        return np.where(p < hi, p, hi)
+
+    def first_below(self, lo, hi, level):
+        # 第一筆收盤價 < level 的位置
+        level = np.asarray(level, dtype=np.float64)
+        return self._lift(self._mins, lo, hi, lambda m: m >= level)
+
+    def first_at_or_above(self, lo, hi, level):
+        # 第一筆收盤價 >= level 的位置
+        level = np.asarray(level, dtype=np.float64)
+        return self._lift(self._maxs, lo, hi, lambda m: m < level)
+
+
+def as_price_history(history_data):
+    return history_data if isinstance(history_data, PriceHistory) else PriceHistory.from_frame(history_data)
@@ -0,0 +1,311 @@
+import io
+import re
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+# ==========================================
+# 📥 讀檔與欄位正規化
+# ==========================================
+
+# 🌟 [修復版] 代號清洗器 (支援 US 結尾)
+def clean_ticker_symbol(ticker):
+    if pd.isna(ticker): return ""
+    t = str(ticker).strip().upper()
+    
+    # 使用 Regex 移除美股常見後綴 (包含 US)
+    t = re.sub(r'\s+(UW|UN|UQ|UP|US)$', '', t)
+    
+    # 其他國家後綴轉換
+    if t.endswith(" JT"): return t.replace(" JT", ".T") 
+    if t.endswith(" TT"): return t.replace(" TT", ".TW") 
+    if t.endswith(" HK"): return t.replace(" HK", ".HK") 
+    return t
+
+
+# 🌟 NC 智慧判讀
+def parse_nc_months(ko_type_val):
+    s = str(ko_type_val).upper().strip()
+    if pd.isna(ko_type_val) or s == "" or s == "NAN": return 1 
+    match = re.search(r'(?:NC|LOCK|NON-CALL)\s*[:\-]?\s*(\d+)', s)
+    if match: return int(match.group(1))
+    if "DAILY" in s: return 1
+    return 1
+
+
+# 🌟 自動推算到期日
+def calculate_maturity(row, issue_date_col, tenure_col):
+    if 'MaturityDate' in row and pd.notna(row['MaturityDate']):
+        return row['MaturityDate']
+    
+    issue_date = row.get(issue_date_col)
+    tenure_str = str(row.get(tenure_col, ""))
+    
+    if pd.isna(issue_date) or issue_date == pd.NaT:
+        return pd.NaT
+        
+    try:
+        months_to_add = 0
+        match_m = re.search(r'(\d+)\s*M', tenure_str, re.IGNORECASE)
+        match_y = re.search(r'(\d+)\s*Y', tenure_str, re.IGNORECASE)
+        
+        if match_m:
+            months_to_add = int(match_m.group(1))
+        elif match_y:
+            months_to_add = int(match_y.group(1)) * 12
+        elif tenure_str.isdigit():
+            months_to_add = int(tenure_str)
+        
+        if months_to_add > 0:
+            return issue_date + relativedelta(months=months_to_add)
+    except: pass
+    return pd.NaT
+
+
+def clean_percentage(val):
+    if pd.isna(val) or str(val).strip() == "": return None
+    try:
+        s = str(val).replace('%', '').replace(',', '').strip()
+        return float(s)
+    except: return None
+
+
+def clean_name_str(val):
+    if pd.isna(val): return "貴賓"
+    s = str(val).strip()
+    if s.lower() == 'nan' or s == "": return "貴賓"
+    return s
+
+
+# 🌟 升級版欄位搜尋 (無視空格)
+def find_col_index(columns, include_keywords, exclude_keywords=None):
+    for idx, col_name in enumerate(columns):
+        col_str = str(col_name).strip().lower().replace(" ", "")
+        if exclude_keywords:
+            if any(ex in col_str for ex in exclude_keywords): continue
+        if any(inc in col_str for inc in include_keywords):
+            return idx, col_name
+    return None, None
+
+
+# ==========================================
+# ⚡ 欄位向量化版本 (整欄一次處理，結果與逐列版本相同)
+# ==========================================
+
+def _to_str(series):
+    # 等同逐格 str(x)：缺值也要變成 'nan' / 'None'
+    out = series.astype(str).astype(object)
+    miss = series.isna()
+    if miss.any(): out[miss] = series[miss].map(str)
+    return out
+
+
+def clean_ticker_series(series):
+    t = _to_str(series).str.strip().str.upper()
+    t = t.str.replace(r'\s+(UW|UN|UQ|UP|US)$', '', regex=True)
+    jt = t.str.endswith(" JT"); tt = t.str.endswith(" TT"); hk = t.str.endswith(" HK")
+    t = t.where(~jt, t.str.replace(" JT", ".T", regex=False))
+    t = t.where(~tt, t.str.replace(" TT", ".TW", regex=False))
+    t = t.where(~hk, t.str.replace(" HK", ".HK", regex=False))
+    return t.where(series.notna(), "").astype(str)
+
+
+def clean_percentage_series(series):
+    s = _to_str(series)
+    blank = series.isna() | (s.str.strip() == "")
+    num = pd.to_numeric(s.str.replace('%', '', regex=False).str.replace(',', '', regex=False).str.strip(), errors='coerce')
+    return num.where(~blank).astype(float)
+
+
+def clean_name_series(series):
+    s = _to_str(series).str.strip()
+    bad = series.isna() | (s.str.lower() == 'nan') | (s == "")
+    return s.where(~bad, "貴賓").astype(str)
+
+
+def nc_months_series(series):
+    s = _to_str(series).str.upper().str.strip()
+    found = s.str.extract(r'(?:NC|LOCK|NON-CALL)\s*[:\-]?\s*(\d+)', expand=False)
+    months = pd.to_numeric(found, errors='coerce').fillna(1).astype(int)
+    months[series.isna() | (s == "") | (s == "NAN")] = 1
+    return months
+
+
+def maturity_from_tenure(issue_dates, tenure):
+    # 天期優先序同 calculate_maturity：先找 M，再找 Y，最後純數字視為月
+    t = _to_str(tenure)
+    by_m = pd.to_numeric(t.str.extract(r'(\d+)\s*M', flags=re.IGNORECASE, expand=False), errors='coerce')
+    by_y = pd.to_numeric(t.str.extract(r'(\d+)\s*Y', flags=re.IGNORECASE, expand=False), errors='coerce') * 12
+    by_n = pd.to_numeric(t.where(t.str.isdigit().astype(bool)), errors='coerce')
+    months = by_m.fillna(by_y).fillna(by_n)
+
+    out = pd.Series(pd.NaT, index=issue_dates.index, dtype=issue_dates.dtype if str(issue_dates.dtype).startswith('datetime64') else 'datetime64[ns]')
+    valid = issue_dates.notna() & (months > 0)
+    # 同樣月數的一起加，DateOffset 與 relativedelta 一樣會把日期夾到月底
+    for n, idx in months[valid].groupby(months[valid]).groups.items():
+        try: out[idx] = issue_dates[idx] + pd.DateOffset(months=int(n))
+        except (OverflowError, ValueError): pass
+    return out
+
+
+def read_book(file_bytes):
+    try:
+        df = pd.read_excel(io.BytesIO(file_bytes), sheet_name=0, header=0, engine='openpyxl')
+    except:
+        df = pd.read_csv(io.BytesIO(file_bytes))
+
+    df = df.dropna(how='all')
+    if df.iloc[0].astype(str).str.contains("進場價").any():
+        df = df.iloc[1:].reset_index(drop=True)
+    return df
+
+
+def locate_columns(cols):
+    # 依表頭找出各欄位的位置 (只看表頭，不需要整張表)
+    
+    # 欄位定位
+    id_idx, _ = find_col_index(cols, ["債券", "代號", "id", "商品代號"]) or (0, "")
+    type_idx, _ = find_col_index(cols, ["商品類型", "ProductType", "type"], exclude_keywords=["ko", "ki"]) 
+    strike_idx, _ = find_col_index(cols, ["strike", "執行", "履約"])
+    ko_idx, _ = find_col_index(cols, ["ko", "提前"], exclude_keywords=["strike", "執行", "ki", "type"])
+    ko_type_idx, _ = find_col_index(cols, ["ko類型", "kotype"]) or find_col_index(cols, ["類型", "type"], exclude_keywords=["ki", "ko", "商品"])
+    ki_idx, _ = find_col_index(cols, ["ki", "下檔"], exclude_keywords=["ko", "type"])
+    ki_type_idx, _ = find_col_index(cols, ["ki類型", "kitype"])
+    t1_idx, _ = find_col_index(cols, ["標的1", "ticker1"])
+    
+    trade_date_idx, _ = find_col_index(cols, ["交易日"])
+    issue_date_idx, _ = find_col_index(cols, ["發行日"])
+    final_date_idx, _ = find_col_index(cols, ["最終", "評價"])
+    maturity_date_idx, _ = find_col_index(cols, ["到期", "maturity"])
+    tenure_idx, _ = find_col_index(cols, ["天期", "term", "tenure"])
+    
+    name_idx, _ = find_col_index(cols, ["理專", "姓名", "客戶"])
+    email_idx, email_col_name = find_col_index(cols, ["email", "e-mail", "mail", "信箱"])
+
+    if t1_idx is None:
+        raise ValueError("❌ 無法辨識「標的1」欄位，請檢查 Excel 表頭。")
+
+    # 標的欄位：找不到「標的i」時假設 標的/進場價 兩兩相鄰
+    tickers = []
+    for i in range(1, 6):
+        if i == 1: tx_idx = t1_idx
+        else:
+            tx_idx, _ = find_col_index(cols, [f"標的{i}"])
+            if tx_idx is None: 
+                possible_idx = t1_idx + (i-1)*2
+                if possible_idx < len(cols): tx_idx = possible_idx
+        tickers.append(tx_idx if tx_idx is not None and tx_idx < len(cols) else None)
+
+    return {
+        'n_cols': len(cols), 'email_col_name': email_col_name,
+        'id': id_idx, 'type': type_idx, 'strike': strike_idx, 'ko': ko_idx, 'ko_type': ko_type_idx,
+        'ki': ki_idx, 'ki_type': ki_type_idx, 'trade_date': trade_date_idx, 'issue_date': issue_date_idx,
+        'final_date': final_date_idx, 'maturity_date': maturity_date_idx, 'tenure': tenure_idx,
+        'name': name_idx, 'email': email_idx, 'tickers': tickers,
+    }
+
+
+def needed_columns(layout):
+    # 實際會讀到的欄位 (標的欄 + 緊鄰的進場價欄)
+    keys = ['id', 'type', 'strike', 'ko', 'ko_type', 'ki', 'ki_type', 'trade_date', 'issue_date',
+            'final_date', 'maturity_date', 'tenure', 'name', 'email']
+    idx = {layout[k] for k in keys if layout[k] is not None}
+    for tx_idx in layout['tickers']:
+        if tx_idx is None: continue
+        idx.add(tx_idx)
+        if tx_idx + 1 < layout['n_cols']: idx.add(tx_idx + 1)
+    return sorted(idx)
+
+
+def build_clean_df(df):
+    layout = locate_columns(df.columns.tolist())
+    return build_from_columns(layout, lambda idx: df.iloc[:, idx]), layout['email_col_name']
+
+
+def build_from_columns(layout, get):
+    # get(欄位位置) 回傳該欄 Series；完整 DataFrame 或串流讀進來的窄表都適用
+    n_cols = layout['n_cols']
+    id_idx, type_idx, strike_idx = layout['id'], layout['type'], layout['strike']
+    ko_idx, ko_type_idx, ki_idx, ki_type_idx = layout['ko'], layout['ko_type'], layout['ki'], layout['ki_type']
+    trade_date_idx, issue_date_idx, final_date_idx = layout['trade_date'], layout['issue_date'], layout['final_date']
+    maturity_date_idx, tenure_idx = layout['maturity_date'], layout['tenure']
+    name_idx, email_idx = layout['name'], layout['email']
+
+    # 建立資料表
+    clean_df = pd.DataFrame()
+    clean_df['ID'] = get(id_idx)
+    if name_idx is not None: clean_df['Name'] = clean_name_series(get(name_idx))
+    else: clean_df['Name'] = "貴賓"
+    
+    if email_idx is not None: 
+        clean_df['Email'] = get(email_idx).astype(str).replace('nan', '').str.strip()
+    else: 
+        clean_df['Email'] = ""
+    
+    # 抓取商品類型
+    if type_idx is not None:
+        clean_df['Product_Type'] = get(type_idx).astype(str).fillna("FCN")
+    else:
+        clean_df['Product_Type'] = "FCN"
+
+    clean_df['TradeDate'] = pd.to_datetime(get(trade_date_idx), errors='coerce') if trade_date_idx else pd.NaT
+    clean_df['IssueDate'] = pd.to_datetime(get(issue_date_idx), errors='coerce') if issue_date_idx else pd.Timestamp.min
+    
+    if maturity_date_idx: clean_df['MaturityDate'] = pd.to_datetime(get(maturity_date_idx), errors='coerce')
+    else: clean_df['MaturityDate'] = pd.NaT
+        
+    clean_df['ValuationDate'] = pd.to_datetime(get(final_date_idx), errors='coerce') if final_date_idx else pd.NaT
+    clean_df['TenureStr'] = get(tenure_idx) if tenure_idx else ""
+
+    # 自動推算日期 (到期日空白者以 發行日 + 天期 推算)
+    need = clean_df['MaturityDate'].isna()
+    if need.any():
+        calc = maturity_from_tenure(clean_df.loc[need, 'IssueDate'], clean_df.loc[need, 'TenureStr'])
+        need_val = clean_df.loc[need, 'ValuationDate'].isna()
+        clean_df.loc[need, 'MaturityDate'] = calc
+        clean_df.loc[need_val[need_val].index, 'ValuationDate'] = calc[need_val]
+
+    # 天期顯示：有填就照填，沒填就用日期差約略換算成月
+    tenure_str = clean_df['TenureStr']
+    tenure_disp = _to_str(tenure_str).where(tenure_str != "", "-")
+    use_dates = (tenure_str == "") & clean_df['MaturityDate'].notna() & clean_df['IssueDate'].notna()
+    if use_dates.any():
+        days = (clean_df.loc[use_dates, 'MaturityDate'] - clean_df.loc[use_dates, 'IssueDate']).dt.days
+        tenure_disp[use_dates] = (days / 30).round().astype(int).astype(str) + "M"
+    clean_df['Tenure'] = tenure_disp.astype(str)
+
+    # 參數處理
+    clean_df['KO_Pct'] = clean_percentage_series(get(ko_idx))
+    clean_df['KI_Pct'] = clean_percentage_series(get(ki_idx))
+    clean_df['Strike_Pct'] = clean_percentage_series(get(strike_idx)) if strike_idx else 100.0
+    
+    clean_df['KO_Type'] = get(ko_type_idx) if ko_type_idx else "NC1" 
+    clean_df['KI_Type'] = get(ki_type_idx) if ki_type_idx else "AKI"
+    clean_df['NC_Months'] = nc_months_series(clean_df['KO_Type'])
+
+    # 標的代號與初始價處理
+    for i, tx_idx in enumerate(layout['tickers'], start=1):
+        if tx_idx is not None:
+            raw_ticker = get(tx_idx)
+            clean_df[f'T{i}_Code'] = clean_ticker_series(raw_ticker)
+            # 原始代號留著給代號主檔 (手動對照、記錄轉換結果)
+            clean_df[f'T{i}_Raw'] = _to_str(raw_ticker).str.strip().str.upper().where(raw_ticker.notna(), "").astype(str)
+            
+            # 自動補價邏輯
+            if tx_idx + 1 < n_cols:
+                sample_val = get(tx_idx + 1).iloc[0]
+                try:
+                    float(sample_val)
+                    clean_df[f'T{i}_Initial'] = pd.to_numeric(get(tx_idx + 1), errors='coerce').fillna(0)
+                except:
+                    clean_df[f'T{i}_Initial'] = 0
+            else:
+                clean_df[f'T{i}_Initial'] = 0
+        else:
+            clean_df[f'T{i}_Code'] = ""
+            clean_df[f'T{i}_Raw'] = ""
+            clean_df[f'T{i}_Initial'] = 0
+
+    clean_df = clean_df.dropna(subset=['ID'])
+    return clean_df
+
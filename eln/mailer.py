@@ -0,0 +1,163 @@
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ==========================================
+# 📮 SMTP 連線池 + 併發寄信
+# ==========================================
+# 每個 worker 保留一條已登入的連線重複使用，共用一個速率限制器，
+# 暫時性錯誤 (斷線、4xx) 以指數退避重試，最後回報每位收件人的結果。
+# smtplib / email 到真的要寄信時才載入，不拖慢網頁第一次開啟。
+
+
+class RateLimiter:
+    # 全部 worker 共用：每秒最多 rate 封
+    def __init__(self, rate_per_sec):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec and rate_per_sec > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval: return
+        with self.lock:
+            now = time.monotonic()
+            wait_for = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait_for > 0: time.sleep(wait_for)
+
+
+def is_transient(exc):
+    # smtplib 的例外都是 OSError 的子類別，要先依 SMTP 回應判斷，最後才看連線層錯誤
+    import smtplib
+    if isinstance(exc, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPException):
+        # 例如 SMTPNotSupportedError：重試結果也一樣
+        return False
+    return isinstance(exc, (ConnectionError, socket.timeout, TimeoutError))
+
+
+def build_message(sender, to_email, subject, body_text):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = str(to_email).strip()
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body_text, 'plain'))
+    return msg
+
+
+class Mailer:
+    def __init__(self, account, password, host='smtp.gmail.com', port=465, use_ssl=True,
+                 workers=3, rate_per_sec=2.0, max_retries=3, backoff=1.0, timeout=30):
+        self.account = account
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.workers = max(1, int(workers))
+        self.limiter = RateLimiter(rate_per_sec)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return bool(self.account)
+
+    def _connect(self):
+        import smtplib
+        if self.use_ssl: server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else: server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        # 本機測試用的 SMTP (例如 aiosmtpd) 沒有帳密就不登入
+        if self.password: server.login(self.account, self.password)
+        with self._lock: self._sessions.append(server)
+        return server
+
+    def _session(self):
+        server = getattr(self._local, 'server', None)
+        with self._lock: alive = server is not None and server in self._sessions
+        if not alive:
+            server = self._connect()
+            self._local.server = server
+        return server
+
+    def _drop_session(self):
+        server = getattr(self._local, 'server', None)
+        self._local.server = None
+        if server is None: return
+        with self._lock:
+            if server in self._sessions: self._sessions.remove(server)
+        try: server.close()
+        except Exception: pass
+
+    def _send_one(self, item):
+        target = str(item.get('target', '')).strip()
+        result = {'target': target, 'subj': item.get('subj', ''), 'ok': False, 'attempts': 0, 'error': ''}
+        if not target or "@" not in target:
+            result['error'] = 'invalid address'
+            return result
+        msg = build_message(self.account, target, item.get('subj', ''), item.get('msg', ''))
+        for attempt in range(1, self.max_retries + 2):
+            result['attempts'] = attempt
+            self.limiter.wait()
+            try:
+                self._session().send_message(msg)
+                result['ok'] = True
+                result['error'] = ''
+                return result
+            except Exception as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+                # 出錯後連線狀態不明，丟掉重連
+                self._drop_session()
+                if not is_transient(e) or attempt > self.max_retries: break
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+        print(f"Email 發送失敗 ({target}): {result['error']}")
+        return result
+
+    def send(self, to_email, subject, body_text):
+        if not self.ready or not to_email: return False
+        try:
+            return self._send_one({'target': to_email, 'subj': subject, 'msg': body_text})['ok']
+        finally:
+            self.close()
+
+    def send_many(self, messages, progress=None, on_result=None):
+        # progress(done, total) / on_result(第幾封, 結果) 在呼叫端執行緒回呼，可直接更新 Streamlit 元件或寫入佇列
+        total = len(messages)
+        results = [None] * total
+        if not self.ready:
+            results = [{'target': m.get('target', ''), 'subj': m.get('subj', ''), 'ok': False,
+                        'attempts': 0, 'error': 'SMTP 未設定'} for m in messages]
+            if on_result:
+                for i, r in enumerate(results): on_result(i, r)
+            return results
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._send_one, m): i for i, m in enumerate(messages)}
+                for done, fut in enumerate(as_completed(futures), start=1):
+                    i = futures[fut]
+                    results[i] = fut.result()
+                    if on_result: on_result(i, results[i])
+                    if progress: progress(done, total)
+        finally:
+            self.close()
+        return results
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for server in sessions:
+            try: server.quit()
+            except Exception:
+                try: server.close()
+                except Exception: pass
@@ -0,0 +1,160 @@
+import cProfile
+import importlib.util
+import io
+import json
+import marshal
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+# ==========================================
+# ⏱️ 各階段耗時 / 筆數紀錄 + 效能剖析
+# ==========================================
+# 每個階段記一筆：秒數 + 筆數類的計數 (數字) + 標籤 (文字，例如 book)。
+# 另可記錄時間點 (mark)：從執行開始到某事發生 (例如第一列結果出現) 的秒數。
+# 可輸出成 JSON lines (一階段一行) 或 Prometheus textfile (node_exporter 收集)。
+
+
+class RunMetrics:
+    def __init__(self, run_id=None, t0=None):
+        # t0: time.perf_counter() 的起點 (例如程式第一行)，mark 以此計時
+        self.run_id = run_id or datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.started_at = time.time()
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self.stages = []
+        self.marks = {}
+
+    @contextmanager
+    def stage(self, name, **fields):
+        # with metrics.stage("ingest") as rec: ...; rec['rows'] = len(df)
+        rec = {'stage': name, **fields}
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec['seconds'] = time.perf_counter() - t0
+            self.stages.append(rec)
+
+    def mark(self, name, at=None):
+        # 只記第一次 (例如 first_row)；at 為 perf_counter 值，預設為現在
+        if name not in self.marks:
+            self.marks[name] = (at if at is not None else time.perf_counter()) - self.t0
+        return self.marks[name]
+
+    def total_seconds(self):
+        return sum(r['seconds'] for r in self.stages)
+
+    def to_frame(self):
+        if not self.stages: return pd.DataFrame(columns=['stage', 'seconds'])
+        df = pd.DataFrame(self.stages)
+        cols = ['stage', 'seconds'] + [c for c in df.columns if c not in ('stage', 'seconds')]
+        return df[cols]
+
+    def to_jsonl(self):
+        ts = datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds')
+        rows = self.stages + [{'mark': k, 'seconds': v} for k, v in self.marks.items()]
+        return "".join(json.dumps({'run_id': self.run_id, 'ts': ts, **r}, ensure_ascii=False, default=str) + "\n"
+                       for r in rows)
+
+    def write_jsonl(self, path):
+        # 附加寫入，一次執行的各階段共用同一個 run_id
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(self.to_jsonl())
+
+    def to_prometheus(self):
+        lines = [
+            "# HELP eln_stage_seconds Wall time of each pipeline stage in the last run.",
+            "# TYPE eln_stage_seconds gauge",
+        ]
+        items = []
+        for r in self.stages:
+            labels = {'stage': r['stage']}
+            labels.update({k: v for k, v in r.items() if isinstance(v, str) and k != 'stage'})
+            lines.append(f"eln_stage_seconds{_labels(labels)} {r['seconds']:.6f}")
+            for k, v in r.items():
+                if k != 'seconds' and isinstance(v, (int, float)) and not isinstance(v, bool):
+                    items.append(f"eln_stage_items{_labels({**labels, 'kind': k})} {v}")
+        lines += ["# HELP eln_stage_items Rows / tickers / messages handled by each stage in the last run.",
+                  "# TYPE eln_stage_items gauge"] + items
+        if self.marks:
+            lines += ["# HELP eln_run_mark_seconds Seconds from run start until each milestone (e.g. first_row).",
+                      "# TYPE eln_run_mark_seconds gauge"]
+            lines += [f"eln_run_mark_seconds{_labels({'mark': k})} {v:.6f}" for k, v in self.marks.items()]
+        lines += ["# HELP eln_last_run_timestamp_seconds Start time of the last run.",
+                  "# TYPE eln_last_run_timestamp_seconds gauge",
+                  f"eln_last_run_timestamp_seconds {self.started_at:.0f}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        # textfile collector 可能隨時讀檔：先寫暫存檔再改名，避免讀到寫一半的內容
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+
+def _labels(labels):
+    def esc(v): return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+
+# ==========================================
+# 🔬 整次執行的效能剖析 (選用)
+# ==========================================
+
+def profiler_kinds():
+    kinds = ["cprofile"]
+    if importlib.util.find_spec("pyinstrument") is not None: kinds.append("pyinstrument")
+    return kinds
+
+
+class RunProfiler:
+    # cProfile 輸出 .prof (可用 snakeviz / pstats 開)，pyinstrument 輸出互動式 HTML
+    def __init__(self, kind="cprofile"):
+        if kind not in ("cprofile", "pyinstrument"): raise ValueError(f"unknown profiler: {kind}")
+        self.kind = kind
+        self._prof = None
+        self.running = False
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            from pyinstrument import Profiler
+            self._prof = Profiler()
+            self._prof.start()
+        else:
+            self._prof = cProfile.Profile()
+            self._prof.enable()
+        self.running = True
+        return self
+
+    def stop(self):
+        # 可重複呼叫 (已停止就略過)
+        if self._prof is None or not self.running: return self
+        if self.kind == "pyinstrument": self._prof.stop()
+        else: self._prof.disable()
+        self.running = False
+        return self
+
+    def report(self):
+        # 回傳 (檔名, 內容 bytes, MIME)
+        if self.kind == "pyinstrument":
+            return "eln_profile.html", self._prof.output_html().encode("utf-8"), "text/html"
+        return "eln_profile.prof", marshal.dumps(pstats.Stats(self._prof).stats), "application/octet-stream"
+
+    def summary(self, limit=20):
+        if self.kind == "pyinstrument": return self._prof.output_text()
+        out = io.StringIO()
+        pstats.Stats(self._prof, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def __enter__(self): return self.start()
+
+    def __exit__(self, *exc): self.stop()
@@ -0,0 +1,166 @@
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from eln.history import as_price_history
+from eln.scenarios import live_mask
+
+# ==========================================
+# 🎲 蒙地卡羅：提前出場 / KI / 到期接股 機率
+# ==========================================
+# 以下載的歷史股價估計各標的波動度與相關係數，模擬相關的對數常態路徑 (漂移為 0 的風險中立近似)。
+# 每檔商品套用自己的 NC 期、KO/KI/執行價、AKI (每日觀察) / EKI (到期觀察)。
+# 標的組合相同的商品共用同一批路徑，以組合為單位分派到多個 process；
+# 每組的亂數種子由 (seed, 標的組合) 決定，結果不受 worker 數或執行順序影響。
+
+TRADING_DAYS = 252
+CALIB_WINDOW = 252
+MIN_OBS = 20
+DEFAULT_VOL = 0.30
+BATCH_PATHS = 1000
+PROB_COLUMNS = ['KO機率%', 'KI機率%', '接股機率%']
+
+
+def calibrate(history_data, today_ts, window=CALIB_WINDOW):
+    # 年化波動度 (Series) 與相關係數 (DataFrame)；資料太少的標的用 DEFAULT_VOL、相關係數 0
+    prices = as_price_history(history_data).to_frame(end=today_ts).ffill().tail(window + 1)
+    rets = np.log(prices / prices.shift(1)).iloc[1:]
+    counts = rets.notna().sum()
+    vol = (rets.std() * np.sqrt(TRADING_DAYS)).where(counts >= MIN_OBS, DEFAULT_VOL).fillna(DEFAULT_VOL)
+    return vol, rets.corr(min_periods=MIN_OBS)
+
+
+def _nearest_corr(c):
+    # 樣本相關矩陣不一定半正定：把負特徵值截為 0 後重新正規化對角線
+    w, v = np.linalg.eigh(c)
+    c = (v * np.clip(w, 1e-10, None)) @ v.T
+    d = np.sqrt(np.diag(c))
+    return c / d[:, None] / d[None, :]
+
+
+def _first_true(mask, axis):
+    # 第一個 True 的位置，找不到回傳該軸長度
+    n = mask.shape[axis]
+    return np.where(mask.any(axis=axis), mask.argmax(axis=axis), n)
+
+
+def _evaluate(paths, spec):
+    """
+    paths: 路徑數 x 天數 x 標的 (相對今天收盤的比值)
+    spec: 單一商品，標的依組合順序對齊
+    回傳 (KO 次數, KI 次數, 接股次數)
+    """
+    idx = spec['slots']
+    n = spec['n_days']
+    perf = paths[:, :n, :][:, :, idx] * spec['perf0'][None, None, :]
+    n_paths = perf.shape[0]
+    day = np.arange(1, n + 1)
+
+    # KO：NC 後每日觀察，各標的達 KO 即鎖定，全部鎖定那天提前出場
+    post_nc = (day >= spec['nc_day'])[None, :, None]
+    lock_day = _first_true((perf >= spec['ko']) & post_nc, axis=1)  # 路徑 x 標的
+    lock_day = np.where(spec['locked'][None, :], 0, lock_day)
+    ko_day = lock_day.max(axis=1)
+    knocked = ko_day < n
+
+    # KI：AKI 每日觀察 (提前出場後不再觀察)，EKI 只看到期日
+    if spec['is_aki']:
+        ki_day = _first_true((perf < spec['ki']).any(axis=2), axis=1)
+        hit = spec['hit'].any() | ((ki_day < n) & (ki_day <= ko_day))
+    else:
+        hit = (perf[:, -1, :] < spec['ki']).any(axis=1) & ~knocked
+    hit = np.broadcast_to(hit, (n_paths,))
+
+    below_strike = (perf[:, -1, :] < spec['strike']).any(axis=1)
+    delivered = ~knocked & hit & below_strike
+    return int(knocked.sum()), int(hit.sum()), int(delivered.sum())
+
+
+def _simulate_group(task):
+    # 單一標的組合：分批模擬路徑，累計組內每檔商品的事件次數
+    vols, corr, specs, n_paths, seed = task['vols'], task['corr'], task['specs'], task['n_paths'], task['seed']
+    horizon = max(s['n_days'] for s in specs)
+    chol = np.linalg.cholesky(_nearest_corr(corr))
+    dt = 1.0 / TRADING_DAYS
+    drift = -0.5 * vols ** 2 * dt
+    scale = vols * np.sqrt(dt)
+    rng = np.random.default_rng(seed)
+
+    counts = np.zeros((len(specs), 3), dtype=np.int64)
+    done = 0
+    while done < n_paths:
+        batch = min(BATCH_PATHS, n_paths - done)
+        z = rng.standard_normal((batch, horizon, len(vols))) @ chol.T
+        paths = np.exp(np.cumsum(drift + scale * z, axis=1))
+        for j, spec in enumerate(specs):
+            counts[j] += _evaluate(paths, spec)
+        done += batch
+    return task['positions'], counts / n_paths
+
+
+def _busdays(start, end):
+    return int(np.busday_count(pd.Timestamp(start).date(), pd.Timestamp(end).date()))
+
+
+def build_tasks(products, barrier_results, history_data, today_ts, n_paths=2000, seed=0):
+    today_ts = pd.Timestamp(today_ts).normalize()
+    vol, corr = calibrate(history_data, today_ts)
+    live = live_mask(products, barrier_results, today_ts)
+
+    groups = {}
+    for pos, (p, b, is_live) in enumerate(zip(products, barrier_results, live)):
+        row = p['row']
+        end = row['ValuationDate'] if pd.notna(row.get('ValuationDate')) else row.get('MaturityDate')
+        if not is_live or pd.isna(end): continue
+        n_days = _busdays(today_ts + pd.Timedelta(days=1), pd.Timestamp(end) + pd.Timedelta(days=1))
+        if n_days <= 0 or any(a['price'] <= 0 for a in p['assets']): continue
+
+        key = tuple(sorted(set(p['codes'])))
+        slot_of = {c: i for i, c in enumerate(key)}
+        nc_day = _busdays(today_ts + pd.Timedelta(days=1), p['nc_end_date']) + 1 if p['nc_end_date'] > today_ts else 0
+        groups.setdefault(key, []).append((pos, {
+            'slots': np.array([slot_of[c] for c in p['codes']]),
+            'perf0': np.array([a['price'] / a['initial'] for a in p['assets']]),
+            'ko': p['ko_thresh'], 'ki': p['ki_thresh'], 'strike': p['strike_thresh'], 'is_aki': bool(p['is_aki']),
+            'locked': np.array([a['locked_ko'] for a in b['assets']]),
+            'hit': np.array([a['hit_ki'] for a in b['assets']]),
+            'nc_day': nc_day, 'n_days': n_days,
+        }))
+
+    tasks = []
+    for key, items in groups.items():
+        codes = list(key)
+        sub_corr = corr.reindex(index=codes, columns=codes).fillna(0.0).to_numpy(dtype=np.float64, copy=True)
+        np.fill_diagonal(sub_corr, 1.0)
+        tasks.append({
+            'positions': [pos for pos, _ in items], 'specs': [spec for _, spec in items],
+            'vols': vol.reindex(codes).fillna(DEFAULT_VOL).to_numpy(dtype=np.float64),
+            'corr': sub_corr,
+            'n_paths': int(n_paths),
+            'seed': [int(seed), zlib.crc32("|".join(codes).encode("utf-8"))],
+        })
+    return tasks
+
+
+def simulate_probabilities(products, barrier_results, history_data, today_ts, n_paths=2000, seed=0, workers=None):
+    """
+    回傳與 products 對齊的 DataFrame：KO機率% / KI機率% / 接股機率%
+    (已提前出場、已到期、未發行或缺價的商品為 NaN)。
+    workers: process 數，預設為 CPU 數；1 則在目前的 process 內執行。
+    """
+    tasks = build_tasks(products, barrier_results, history_data, today_ts, n_paths, seed)
+    probs = np.full((len(products), 3), np.nan)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(tasks) <= 1:
+        outputs = [_simulate_group(t) for t in tasks]
+    else:
+        # 大組先送，負載比較平均
+        tasks.sort(key=lambda t: -len(t['specs']) * max(s['n_days'] for s in t['specs']))
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            outputs = list(pool.map(_simulate_group, tasks))
+    for positions, p in outputs:
+        probs[positions] = p
+    return pd.DataFrame(np.round(probs * 100, 1), columns=PROB_COLUMNS)
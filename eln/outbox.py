@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from eln.engine import build_digests
+
+# ==========================================
+# 📤 寄信佇列 (SQLite outbox + 背景寄送)
+# ==========================================
+# 按下寄送只是把信寫進本地佇列，由背景執行緒逐封寄出、逐封記錄結果；
+# 關掉分頁、Streamlit 重跑或程式中斷都不會遺失進度，下次啟動接著寄。
+# 每則通知以 (商品, 收件人, 事件, 日期) 為 key，同一天同一事件只排一次；
+# 彙整信若有部分商品已排過，只用還沒排過的部分重組一封。
+# 程式在寄送途中中斷時，正在寄的那幾封 (最多 SMTP worker 數) 無法確定是否送達，
+# 超過 STALE_SECONDS 仍是 sending 的信視為未寄，重新排入。
+
+DEFAULT_OUTBOX_PATH = os.path.join(".eln_cache", "outbox.sqlite")
+SQL_CHUNK = 500
+CLAIM_SIZE = 50
+STALE_SECONDS = 600
+STATUSES = ('pending', 'sending', 'sent', 'failed')
+# 優先順序：管理員摘要先寄
+PRIORITY_ADMIN = 0
+PRIORITY_CLIENT = 1
+
+
+def delivery_key(product_id, target, event, day):
+    raw = json.dumps([str(product_id), str(target).strip().lower(), str(event), str(day)], ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _parts(message):
+    # 一封信涵蓋的各則通知 (彙整信為 parts，單封就是自己)；沒有事件的信 (例如管理員摘要) 以內容當事件
+    event = hashlib.sha1((message.get('subj', '') + message.get('msg', '')).encode('utf-8')).hexdigest()
+    return [{**p, 'event': p.get('event') or event} for p in (message.get('parts') or [message])]
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class Outbox:
+    def __init__(self, path=DEFAULT_OUTBOX_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with self._connect() as con:
+            # WAL：背景寄送寫入時畫面仍可讀取進度
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE IF NOT EXISTS mails (seq INTEGER PRIMARY KEY AUTOINCREMENT, batch TEXT, "
+                        "priority INTEGER, target TEXT, subj TEXT, msg TEXT, status TEXT, attempts INTEGER, "
+                        "error TEXT, created_at TEXT, updated_at TEXT)")
+            con.execute("CREATE INDEX IF NOT EXISTS mails_status ON mails (status, priority, seq)")
+            con.execute("CREATE INDEX IF NOT EXISTS mails_batch ON mails (batch, status)")
+            con.execute("CREATE TABLE IF NOT EXISTS deliveries (key TEXT PRIMARY KEY, mail_seq INTEGER, "
+                        "product_id TEXT, target TEXT, event TEXT, day TEXT)")
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con: yield con
+        finally:
+            con.close()
+
+    def _known(self, con, keys):
+        known = set()
+        for i in range(0, len(keys), SQL_CHUNK):
+            part = keys[i:i + SQL_CHUNK]
+            q = f"SELECT key FROM deliveries WHERE key IN ({','.join('?' * len(part))})"
+            known.update(k for (k,) in con.execute(q, part))
+        return known
+
+    def enqueue(self, messages, today_ts, batch='', priority=PRIORITY_CLIENT):
+        """
+        messages: build_notifications / build_digests 的信件 (target / subj / msg，彙整信另有 parts)。
+        已排過的通知略過，回傳實際排入的封數。
+        """
+        day = pd.Timestamp(today_ts).strftime('%Y-%m-%d')
+        now = _now()
+        added = 0
+        with self._connect() as con:
+            for m in messages:
+                target = str(m.get('target', '')).strip()
+                parts = _parts(m)
+                keys = [delivery_key(p.get('id', ''), target, p['event'], day) for p in parts]
+                known = self._known(con, keys)
+                fresh = [(p, k) for p, k in zip(parts, keys) if k not in known]
+                if not fresh: continue
+                if len(fresh) < len(parts):
+                    m = build_digests([p for p, _ in fresh], today_ts)[0]
+                cur = con.execute("INSERT INTO mails (batch, priority, target, subj, msg, status, attempts, error, "
+                                  "created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'pending', 0, '', ?, ?)",
+                                  (batch, priority, target, m.get('subj', ''), m.get('msg', ''), now, now))
+                con.executemany("INSERT OR IGNORE INTO deliveries VALUES (?, ?, ?, ?, ?, ?)",
+                                [(k, cur.lastrowid, str(p.get('id', '')), target, p['event'], day) for p, k in fresh])
+                added += 1
+        return added
+
+    def claim(self, limit=CLAIM_SIZE):
+        # 取出待寄的信 (優先順序、排入順序) 並標成 sending；BEGIN IMMEDIATE 避免兩個寄送程序拿到同一封
+        now = _now()
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            rows = con.execute("SELECT seq, target, subj, msg FROM mails WHERE status = 'pending' "
+                               "ORDER BY priority, seq LIMIT ?", (limit,)).fetchall()
+            con.executemany("UPDATE mails SET status = 'sending', updated_at = ? WHERE seq = ?",
+                            [(now, seq) for seq, *_ in rows])
+        return [{'seq': seq, 'target': target, 'subj': subj, 'msg': msg} for seq, target, subj, msg in rows]
+
+    def mark(self, seq, result):
+        with self._connect() as con:
+            con.execute("UPDATE mails SET status = ?, attempts = attempts + ?, error = ?, updated_at = ? WHERE seq = ?",
+                        ('sent' if result['ok'] else 'failed', result.get('attempts', 0), result.get('error', ''),
+                         _now(), seq))
+
+    def requeue(self, seqs):
+        # 已領出但沒寄的信放回佇列
+        with self._connect() as con:
+            con.executemany("UPDATE mails SET status = 'pending', updated_at = ? WHERE seq = ? AND status = 'sending'",
+                            [(_now(), seq) for seq in seqs])
+
+    def recover(self, stale_seconds=STALE_SECONDS):
+        # 上次中斷時停在 sending 太久的信重新排入；回傳筆數
+        cutoff = (datetime.now() - timedelta(seconds=stale_seconds)).isoformat(timespec='seconds')
+        with self._connect() as con:
+            return con.execute("UPDATE mails SET status = 'pending' WHERE status = 'sending' AND updated_at < ?",
+                               (cutoff,)).rowcount
+
+    def retry_failed(self, batch=None):
+        q = "UPDATE mails SET status = 'pending', updated_at = ? WHERE status = 'failed'"
+        params = [_now()]
+        if batch is not None: q += " AND batch = ?"; params.append(batch)
+        with self._connect() as con:
+            return con.execute(q, params).rowcount
+
+    def progress(self, batch=None):
+        # {'pending', 'sending', 'sent', 'failed', 'total'} 封數
+        q = "SELECT status, COUNT(*) FROM mails" + (" WHERE batch = ?" if batch is not None else "") + " GROUP BY status"
+        with self._connect() as con:
+            counts = dict(con.execute(q, [] if batch is None else [batch]).fetchall())
+        out = {s: counts.get(s, 0) for s in STATUSES}
+        out['total'] = sum(out.values())
+        return out
+
+    def failures(self, batch=None):
+        q = "SELECT target, subj, attempts, error FROM mails WHERE status = 'failed'"
+        params = []
+        if batch is not None: q += " AND batch = ?"; params.append(batch)
+        with self._connect() as con:
+            rows = con.execute(q + " ORDER BY seq", params).fetchall()
+        return [{'target': t, 'subj': s, 'attempts': a, 'error': e} for t, s, a, e in rows]
+
+
+class OutboxWorker:
+    """
+    把佇列寄到空為止。start() 開背景執行緒 (已在寄就不另開)；run() 在目前的執行緒寄 (排程 / CLI 用)。
+    mailer_factory: 每一輪建立一個 Mailer (send_many 結束會關閉連線)。
+    """
+
+    def __init__(self, outbox, mailer_factory, claim_size=CLAIM_SIZE):
+        self.outbox = outbox
+        self.mailer_factory = mailer_factory
+        self.claim_size = claim_size
+        self.last_error = ''
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running: return False
+            self._thread = threading.Thread(target=self.run, name="eln-outbox", daemon=True)
+            self._thread.start()
+            return True
+
+    def run(self):
+        # 回傳本次 (寄出, 失敗) 封數
+        sent = failed = 0
+        self.outbox.recover()
+        while True:
+            batch = self.outbox.claim(self.claim_size)
+            if not batch: break
+            marked = set()
+
+            def on_result(i, result):
+                self.outbox.mark(batch[i]['seq'], result)
+                marked.add(i)
+
+            try:
+                results = self.mailer_factory().send_many(batch, on_result=on_result)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                self.outbox.requeue([m['seq'] for i, m in enumerate(batch) if i not in marked])
+                break
+            sent += sum(1 for r in results if r['ok'])
+            failed += sum(1 for r in results if not r['ok'])
+        return sent, failed
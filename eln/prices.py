@@ -0,0 +1,297 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from eln.history import PriceHistory
+
+# ==========================================
+# 💾 本地股價庫 (SQLite) + 增量下載
+# ==========================================
+# 過去的收盤價不會變，只需補抓「本地還沒有的日期區間」。
+# 每個代號有自己的起始日 (引用它的商品中最早的交易日)，不必為了一檔舊商品把所有代號都抓好幾年。
+# 資料來源 (provider) 可替換：正式環境用 Yahoo，測試可用 CSV 檔案假資料。
+
+DEFAULT_DB_PATH = os.path.join(".eln_cache", "prices.sqlite")
+SQL_CHUNK = 500
+# 最近幾天的收盤價可能是盤中暫定值或事後修正，每次都重抓
+REFRESH_DAYS = 3
+# 補抓區間至少有這麼多個營業日卻抓不到資料，才記為 NO_DATA (短區間遇到假日本來就可能是空的)
+EMPTY_RETRY_BDAYS = 3
+# 涵蓋報告：頭尾差幾天以內不算缺資料 (假日、尚未收盤)
+COVERAGE_TOLERANCE_DAYS = 7
+# 供應商回應了但這檔沒有任何資料 (下市、打錯代號)；逾時或連線錯誤則是暫時性的
+NO_DATA = "no data"
+
+
+def _to_frame(data, tickers):
+    # 統一成 日期 x 代號 的 DataFrame，日期去除時區並對齊到日
+    if isinstance(data, pd.Series):
+        data = data.to_frame(name=tickers[0] if len(tickers) == 1 else data.name)
+    if data is None or data.empty:
+        return pd.DataFrame(columns=list(tickers), dtype=float)
+    idx = pd.DatetimeIndex(data.index)
+    if idx.tz is not None: idx = idx.tz_localize(None)
+    data = data.copy()
+    data.index = idx.normalize()
+    return data
+
+
+def ticker_starts(tickers, start):
+    # start 可以是單一日期 (全部代號共用) 或 {代號: 起始日}；統一成 {代號: 起始日}
+    if isinstance(start, dict):
+        return {t: pd.Timestamp(start[t]).normalize() for t in tickers}
+    start = pd.Timestamp(start).normalize()
+    return {t: start for t in tickers}
+
+
+def market_of(ticker):
+    t = str(ticker).upper()
+    if t.endswith(".TW") or t.endswith(".TWO"): return "TW"
+    if t.endswith(".T"): return "JP"
+    if t.endswith(".HK"): return "HK"
+    return "US"
+
+
+def chunk_by_market(tickers, chunk_size):
+    # 同市場的代號放同一批 (交易日曆相同)，每批最多 chunk_size 檔
+    by_market = {}
+    for t in tickers: by_market.setdefault(market_of(t), []).append(t)
+    return [group[i:i + chunk_size] for _, group in sorted(by_market.items()) for i in range(0, len(group), chunk_size)]
+
+
+def coverage_report(history, tickers, start, end, errors=None, skipped=None, tolerance_days=COVERAGE_TOLERANCE_DAYS):
+    # 每檔代號實際拿到的資料區間，與要求區間 (start 可為 {代號: 起始日}) 比較後列出缺口
+    # skipped: {代號: 原因}，這次刻意沒抓的代號 (狀態 skipped)
+    errors = errors or {}
+    skipped = skipped or {}
+    starts = ticker_starts(tickers, start); end = pd.Timestamp(end).normalize()
+    tol = timedelta(days=tolerance_days)
+    report = []
+    for t in tickers:
+        start = starts[t]
+        s = history[t].dropna() if t in history.columns else pd.Series(dtype=float)
+        entry = {'ticker': t, 'market': market_of(t), 'status': 'ok', 'first': None, 'last': None,
+                 'missing': [], 'error': errors.get(t, '')}
+        if s.empty:
+            entry['status'] = 'skipped' if t in skipped else 'missing'
+            entry['error'] = skipped.get(t, entry['error'])
+            entry['missing'].append((start, end))
+        else:
+            entry['first'], entry['last'] = s.index[0], s.index[-1]
+            if entry['first'] - start > tol: entry['missing'].append((start, entry['first'] - timedelta(days=1)))
+            if end - entry['last'] > tol: entry['missing'].append((entry['last'] + timedelta(days=1), end))
+            if entry['missing']: entry['status'] = 'partial'
+        report.append(entry)
+    return report
+
+
+def report_frame(report, only_problems=True):
+    rows = [{
+        '代號': r['ticker'], '市場': r['market'], '狀態': r['status'],
+        '資料起': r['first'].strftime('%Y-%m-%d') if r['first'] is not None else "-",
+        '資料迄': r['last'].strftime('%Y-%m-%d') if r['last'] is not None else "-",
+        '缺少區間': ", ".join(f"{a:%Y-%m-%d}~{b:%Y-%m-%d}" for a, b in r['missing']),
+        '錯誤': r['error'],
+    } for r in report if not only_problems or r['status'] != 'ok']
+    return pd.DataFrame(rows, columns=['代號', '市場', '狀態', '資料起', '資料迄', '缺少區間', '錯誤'])
+
+
+class YahooProvider:
+    # auto_adjust=False：用交易所原始收盤價，歷史資料才不會因除權息而改變
+    # yf.download 共用模組層級的暫存，多執行緒同時呼叫會互相覆蓋，所以改成逐檔 Ticker.history；
+    # 單檔失敗只會少那一欄，原因放在 attrs['errors'] ({代號: 錯誤})，由 PriceStore 重抓；
+    # 請求成功但沒有資料的代號不在 errors 裡 (才會被當成 NO_DATA)
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+
+    def fetch(self, tickers, start, end):
+        import yfinance as yf
+        cols, errors = {}, {}
+        for t in tickers:
+            try:
+                hist = yf.Ticker(t).history(start=start, end=end + timedelta(days=1), auto_adjust=False,
+                                            timeout=self.timeout)
+            except Exception as ex:
+                errors[t] = f"{type(ex).__name__}: {ex}"
+                continue
+            if hist is not None and not hist.empty: cols[t] = hist['Close']
+        if not cols:
+            out = pd.DataFrame(columns=list(tickers), dtype=float)
+        else:
+            out = _to_frame(pd.DataFrame({t: _to_frame(c, [t])[t] for t, c in cols.items()}), tickers)
+        out.attrs['errors'] = errors
+        return out
+
+
+class CsvProvider:
+    # 檔案假資料：目錄下每個代號一個 <代號>.csv (欄位 Date, Close)
+    def __init__(self, folder):
+        self.folder = folder
+        self.calls = []
+
+    def fetch(self, tickers, start, end):
+        self.calls.append((list(tickers), pd.Timestamp(start), pd.Timestamp(end)))
+        cols = {}
+        for t in tickers:
+            path = os.path.join(self.folder, f"{t}.csv")
+            if not os.path.exists(path): continue
+            s = pd.read_csv(path, parse_dates=['Date']).set_index('Date')['Close']
+            cols[t] = s[(s.index >= pd.Timestamp(start)) & (s.index <= pd.Timestamp(end))]
+        return _to_frame(pd.DataFrame(cols), tickers)
+
+
+class PriceStore:
+    # 抓價：依市場分批、併發抓取 (最多 workers 批同時進行)，每批 timeout 秒；
+    # 只重抓失敗的代號，最後一輪逐檔抓，一檔壞代號不會拖垮整批。
+    def __init__(self, path=DEFAULT_DB_PATH, provider=None, refresh_days=REFRESH_DAYS,
+                 workers=4, chunk_size=50, timeout=120, max_retries=2, backoff=1.0):
+        self.path = path
+        self.provider = provider or YahooProvider()
+        self.refresh_days = refresh_days
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.last_download_rows = 0
+        self.last_report = []
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with self._connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS prices (ticker TEXT, date TEXT, close REAL, PRIMARY KEY (ticker, date))")
+            con.execute("CREATE TABLE IF NOT EXISTS coverage (ticker TEXT PRIMARY KEY, start TEXT, end TEXT, updated_at TEXT)")
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path)
+        try:
+            with con: yield con
+        finally:
+            con.close()
+
+    def _coverage(self, con, tickers):
+        cov = {}
+        for i in range(0, len(tickers), SQL_CHUNK):
+            part = tickers[i:i + SQL_CHUNK]
+            q = f"SELECT ticker, start, end FROM coverage WHERE ticker IN ({','.join('?' * len(part))})"
+            for t, s, e in con.execute(q, part):
+                cov[t] = (pd.Timestamp(s), pd.Timestamp(e))
+        return cov
+
+    def plan(self, tickers, start, end):
+        # 每個代號需要補抓的區間：{(起, 迄): [代號...]}；start 可為 {代號: 起始日}
+        starts = ticker_starts(tickers, start); end = pd.Timestamp(end).normalize()
+        with self._connect() as con:
+            cov = self._coverage(con, list(tickers))
+        jobs = {}
+        for t in tickers:
+            start = starts[t]
+            if t not in cov:
+                jobs.setdefault((start, end), []).append(t)
+                continue
+            c_start, c_end = cov[t]
+            if start < c_start:
+                jobs.setdefault((start, c_start), []).append(t)
+            refresh_from = max(c_end - timedelta(days=self.refresh_days), start)
+            if refresh_from <= end:
+                jobs.setdefault((refresh_from, end), []).append(t)
+        return jobs
+
+    def _save(self, con, data, fetch_start, fetch_end):
+        now = datetime.now().isoformat(timespec='seconds')
+        rows = 0
+        for t in data.columns:
+            s = data[t].dropna()
+            if s.empty: continue
+            con.executemany("INSERT OR REPLACE INTO prices VALUES (?, ?, ?)",
+                            [(t, d.strftime('%Y-%m-%d'), float(v)) for d, v in s.items()])
+            rows += len(s)
+            # 只有真的拿到資料才擴大涵蓋區間，避免暫時失敗的代號被當成「已下載」
+            old = self._coverage(con, [t]).get(t)
+            new_start = min(fetch_start, old[0]) if old else fetch_start
+            new_end = max(fetch_end, old[1]) if old else fetch_end
+            con.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)",
+                        (t, new_start.strftime('%Y-%m-%d'), new_end.strftime('%Y-%m-%d'), now))
+        return rows
+
+    def load(self, tickers, start, end):
+        # 回傳 PriceHistory (每個代號只含自己的區間，不補 NaN)；start 可為 {代號: 起始日}
+        tickers = list(tickers)
+        starts = ticker_starts(tickers, start)
+        first = min(starts.values()).strftime('%Y-%m-%d') if starts else None
+        end = pd.Timestamp(end).strftime('%Y-%m-%d')
+        frames = []
+        with self._connect() as con:
+            for i in range(0, len(tickers), SQL_CHUNK):
+                part = tickers[i:i + SQL_CHUNK]
+                q = (f"SELECT ticker, date, close FROM prices WHERE ticker IN ({','.join('?' * len(part))}) "
+                     f"AND date >= ? AND date <= ?")
+                frames.append(pd.read_sql_query(q, con, params=part + [first, end]))
+        long_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['ticker', 'date', 'close'])
+        long_df['date'] = pd.to_datetime(long_df['date'])
+        long_df = long_df[long_df['date'] >= long_df['ticker'].map(starts)]
+        return PriceHistory.from_long(long_df, tickers)
+
+    def _fetch_round(self, jobs):
+        # jobs: [(起, 迄, [代號...])]；回傳 (拿到的 [(起, 迄, data)], 暫時失敗的 {(起, 迄): {代號: 原因}},
+        # 沒有資料的 {代號: NO_DATA})；只有暫時失敗的需要重抓
+        fetched, failed, missing = [], {}, {}
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = {pool.submit(self.provider.fetch, group, s, e): (s, e, group) for s, e, group in jobs}
+            waves = -(-len(jobs) // self.workers)
+            done, pending = wait(futures, timeout=self.timeout * waves if self.timeout else None)
+            for fut in pending:
+                s, e, group = futures[fut]
+                failed.setdefault((s, e), {}).update({t: f"timeout ({self.timeout}s)" for t in group})
+            for fut in done:
+                s, e, group = futures[fut]
+                try:
+                    data = fut.result()
+                except Exception as ex:
+                    failed.setdefault((s, e), {}).update({t: f"{type(ex).__name__}: {ex}" for t in group})
+                    continue
+                fetched.append((s, e, data))
+                # 供應商回報的單檔錯誤 (逾時、連線) 是暫時性失敗，不是「沒有資料」
+                errors = data.attrs.get('errors', {})
+                if errors: failed.setdefault((s, e), {}).update({t: errors[t] for t in group if t in errors})
+                if len(pd.bdate_range(s, e)) < EMPTY_RETRY_BDAYS: continue
+                for t in group:
+                    if t in errors: continue
+                    if t not in data.columns or data[t].dropna().empty: missing[t] = NO_DATA
+        finally:
+            # 逾時的請求不等它結束，結果也不採用
+            pool.shutdown(wait=False, cancel_futures=True)
+        return fetched, failed, missing
+
+    def get_history(self, tickers, start, end, skip=None):
+        # 先補抓缺口再從本地讀出 PriceHistory；start 可為 {代號: 起始日}；缺資料的代號記在 last_report
+        # skip: {代號: 原因}，不送出請求 (例如已知沒有資料的代號)，本地有的資料照樣讀出
+        tickers = list(dict.fromkeys(tickers))
+        skip = skip or {}
+        start = ticker_starts(tickers, start); end = pd.Timestamp(end).normalize()
+        self.last_download_rows = 0
+        wanted = [t for t in tickers if t not in skip]
+        jobs = [(s, e, chunk) for (s, e), group in self.plan(wanted, start, end).items()
+                for chunk in chunk_by_market(group, self.chunk_size)]
+        errors, missing = {}, {}
+        for attempt in range(self.max_retries + 1):
+            if not jobs: break
+            if attempt: time.sleep(self.backoff * 2 ** (attempt - 1))
+            fetched, failed, empty = self._fetch_round(jobs)
+            # 供應商回應了但沒有資料：重抓也一樣，直接記為缺資料，不進重試也不等退避
+            missing.update(empty)
+            with self._connect() as con:
+                for s, e, data in fetched:
+                    self.last_download_rows += self._save(con, data, s, e)
+            errors = {t: why for group in failed.values() for t, why in group.items()}
+            size = 1 if attempt + 1 == self.max_retries else self.chunk_size
+            jobs = [(s, e, chunk) for (s, e), group in failed.items() for chunk in chunk_by_market(list(group), size)]
+        history = self.load(tickers, start, end)
+        self.last_report = coverage_report(history, tickers, start, end, {**missing, **errors}, skip)
+        return history
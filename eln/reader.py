@@ -0,0 +1,128 @@
+import io
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from eln.ingest import build_from_columns, locate_columns, needed_columns
+
+# ==========================================
+# 📖 串流讀檔 (大檔不整張載入記憶體)
+# ==========================================
+# xlsx 用 openpyxl read-only 逐列讀，CSV 用 C 引擎分塊讀；
+# 先看表頭決定要哪些欄，只保留這些欄，「進場價」副表頭在讀的過程中直接跳過。
+
+CHUNK_ROWS = 5000
+XLSX_MAGIC = b"PK\x03\x04"
+
+
+def _header_names(header):
+    # 比照 pandas：空白表頭為 Unnamed: i，重複名稱加 .1 .2
+    names, seen = [], {}
+    for i, v in enumerate(header):
+        name = f"Unnamed: {i}" if v is None or (isinstance(v, str) and v.strip() == "") else v
+        key = str(name)
+        if key in seen:
+            seen[key] += 1
+            name = f"{key}.{seen[key]}"
+        else:
+            seen[key] = 0
+        names.append(name)
+    return names
+
+
+def _convert_cell(v):
+    # 比照 pandas openpyxl 讀取：空格為 ""，整數值的 float 轉 int
+    if v is None: return ""
+    if isinstance(v, float) and v.is_integer(): return int(v)
+    return v
+
+
+def _is_blank_row(row):
+    return all(v is None or (isinstance(v, str) and v == "") for v in row)
+
+
+def _is_sub_header(row):
+    return any("進場價" in str(v) for v in row if v is not None)
+
+
+def _parse_chunk(rows, needed):
+    narrow = [[_convert_cell(r[i]) if i < len(r) else "" for i in needed] for r in rows]
+    chunk = TextParser(narrow, header=None, names=list(range(len(needed)))).read()
+    chunk.columns = needed
+    return chunk
+
+
+def _finish(chunks, layout, needed):
+    if chunks: narrow = pd.concat(chunks, ignore_index=True)
+    else: narrow = pd.DataFrame(columns=needed)
+    narrow = narrow.dropna(how='all').reset_index(drop=True)
+    return build_from_columns(layout, lambda idx: narrow[idx])
+
+
+def _read_sheet(ws, chunk_rows):
+    rows = ws.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None: raise ValueError("❌ 工作表是空的。")
+    layout = locate_columns(_header_names(header))
+    needed = needed_columns(layout)
+
+    chunks, buf, first_seen = [], [], False
+    for row in rows:
+        if _is_blank_row(row): continue
+        if not first_seen:
+            first_seen = True
+            if _is_sub_header(row): continue
+        buf.append(row)
+        if len(buf) >= chunk_rows:
+            chunks.append(_parse_chunk(buf, needed)); buf = []
+    if buf: chunks.append(_parse_chunk(buf, needed))
+    return _finish(chunks, layout, needed), layout['email_col_name']
+
+
+def read_xlsx_stream(file_bytes, all_sheets=False, chunk_rows=CHUNK_ROWS):
+    from openpyxl import load_workbook
+    wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        if not all_sheets:
+            return _read_sheet(wb.worksheets[0], chunk_rows)
+
+        # 多工作表：認不出「標的1」的分頁直接略過
+        frames, email_col_name, last_error = [], None, None
+        for ws in wb.worksheets:
+            try:
+                clean_df, col_name = _read_sheet(ws, chunk_rows)
+            except ValueError as e:
+                last_error = e
+                continue
+            clean_df['Sheet'] = ws.title
+            frames.append(clean_df)
+            email_col_name = email_col_name or col_name
+        if not frames: raise last_error or ValueError("❌ 找不到可辨識的工作表。")
+        return pd.concat(frames, ignore_index=True), email_col_name
+    finally:
+        wb.close()
+
+
+def read_csv_stream(file_bytes, chunk_rows=CHUNK_ROWS):
+    header = pd.read_csv(io.BytesIO(file_bytes), nrows=0).columns.tolist()
+    layout = locate_columns(header)
+    needed = needed_columns(layout)
+
+    # 只讀前幾列判斷有沒有「進場價」副表頭
+    sample = pd.read_csv(io.BytesIO(file_bytes), nrows=50).dropna(how='all')
+    skip_pos = sample.index[0] if not sample.empty and sample.iloc[0].astype(str).str.contains("進場價").any() else None
+
+    chunks = []
+    for chunk in pd.read_csv(io.BytesIO(file_bytes), usecols=needed, chunksize=chunk_rows):
+        chunk.columns = needed
+        if skip_pos is not None and skip_pos in chunk.index:
+            chunk = chunk.drop(index=skip_pos)
+        chunks.append(chunk)
+    return _finish(chunks, layout, needed), layout['email_col_name']
+
+
+def read_book_stream(file_bytes, all_sheets=False, chunk_rows=CHUNK_ROWS):
+    # 以檔頭判斷格式，不再先試 Excel 失敗才改讀 CSV
+    if file_bytes[:4] == XLSX_MAGIC:
+        return read_xlsx_stream(file_bytes, all_sheets, chunk_rows)
+    return read_csv_stream(file_bytes, chunk_rows)
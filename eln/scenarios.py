@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from eln.prices import market_of
+
+# ==========================================
+# 🧪 壓力測試 / 情境分析 (整本部位一次算)
+# ==========================================
+# 對最新收盤價套上一組衝擊 (情境 x 標的 的漲跌幅矩陣)，
+# 以 情境 x 商品 x 標的 的陣列一次算出每個情境下每檔商品的
+# 最差表現、距 KO / KI 的距離、是否觸發 KO / KI、DRA 是否計息。
+# 門檻沿用主流程 prepare_products 算好的 ko_thresh / ki_thresh / strike_thresh / nc_end_date。
+
+MARKETS = ("US", "TW", "JP", "HK")
+
+
+def shock_levels(lo=-0.3, hi=0.3, n=61):
+    return np.round(np.linspace(lo, hi, n), 6)
+
+
+def shock_matrix(tickers, levels, target=None):
+    """
+    回傳 情境 x 標的 的漲跌幅 DataFrame (index 為衝擊幅度)。
+    target: None = 全部標的同幅度；市場代碼 (US/TW/JP/HK) = 只衝擊該市場；
+            其他字串視為單一標的代號；其餘標的維持不動。
+    """
+    tickers = list(tickers)
+    levels = np.asarray(levels, dtype=np.float64)
+    if target is None: hit = np.ones(len(tickers), dtype=bool)
+    elif target in MARKETS: hit = np.array([market_of(t) == target for t in tickers], dtype=bool)
+    else: hit = np.array([t == target for t in tickers], dtype=bool)
+    return pd.DataFrame(np.where(hit[None, :], levels[:, None], 0.0), index=pd.Index(levels, name='shock'), columns=tickers)
+
+
+def _book_arrays(products, barrier_results):
+    # 商品 x 標的 的補齊陣列 (空位 used=False)
+    m = len(products)
+    n_slots = max([len(p['codes']) for p in products] + [1])
+    codes = np.full((m, n_slots), "", dtype=object)
+    initials = np.full((m, n_slots), np.nan)
+    prices = np.full((m, n_slots), np.nan)
+    used = np.zeros((m, n_slots), dtype=bool)
+    locked = np.zeros((m, n_slots), dtype=bool)
+    hit = np.zeros((m, n_slots), dtype=bool)
+    for j, (p, b) in enumerate(zip(products, barrier_results)):
+        for k, a in enumerate(p['assets']):
+            codes[j, k] = a['code']
+            initials[j, k] = a['initial']
+            prices[j, k] = a['price'] if a['price'] > 0 else np.nan
+            used[j, k] = True
+            locked[j, k] = b['assets'][k]['locked_ko']
+            hit[j, k] = b['assets'][k]['hit_ki']
+    return codes, initials, prices, used, locked, hit
+
+
+def live_mask(products, barrier_results, today_ts):
+    # 仍在比價中的商品：已發行、未提前出場、未到最終評價日
+    today_ts = pd.Timestamp(today_ts)
+    out = []
+    for p, b in zip(products, barrier_results):
+        val = p['row'].get('ValuationDate')
+        out.append(pd.notna(p['issue_date']) and today_ts >= p['issue_date']
+                   and b['early_redemption_date'] is None and not (pd.notna(val) and today_ts >= val))
+    return np.array(out, dtype=bool)
+
+
+def stress_book(products, barrier_results, shocks, today_ts, live_only=True):
+    """
+    shocks: shock_matrix(...) 的結果 (情境 x 標的)。
+    回傳 (明細, 摘要)：
+      明細：每個 情境 x 商品 一列 — 最差表現、距 KO、距 KI、KO 觸發、KI 已破、DRA 計息
+      摘要：每個情境一列 — 各狀態的商品檔數與平均最差表現
+    距 KO = 尚未鎖定標的中最差者的 (表現 - KO 門檻)，>= 0 代表會觸發；
+    距 KI = 所有標的中最差者的 (表現 - KI 門檻)，< 0 代表跌破。
+    """
+    today_ts = pd.Timestamp(today_ts)
+    keep = live_mask(products, barrier_results, today_ts) if live_only else np.ones(len(products), dtype=bool)
+    products = [p for p, k in zip(products, keep) if k]
+    barrier_results = [b for b, k in zip(barrier_results, keep) if k]
+
+    n_scen = len(shocks.index)
+    if not products:
+        empty = pd.DataFrame(columns=['shock', '債券代號', 'worst_perf', 'ko_gap', 'ki_gap', 'ko_trigger', 'ki_hit', 'dra_accrual'])
+        return empty, summarize(empty, shocks.index)
+
+    codes, initials, prices, used, locked, hit = _book_arrays(products, barrier_results)
+    ko = np.array([p['ko_thresh'] for p in products])[None, :]
+    ki = np.array([p['ki_thresh'] for p in products])[None, :]
+    strike = np.array([p['strike_thresh'] for p in products])[None, :]
+    is_dra = np.array([bool(p['is_dra']) for p in products])[None, :]
+    post_nc = np.array([today_ts >= p['nc_end_date'] for p in products])[None, :]
+
+    # 標的代號 → 衝擊矩陣的欄；矩陣沒有的代號 (與空位) 對應到最後補的 0 欄
+    col_of = {c: i for i, c in enumerate(shocks.columns)}
+    shock_values = np.zeros((n_scen, len(col_of) + 1))
+    shock_values[:, :-1] = shocks.to_numpy(dtype=np.float64)
+    cols = np.vectorize(lambda c: col_of.get(c, len(col_of)), otypes=[np.int64])(codes)
+
+    shocked = prices[None, :, :] * (1.0 + shock_values[:, cols])  # 情境 x 商品 x 標的
+    with np.errstate(invalid='ignore', divide='ignore'):
+        perf = shocked / initials[None, :, :]
+    valid = used[None, :, :] & ~np.isnan(perf)
+
+    worst = np.where(valid, perf, np.inf).min(axis=2)
+    worst = np.where(np.isinf(worst), np.nan, worst)
+
+    open_ko = valid & ~locked[None, :, :]
+    ko_gap = np.where(open_ko, perf, np.inf).min(axis=2) - ko
+    ko_gap = np.where(np.isinf(ko_gap), 0.0, ko_gap)  # 全部已鎖定
+    ko_trigger = post_nc & np.where(used[None], locked[None] | (valid & (perf >= ko[:, :, None])), True).all(axis=2)
+
+    ki_gap = worst - ki
+    ki_hit = (hit[None] & used[None]).any(axis=2) | (valid & (perf < ki[:, :, None])).any(axis=2)
+    dra_accrual = is_dra & np.where(used[None], valid & (perf >= strike[:, :, None]), True).all(axis=2)
+
+    n_prod = len(products)
+    detail = pd.DataFrame({
+        'shock': np.repeat(shocks.index.to_numpy(), n_prod),
+        '債券代號': np.tile([p['row']['ID'] for p in products], n_scen),
+        'worst_perf': worst.ravel() * 100, 'ko_gap': ko_gap.ravel() * 100, 'ki_gap': ki_gap.ravel() * 100,
+        'ko_trigger': ko_trigger.ravel(), 'ki_hit': ki_hit.ravel(),
+        'dra_accrual': np.where(is_dra, dra_accrual, False).ravel(),
+        'is_dra': np.broadcast_to(is_dra, (n_scen, n_prod)).ravel(),
+    })
+    return detail.drop(columns='is_dra'), summarize(detail, shocks.index)
+
+
+def summarize(detail, shocks_index):
+    if detail.empty:
+        return pd.DataFrame(0, index=shocks_index, columns=['products', 'ko_trigger', 'ki_hit', 'dra_paused', 'avg_worst_perf'])
+    g = detail.groupby('shock', sort=False)
+    dra_paused = (detail['is_dra'] & ~detail['dra_accrual']) if 'is_dra' in detail else pd.Series(False, index=detail.index)
+    return pd.DataFrame({
+        'products': g.size(),
+        'ko_trigger': g['ko_trigger'].sum(),
+        'ki_hit': g['ki_hit'].sum(),
+        'dra_paused': dra_paused.groupby(detail['shock'], sort=False).sum(),
+        'avg_worst_perf': g['worst_perf'].mean(),
+    })
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+# ==========================================
+# 🧷 回測檢查點 (每檔商品 KO/KI 狀態)
+# ==========================================
+# KO 鎖定與 KI 觸發一旦發生就不會消失，存下每檔商品到某日為止的狀態，
+# 下次只需回測之後的新交易日。key 為商品條件的雜湊，條件一改就自動失效。
+
+DEFAULT_STATE_PATH = os.path.join(".eln_cache", "barrier_state.sqlite")
+SQL_CHUNK = 500
+
+
+def _ts(v):
+    return None if v is None or pd.isna(v) else pd.Timestamp(v).isoformat()
+
+
+def terms_key(product):
+    terms = [
+        list(product['codes']), [repr(float(x)) for x in product['initials']],
+        repr(float(product['ko_thresh'])), repr(float(product['ki_thresh'])), bool(product['is_aki']),
+        _ts(product['issue_date']), _ts(product['nc_end_date']),
+    ]
+    return hashlib.sha1(json.dumps(terms).encode('utf-8')).hexdigest()
+
+
+def _encode(state):
+    return json.dumps({
+        'last_date': _ts(state['last_date']),
+        'early_redemption_date': _ts(state['early_redemption_date']),
+        'assets': state['assets'],
+    }, ensure_ascii=False)
+
+
+def _decode(text):
+    raw = json.loads(text)
+    er = raw['early_redemption_date']
+    return {
+        'last_date': pd.Timestamp(raw['last_date']),
+        'early_redemption_date': pd.Timestamp(er) if er else None,
+        'assets': raw['assets'],
+    }
+
+
+class BarrierStateStore:
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with self._connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS product_state (key TEXT PRIMARY KEY, product_id TEXT, state TEXT, updated_at TEXT)")
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path)
+        try:
+            with con: yield con
+        finally:
+            con.close()
+
+    def load(self, keys):
+        found = {}
+        uniq = list(dict.fromkeys(keys))
+        with self._connect() as con:
+            for i in range(0, len(uniq), SQL_CHUNK):
+                part = uniq[i:i + SQL_CHUNK]
+                q = f"SELECT key, state FROM product_state WHERE key IN ({','.join('?' * len(part))})"
+                for key, text in con.execute(q, part):
+                    found[key] = _decode(text)
+        return [found.get(k) for k in keys]
+
+    def save(self, keys, product_ids, states):
+        now = datetime.now().isoformat(timespec='seconds')
+        rows = [(k, str(pid), _encode(st), now) for k, pid, st in zip(keys, product_ids, states) if st is not None]
+        with self._connect() as con:
+            con.executemany("INSERT OR REPLACE INTO product_state VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def clear(self):
+        with self._connect() as con:
+            con.execute("DELETE FROM product_state")
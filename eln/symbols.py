@@ -0,0 +1,187 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from eln.engine import MAX_ASSETS
+from eln.prices import NO_DATA
+
+# ==========================================
+# 🏷️ 代號主檔 (原始代號 → Yahoo 代號，記住哪些抓得到資料)
+# ==========================================
+# clean_ticker_symbol 每次都依規則把 Bloomberg 代號 (UW/UN/JT/TT/HK...) 轉成 Yahoo 代號，
+# 但規則不知道哪些代號已下市或打錯：這種代號每次都會送出請求、重試，拖慢整批抓價。
+# 這裡記下每個原始代號轉成的代號、供應商有沒有回資料、何時檢查；
+# 確認沒有資料的代號在 TTL 內不再請求 (列在資料品質面板)，過期後自動再試一次。
+# 手動對照 (原始代號或轉換後代號 → 正確代號) 在抓價前套用到部位檔。
+
+DEFAULT_SYMBOLS_PATH = os.path.join(".eln_cache", "symbols.sqlite")
+SQL_CHUNK = 500
+DEAD_TTL_DAYS = 7
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def normalize_code(code):
+    return str(code).strip().upper()
+
+
+class SymbolMaster:
+    def __init__(self, path=DEFAULT_SYMBOLS_PATH, ttl_days=DEAD_TTL_DAYS):
+        self.path = path
+        self.ttl_days = ttl_days
+        self._mapped = None
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        with self._connect() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS symbol_map (raw TEXT PRIMARY KEY, resolved TEXT, source TEXT, seen_at TEXT)")
+            con.execute("CREATE TABLE IF NOT EXISTS checks (symbol TEXT PRIMARY KEY, has_data INTEGER, checked_at TEXT, "
+                        "last_data_at TEXT, failures INTEGER, error TEXT)")
+            con.execute("CREATE TABLE IF NOT EXISTS overrides (code TEXT PRIMARY KEY, symbol TEXT, note TEXT, updated_at TEXT)")
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con: yield con
+        finally:
+            con.close()
+
+    # --- 手動對照 ---
+    def overrides(self):
+        # {原始代號或轉換後代號: 正確代號}
+        with self._connect() as con:
+            return dict(con.execute("SELECT code, symbol FROM overrides"))
+
+    def overrides_frame(self):
+        with self._connect() as con:
+            rows = con.execute("SELECT code, symbol, note, updated_at FROM overrides ORDER BY code").fetchall()
+        return pd.DataFrame(rows, columns=['代號', '改用', '備註', '更新時間'])
+
+    def set_override(self, code, symbol, note=''):
+        code, symbol = normalize_code(code), normalize_code(symbol)
+        with self._connect() as con:
+            if symbol: con.execute("INSERT OR REPLACE INTO overrides VALUES (?, ?, ?, ?)", (code, symbol, note, _now()))
+            else: con.execute("DELETE FROM overrides WHERE code = ?", (code,))
+
+    def replace_overrides(self, rows):
+        # rows: [(代號, 改用, 備註)]，整張對照表換成這份 (空白列略過)；沒改的列保留原本的更新時間
+        keep = {}
+        for code, symbol, note in rows:
+            code, symbol = normalize_code(code or ''), normalize_code(symbol or '')
+            if code and symbol: keep[code] = (symbol, str(note or ''))
+        now = _now()
+        with self._connect() as con:
+            old = {c: (s, n, u) for c, s, n, u in con.execute("SELECT code, symbol, note, updated_at FROM overrides")}
+            con.execute("DELETE FROM overrides")
+            con.executemany("INSERT INTO overrides VALUES (?, ?, ?, ?)",
+                            [(c, s, n, old[c][2] if old.get(c, ())[:2] == (s, n) else now) for c, (s, n) in keep.items()])
+        return len(keep)
+
+    def apply(self, clean_df):
+        """
+        手動對照套用到部位檔的 T{i}_Code (先比對原始代號 T{i}_Raw，再比對規則轉出的代號)，
+        並記下每個原始代號最後用的代號。沒有任何代號被改時回傳原本的 DataFrame。
+        """
+        overrides = self.overrides()
+        out = clean_df
+        pairs = {}
+        for i in range(1, MAX_ASSETS + 1):
+            code_col, raw_col = f'T{i}_Code', f'T{i}_Raw'
+            if code_col not in clean_df.columns: continue
+            codes = clean_df[code_col].fillna("").astype(str)
+            raws = clean_df[raw_col].fillna("").astype(str) if raw_col in clean_df.columns else codes
+            hit = pd.Series(False, index=codes.index)
+            if overrides:
+                fixed = raws.map(overrides).fillna(codes.map(overrides)).fillna(codes)
+                hit = fixed != codes
+                if hit.any():
+                    if out is clean_df: out = clean_df.copy()
+                    out[code_col] = fixed
+                codes = fixed
+            for raw, code, by_hand in zip(raws, codes, hit):
+                if raw: pairs[raw] = (code, 'override' if by_hand else 'rule')
+        self._remember(pairs)
+        return out
+
+    def _remember(self, pairs):
+        # 只寫入新的或改變的對照 (Streamlit 每次重跑都會呼叫 apply)
+        if self._mapped is None:
+            with self._connect() as con:
+                self._mapped = {raw: (code, source) for raw, code, source in
+                                con.execute("SELECT raw, resolved, source FROM symbol_map")}
+        changed = {raw: v for raw, v in pairs.items() if self._mapped.get(raw) != v}
+        if not changed: return
+        now = _now()
+        with self._connect() as con:
+            con.executemany("INSERT OR REPLACE INTO symbol_map VALUES (?, ?, ?, ?)",
+                            [(raw, code, source, now) for raw, (code, source) in changed.items()])
+        self._mapped.update(changed)
+
+    def resolved(self):
+        # 原始代號 → 最後使用的代號 (含來源：rule 規則轉換 / override 手動對照)
+        with self._connect() as con:
+            rows = con.execute("SELECT raw, resolved, source, seen_at FROM symbol_map ORDER BY raw").fetchall()
+        return pd.DataFrame(rows, columns=['原始代號', '代號', '來源', '更新時間'])
+
+    # --- 有沒有資料 ---
+    def _cutoff(self):
+        return (datetime.now() - timedelta(days=self.ttl_days)).isoformat(timespec='seconds')
+
+    def dead(self, tickers):
+        # {代號: 原因}：TTL 內確認供應商沒有資料的代號，這次不請求
+        tickers = list(tickers)
+        cutoff = self._cutoff()
+        out = {}
+        with self._connect() as con:
+            for i in range(0, len(tickers), SQL_CHUNK):
+                part = tickers[i:i + SQL_CHUNK]
+                q = (f"SELECT symbol, checked_at, failures FROM checks WHERE symbol IN ({','.join('?' * len(part))}) "
+                     f"AND has_data = 0 AND checked_at >= ?")
+                for t, checked_at, failures in con.execute(q, part + [cutoff]):
+                    until = pd.Timestamp(checked_at) + timedelta(days=self.ttl_days)
+                    out[t] = f"已知無資料 (連續 {failures} 次)，{until:%Y-%m-%d} 前略過"
+        return out
+
+    def record(self, report):
+        """
+        report: PriceStore.last_report。有拿到資料的代號記為有效；供應商明確回「沒有資料」的記為無效，
+        逾時 / 連線錯誤等暫時性失敗不改變紀錄，略過 (skipped) 的也不動。
+        """
+        now = _now()
+        good = [(r['ticker'], now, f"{r['last']:%Y-%m-%d}") for r in report if r['status'] in ('ok', 'partial')]
+        bad = [(r['ticker'], now, r['error']) for r in report if r['status'] == 'missing' and r['error'] == NO_DATA]
+        with self._connect() as con:
+            con.executemany("INSERT INTO checks VALUES (?, 1, ?, ?, 0, '') ON CONFLICT(symbol) DO UPDATE SET "
+                            "has_data = 1, checked_at = excluded.checked_at, last_data_at = excluded.last_data_at, "
+                            "failures = 0, error = ''", good)
+            con.executemany("INSERT INTO checks VALUES (?, 0, ?, NULL, 1, ?) ON CONFLICT(symbol) DO UPDATE SET "
+                            "has_data = 0, checked_at = excluded.checked_at, failures = failures + 1, "
+                            "error = excluded.error", bad)
+        return len(good), len(bad)
+
+    def recheck(self, tickers=None):
+        # 清掉無效紀錄，下次抓價重新請求；回傳筆數
+        with self._connect() as con:
+            if tickers is None: return con.execute("DELETE FROM checks WHERE has_data = 0").rowcount
+            return con.executemany("DELETE FROM checks WHERE symbol = ? AND has_data = 0",
+                                   [(t,) for t in tickers]).rowcount
+
+    def quality_frame(self):
+        # 資料品質面板：所有被記為無效的代號 (含已過 TTL、下次會重試的)
+        cutoff = self._cutoff()
+        with self._connect() as con:
+            rows = con.execute("SELECT c.symbol, GROUP_CONCAT(m.raw, ', '), c.checked_at, c.failures, c.last_data_at, "
+                               "c.error FROM checks c LEFT JOIN symbol_map m ON m.resolved = c.symbol "
+                               "WHERE c.has_data = 0 GROUP BY c.symbol ORDER BY c.checked_at DESC").fetchall()
+        return pd.DataFrame([{
+            '代號': t, '原始代號': raws or "-", '狀態': '略過中' if checked_at >= cutoff else '下次重試',
+            '連續失敗': failures, '最後檢查': checked_at,
+            '略過至': f"{pd.Timestamp(checked_at) + timedelta(days=self.ttl_days):%Y-%m-%d %H:%M}",
+            '最後有資料': last_data_at or "-", '錯誤': error,
+        } for t, raws, checked_at, failures, last_data_at, error in rows],
+            columns=['代號', '原始代號', '狀態', '連續失敗', '最後檢查', '略過至', '最後有資料', '錯誤'])
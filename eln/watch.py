@@ -0,0 +1,171 @@
+import copy
+import time
+
+import numpy as np
+import pandas as pd
+
+from eln.engine import build_notifications
+from eln.scenarios import live_mask
+
+# ==========================================
+# 📡 盤中監控 (只重算報價穿越門檻的商品)
+# ==========================================
+# 依標的代號建反向索引：代號 → 引用它的商品，以及每檔商品在該標的上的
+# KO / KI / 執行價 價位 (排序後的陣列)。報價從 old 變到 new 時，
+# 只有價位落在 [old, new] 之間的商品狀態可能改變，其他商品不必重算，
+# 成本與價格變動成正比，而不是與部位大小成正比。
+# 已出場、已到期、未發行的商品不進索引。
+# 盤中報價視為暫定觀察：達 KO / 跌破 AKI 的紀錄會標示「盤中」，正式結果仍以收盤回測為準。
+
+
+class UnderlyingIndex:
+    def __init__(self, products, positions=None):
+        self.by_code = {}
+        levels = {}
+        for pos in (range(len(products)) if positions is None else positions):
+            p = products[pos]
+            for a in p['assets']:
+                self.by_code.setdefault(a['code'], []).append(pos)
+                for th in (p['ko_thresh'], p['ki_thresh'], p['strike_thresh']):
+                    levels.setdefault(a['code'], []).append((a['initial'] * th, pos))
+        self.levels = {}
+        for code, items in levels.items():
+            items.sort()
+            self.levels[code] = (np.array([lv for lv, _ in items]), np.array([pos for _, pos in items], dtype=np.int64))
+
+    def products_of(self, code):
+        return self.by_code.get(code, [])
+
+    def crossed(self, code, old, new):
+        # 價位在 old 與 new 之間 (含端點) 的商品；沒有前一筆報價時整個代號都要重算
+        if code not in self.levels: return set()
+        if old is None or pd.isna(old): return set(self.by_code[code])
+        lv, pos = self.levels[code]
+        lo, hi = (old, new) if old <= new else (new, old)
+        return set(pos[np.searchsorted(lv, lo, side='left'):np.searchsorted(lv, hi, side='right')].tolist())
+
+
+class IntradayWatcher:
+    def __init__(self, products, barrier_results, today_ts, lookback_days=3, notify_ki_daily=True):
+        # 自己保留一份，盤中暫定的 KO / KI 不影響原本的回測結果
+        self.products = copy.deepcopy(products)
+        self.barrier_results = copy.deepcopy(barrier_results)
+        self.today_ts = pd.Timestamp(today_ts)
+        self.lookback_days = lookback_days
+        self.notify_ki_daily = notify_ki_daily
+        live = live_mask(self.products, self.barrier_results, self.today_ts)
+        self.index = UnderlyingIndex(self.products, np.flatnonzero(live).tolist())
+        self.last = {a['code']: a['price'] for p in self.products for a in p['assets'] if a['price'] > 0}
+        self.evaluations = 0
+        self.status = [self._evaluate(pos, self.today_ts)['status'] for pos in range(len(self.products))]
+
+    def _observe(self, pos, ts):
+        # 套上最新報價；已發行、未出場的商品再看盤中是否達 KO / 跌破 AKI
+        p, b = self.products[pos], self.barrier_results[pos]
+        live = pd.notna(p['issue_date']) and ts >= p['issue_date'] and b['early_redemption_date'] is None
+        post_nc = ts >= p['nc_end_date']
+        for a, st in zip(p['assets'], b['assets']):
+            q = self.last.get(a['code'])
+            if q:
+                a['price'] = float(q)
+                a['perf'] = a['price'] / a['initial']
+            if not live or a['price'] <= 0: continue
+            if post_nc and not st['locked_ko'] and a['perf'] >= p['ko_thresh']:
+                st['locked_ko'] = True
+                st['ko_record'] = f"@{a['price']:.2f} ({ts.strftime('%Y/%m/%d %H:%M')} 盤中)"
+            if p['is_aki'] and not st['hit_ki'] and a['perf'] < p['ki_thresh']:
+                st['hit_ki'] = True
+                st['ki_record'] = f"@{a['price']:.2f} ({ts.strftime('%Y/%m/%d %H:%M')} 盤中)"
+        if live and post_nc and b['assets'] and all(st['locked_ko'] for st in b['assets']):
+            b['early_redemption_date'] = ts.normalize()
+
+    def _evaluate(self, pos, ts):
+        # 沿用 build_notifications 的狀態與通知邏輯，只餵這一檔
+        self.evaluations += 1
+        results, messages, admin = build_notifications(
+            [self.products[pos]], [self.barrier_results[pos]], ts, self.lookback_days, self.notify_ki_daily)
+        return {'status': admin[0] if admin else "", 'result': results[0], 'messages': messages}
+
+    def on_quotes(self, quotes, ts=None):
+        """
+        quotes: {代號: 最新價}。回傳新發生的事件 list：
+        {'ts', 'id', 'name', 'status' (同管理員摘要的一行), 'result', 'messages'}
+        """
+        ts = pd.Timestamp(ts) if ts is not None else pd.Timestamp.now()
+        touched = set()
+        for code, price in quotes.items():
+            if price is None or pd.isna(price) or price <= 0: continue
+            old = self.last.get(code)
+            if old == price: continue
+            touched |= self.index.crossed(code, old, price)
+            self.last[code] = float(price)
+
+        events = []
+        for pos in sorted(touched):
+            self._observe(pos, ts)
+            ev = self._evaluate(pos, ts)
+            if ev['status'] and ev['status'] != self.status[pos]:
+                row = self.products[pos]['row']
+                events.append({'ts': ts, 'id': row['ID'], 'name': row['Name'], **ev})
+            self.status[pos] = ev['status']
+        return events
+
+
+# ==========================================
+# 報價來源
+# ==========================================
+
+class ReplayFeed:
+    # 本地替身：依序回放 時間 x 代號 的報價表 (CSV 第一欄為時間)，測試與演練用
+    def __init__(self, quotes):
+        self.quotes = quotes.sort_index()
+        self._i = 0
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path, index_col=0, parse_dates=True))
+
+    @property
+    def exhausted(self):
+        return self._i >= len(self.quotes)
+
+    def poll(self):
+        if self.exhausted: return None, {}
+        ts = self.quotes.index[self._i]
+        row = self.quotes.iloc[self._i].dropna()
+        self._i += 1
+        return pd.Timestamp(ts), {k: float(v) for k, v in row.items()}
+
+
+class YahooQuoteFeed:
+    exhausted = False
+
+    def __init__(self, codes):
+        self.codes = list(codes)
+
+    def poll(self):
+        import yfinance as yf
+        quotes = {}
+        for code in self.codes:
+            try:
+                quotes[code] = float(yf.Ticker(code).fast_info['last_price'])
+            except Exception:
+                continue
+        return pd.Timestamp.now(), quotes
+
+
+def run_watch(watchers, feed, interval=60, max_polls=None, on_event=None):
+    # 輪詢報價，分派給各個 watcher；回傳全部事件
+    all_events = []
+    polls = 0
+    while not feed.exhausted and (max_polls is None or polls < max_polls):
+        if polls and interval: time.sleep(interval)
+        ts, quotes = feed.poll()
+        polls += 1
+        if ts is None: break
+        for key, watcher in watchers.items():
+            for ev in watcher.on_quotes(quotes, ts):
+                ev['book'] = key
+                all_events.append(ev)
+                if on_event: on_event(ev)
+    return all_events
@@ -0,0 +1,30 @@
+import io
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# 測試直接 import 專案內的 eln / benchmarks (不需安裝)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE_TODAY = pd.Timestamp("2025-06-30")
+
+
+@pytest.fixture(scope="module")
+def sample_run(tmp_path_factory):
+    # 合成部位檔 + 本地股價 (CsvProvider，不連網) 跑一次 run_book；today_ts 一併放在結果裡
+    from benchmarks.synthetic import RAW_TICKERS, make_position_sheet, make_price_history, write_price_fixtures
+    from eln.engine import run_book
+    from eln.ingest import clean_ticker_series
+    from eln.prices import CsvProvider, PriceStore
+    from eln.reader import read_book_stream
+
+    folder = tmp_path_factory.mktemp("sample")
+    buf = io.StringIO()
+    make_position_sheet(300, seed=11).to_csv(buf, index=False)
+    clean_df, _ = read_book_stream(buf.getvalue().encode("utf-8"))
+    codes = sorted(set(clean_ticker_series(pd.Series(RAW_TICKERS))))
+    prices = write_price_fixtures(str(folder / "px"), make_price_history(codes, "2020-12-01", SAMPLE_TODAY))
+    store = PriceStore(str(folder / "p.sqlite"), provider=CsvProvider(prices), backoff=0)
+    return {**run_book(clean_df, store, SAMPLE_TODAY), 'clean_df': clean_df, 'today_ts': SAMPLE_TODAY}
@@ -0,0 +1,53 @@
+import io
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import RAW_TICKERS, make_position_sheet, make_price_history, write_price_fixtures
+from eln.books import fetch_books, iter_books, run_books
+from eln.ingest import clean_ticker_series
+from eln.metrics import RunMetrics
+from eln.prices import CsvProvider, PriceStore
+from eln.reader import read_book_stream
+
+TODAY = pd.Timestamp("2025-06-30")
+
+
+def _book(n_rows, seed):
+    buf = io.StringIO()
+    make_position_sheet(n_rows, seed=seed).to_csv(buf, index=False)
+    return read_book_stream(buf.getvalue().encode("utf-8"))[0]
+
+
+@pytest.fixture
+def setup(tmp_path):
+    codes = sorted(set(clean_ticker_series(pd.Series(RAW_TICKERS))))
+    folder = write_price_fixtures(str(tmp_path / "px"), make_price_history(codes, "2020-12-01", TODAY))
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=CsvProvider(folder), backoff=0)
+    return {"A": _book(40, 3), "B": _book(30, 4)}, store
+
+
+def test_iter_books_hands_over_each_book_when_done(setup):
+    books, store = setup
+    metrics = RunMetrics()
+    books, history = fetch_books(books, store, TODAY, metrics)
+    runs = iter_books(books, history, TODAY, metrics=metrics, workers=1)
+
+    book, run = next(runs)
+    # A 交出來時 B 還沒開始算
+    assert book == "A" and len(run['results']) == 40
+    assert [(r['stage'], r.get('book')) for r in metrics.stages] == [("prices", None), ("evaluate", "A"), ("notify", "A")]
+    book, run = next(runs)
+    assert book == "B" and len(run['results']) == 30
+    assert next(runs, None) is None
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_books_matches_single_book_runs(setup, workers):
+    books, store = setup
+    runs = run_books(books, store, TODAY, workers=workers)
+    assert list(runs) == ["A", "B"]
+    for book, df in books.items():
+        alone = run_books({book: df}, store, TODAY, workers=1)[book]
+        assert runs[book]['results'] == alone['results']
+        assert runs[book]['individual_messages'] == alone['individual_messages']
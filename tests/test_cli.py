@@ -0,0 +1,64 @@
+import json
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_position_sheet, make_price_history, write_price_fixtures
+from eln.cli import main
+from eln.ingest import clean_ticker_series
+
+TODAY = "2025-06-30"
+
+
+@pytest.fixture
+def book(tmp_path):
+    # 小部位檔 + 本地股價目錄，命令列只讀寫 tmp_path
+    sheet = make_position_sheet(40, seed=4)
+    path = tmp_path / "部位A.csv"
+    sheet.to_csv(path, index=False)
+    codes = sorted(set(clean_ticker_series(pd.Series(sheet.filter(like="標的").stack().unique()))) - {""})
+    prices = write_price_fixtures(str(tmp_path / "px"), make_price_history(codes, "2020-12-01", TODAY))
+    cache = ["--db", str(tmp_path / "p.sqlite"), "--symbols", str(tmp_path / "s.sqlite"),
+             "--state", str(tmp_path / "state.sqlite"), "--prices-dir", prices, "--today", TODAY]
+    return str(path), cache, len(sheet)
+
+
+@pytest.mark.parametrize("ext", ["csv", "json"])
+def test_batch_run_writes_output(book, tmp_path, capsys, ext):
+    path, cache, n_rows = book
+    out = tmp_path / f"out.{ext}"
+    metrics = tmp_path / "m.jsonl"
+    assert main([path, "-o", str(out), "--metrics-jsonl", str(metrics), *cache]) == 0
+
+    if ext == "csv": df = pd.read_csv(out, encoding="utf-8-sig")
+    else: df = pd.DataFrame(json.loads(out.read_text(encoding="utf-8")))
+    assert len(df) == n_rows and (df['Book'] == "部位A").all()
+    assert df['債券代號'].tolist() == [f"ELN{n:06d}" for n in range(n_rows)]
+    assert f"📊 部位A: {n_rows} 檔商品" in capsys.readouterr().out
+    stages = {json.loads(line)['stage'] for line in metrics.read_text(encoding="utf-8").splitlines()}
+    assert {"ingest", "prices", "evaluate", "notify", "export"} <= stages
+
+
+def test_rerun_from_checkpoint_gives_same_output(book, tmp_path):
+    # 第二次從回測檢查點與本地股價庫接著算，結果要與第一次相同
+    path, cache, n_rows = book
+    assert main([path, "-o", str(tmp_path / "a.csv"), *cache]) == 0
+    assert main([path, "-o", str(tmp_path / "b.csv"), *cache]) == 0
+    a, b = (pd.read_csv(tmp_path / f, encoding="utf-8-sig") for f in ("a.csv", "b.csv"))
+    pd.testing.assert_frame_equal(a, b)
+
+
+@pytest.mark.parametrize("name", ["out.xlsm", "out.txt", "out"])
+def test_unknown_output_extension_is_rejected(book, tmp_path, capsys, name):
+    path, cache, _ = book
+    with pytest.raises(SystemExit) as exc:
+        main([path, "-o", str(tmp_path / name), *cache])
+    assert exc.value.code == 2
+    assert "不支援的輸出格式" in capsys.readouterr().err
+    assert not (tmp_path / name).exists()
+
+
+def test_missing_book_fails(tmp_path, capsys):
+    assert main([str(tmp_path / "nope.csv"), "--db", str(tmp_path / "p.sqlite"),
+                 "--symbols", str(tmp_path / "s.sqlite")]) == 1
+    assert "nope.csv" in capsys.readouterr().err
@@ -0,0 +1,177 @@
+import io
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_position_sheet, make_price_history, write_price_fixtures
+from eln.engine import (build_digests, collect_tickers, digest_section, download_windows, filter_results,
+                        notified_products, page_count, page_slice, results_frame, run_book, table_columns,
+                        underlying_codes)
+from eln.ingest import clean_ticker_series
+from eln.prices import CsvProvider, PriceStore
+from eln.reader import read_book_stream
+
+TODAY = pd.Timestamp("2025-06-30")
+
+
+def _csv_bytes(sheet):
+    buf = io.StringIO()
+    sheet.to_csv(buf, index=False)
+    return buf.getvalue().encode("utf-8")
+
+
+def test_download_windows_without_issue_date_column():
+    # 沒有發行日欄位時 IssueDate 為 Timestamp.min 佔位，不能拿來算起始日 (會溢位)
+    sheet = make_position_sheet(50, seed=1).drop(columns=["發行日"])
+    clean_df, _ = read_book_stream(_csv_bytes(sheet))
+    assert (clean_df['IssueDate'] == pd.Timestamp.min).all()
+
+    windows = download_windows(clean_df, TODAY)
+    assert set(windows) == set(collect_tickers(clean_df))
+    for code, start in windows.items():
+        refs = pd.concat([clean_df.loc[clean_df[f'T{i}_Code'] == code, 'TradeDate'] for i in range(1, 6)])
+        first = refs.min() - pd.Timedelta(days=7)
+        assert start == first.to_period('M').to_timestamp()
+
+
+def test_run_book_without_issue_date_column(tmp_path):
+    sheet = make_position_sheet(30, seed=2).drop(columns=["發行日"])
+    clean_df, _ = read_book_stream(_csv_bytes(sheet))
+    codes = sorted(set(clean_ticker_series(pd.Series(sheet.filter(like="標的").stack().unique()))) - {""})
+    folder = write_price_fixtures(str(tmp_path / "px"), make_price_history(codes, "2020-12-01", TODAY))
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=CsvProvider(folder), backoff=0)
+
+    run = run_book(clean_df, store, TODAY)
+    assert len(run['results']) == len(clean_df)
+
+
+def _table(n):
+    statuses = ["🎉 提前出場\n(2025-03-03)", "👀 比價中\n⚠️ KI已破", "🔒 NC閉鎖期\n(至 2025-09-01)", "💰 到期獲利"]
+    rows = []
+    for i in range(n):
+        status = statuses[i % len(statuses)]
+        row = {"Book": "A" if i < n // 2 else "B", "債券代號": f"ELN{i:04d}", "Type": "FCN",
+               "Name": ["王小明", "Amy Chen", "李四"][i % 3], "狀態": status, "狀態分類": status.split("\n")[0],
+               "最差表現%": 80.0 + i, "KI已破": False, "DRA暫停": False, "交易日": "2024-01-02",
+               "T1_Code": "AAPL" if i % 2 else "2330.TW", "T1_Perf": 95.0, "T1_Price": 190.0}
+        if i % 5 == 0: row.update({"T2_Code": "MSFT", "T2_Perf": 90.0, "T2_Price": 400.0})
+        rows.append(row)
+    return results_frame(rows)
+
+
+def test_filter_results():
+    df = _table(20)
+    assert filter_results(df).equals(df)
+    assert filter_results(df, [], [], [], []).equals(df)
+
+    got = filter_results(df, statuses=["👀 比價中"])
+    assert list(got['債券代號']) == [f"ELN{i:04d}" for i in range(1, 20, 4)]
+    assert set(filter_results(df, names=["李四"])['Name']) == {"李四"}
+    assert len(filter_results(df, books=["B"])) == 10
+    # 標的篩選看所有 T 欄：MSFT 只出現在 T2
+    assert list(filter_results(df, underlyings=["MSFT"]).index) == [0, 5, 10, 15]
+    assert len(filter_results(df, underlyings=["MSFT", "AAPL"])) == 10 + 2
+    # 多個條件同時成立 (AND)
+    both = filter_results(df, statuses=["🎉 提前出場"], names=["王小明"], books=["A"])
+    assert list(both['債券代號']) == ["ELN0000"]
+    # 沒有符合的商品：空表但欄位不變
+    empty = filter_results(df, names=["不存在"])
+    assert empty.empty and list(empty.columns) == list(df.columns)
+    assert underlying_codes(df) == ["2330.TW", "AAPL", "MSFT"]
+
+
+@pytest.mark.parametrize("n_rows, page_size, pages", [(0, 50, 1), (1, 50, 1), (50, 50, 1), (51, 50, 2), (100, 50, 2)])
+def test_page_count(n_rows, page_size, pages):
+    assert page_count(n_rows, page_size) == pages
+
+
+def test_page_slice_boundaries():
+    df = _table(23)
+    first, n_pages = page_slice(df, 1, 10)
+    assert n_pages == 3 and list(first.index) == list(range(10))
+    last, _ = page_slice(df, 3, 10)
+    assert list(last.index) == [20, 21, 22]
+    # 每一頁接起來剛好是整張表，沒有重複或遺漏
+    assert pd.concat([page_slice(df, p, 10)[0] for p in range(1, 4)]).equals(df)
+    # 超出範圍夾到第一頁 / 最後一頁
+    assert page_slice(df, 0, 10)[0].equals(first) and page_slice(df, -3, 10)[0].equals(first)
+    assert page_slice(df, 99, 10)[0].equals(last)
+    # 篩選後沒有資料：仍是 1 頁、空表
+    page, n_pages = page_slice(filter_results(df, names=["不存在"]), 2, 10)
+    assert page.empty and n_pages == 1
+
+
+def test_table_columns():
+    df = _table(10)
+    cols = table_columns(df)
+    assert cols[:2] == ['燈號', 'Book'] and cols[-1] == '狀態'
+    assert cols.index('T1_Code') < cols.index('T1_Perf') < cols.index('T1_Price') < cols.index('T2_Code')
+    assert set(cols) <= set(df.columns)
+    # 只有一個部位檔時不顯示 Book；有機率欄時接在最差表現後面
+    single = filter_results(df, books=["A"]).assign(**{'KO機率%': 1.0, 'KI機率%': 2.0, '接股機率%': 3.0})
+    cols = table_columns(single)
+    assert 'Book' not in cols
+    assert cols[cols.index('最差表現%') + 1:cols.index('最差表現%') + 4] == ['KO機率%', 'KI機率%', '接股機率%']
+    # 篩選後空表也能取欄位
+    empty = filter_results(df, names=["不存在"])
+    assert empty[table_columns(empty)].empty and 'Book' not in table_columns(empty)
+
+
+def _message(target, pid, name, event):
+    row = {'ID': pid, 'Product_Type': "FCN"}
+    detail = "   AAPL: 190.00 (95.00%)\n"
+    return {'target': target, 'subj': f"【ELN通知】{pid} 最新狀態", 'msg': f"{pid} 單檔通知", 'id': pid, 'name': name,
+            'event': event, 'section': digest_section(row, event, detail, "2026-06-30")}
+
+
+def test_build_digests_groups_by_recipient():
+    messages = [
+        _message("a@x.com", "ELN1", "王小明", "🎉 恭喜！已提前出場 (KO)"),
+        _message("b@x.com", "ELN2", "Amy Chen", "💰 到期獲利"),
+        _message(" A@X.com ", "ELN3", "王小明", "⚠️ 注意：KI 已跌破 (AAPL)"),
+        _message("a@x.com", "ELN4", "李四", "⚠️ DRA 暫停計息 (AAPL 跌破執行價)"),
+        _message("a@x.com", "ELN1", "王小明", "🎉 恭喜！已提前出場 (KO)"),  # 同一檔重複列出
+    ]
+    digests = build_digests(messages, TODAY)
+    # 收件人依第一次出現的順序，不分大小寫與前後空白
+    assert [d['target'] for d in digests] == ["a@x.com", "b@x.com"]
+    a, b = digests
+
+    # 多檔商品：同一封信依原順序各列一段，重複的商品只列一次
+    assert a['ids'] == ["ELN1", "ELN3", "ELN4"]
+    assert a['subj'] == "【ELN通知】3 檔商品最新狀態 (2025/06/30)"
+    body = a['msg']
+    assert body.startswith("Hi 貴賓 您好，\n您有 3 檔結構型商品最新狀態：")  # 不同理專 → 貴賓
+    positions = [body.index(f"■ {pid} (FCN)") for pid in a['ids']]
+    assert positions == sorted(positions)
+    for m in messages[:4]:
+        if m['id'] in a['ids']: assert f"【{m['event']}】" in body
+    assert body.count("■ ELN1") == 1 and body.endswith("(本信件由系統自動發送)")
+    assert [p['event'] for p in a['parts']] == [messages[0]['event'], messages[2]['event'], messages[3]['event']]
+    assert all(set(p) == {'target', 'id', 'name', 'event', 'section'} and 'msg' not in p for p in a['parts'])
+
+    # 只有一檔：主旨同單檔通知，稱呼用該理專
+    assert b['ids'] == ["ELN2"] and b['subj'] == "【ELN通知】ELN2 最新狀態"
+    assert b['msg'].startswith("Hi Amy Chen 您好，\n您有 1 檔")
+    assert notified_products(digests) == 4
+    assert build_digests([], TODAY) == []
+
+
+def test_digest_section_matches_single_notice():
+    row = {'ID': "ELN9", 'Product_Type': "DRA"}
+    section = digest_section(row, "💰 到期獲利", "   AAPL: 190.00 (95.00%)\n", "2026-06-30")
+    assert section == "■ ELN9 (DRA)\n【💰 到期獲利】\n   AAPL: 190.00 (95.00%)\n📅 到期日: 2026-06-30\n"
+
+
+def test_digests_cover_every_notice(sample_run):
+    messages = sample_run['individual_messages']
+    assert len({m['event'] for m in messages}) > 1
+    digests = build_digests(messages, sample_run['today_ts'])
+    expected = {}
+    for m in messages: expected.setdefault(m['target'].strip().lower(), []).append(m['id'])
+    assert len(digests) == len(expected)
+    for d in digests:
+        ids = list(dict.fromkeys(expected[d['target'].lower()]))
+        assert d['ids'] == ids and [p['id'] for p in d['parts']] == ids
+        assert all(f"■ {pid} (" in d['msg'] for pid in ids)
+    assert notified_products(digests) == notified_products(messages)
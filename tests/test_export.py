@@ -0,0 +1,117 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from eln.engine import results_frame
+from eln.export import ResultExporter, arrow_schema, conform, export_columns, export_results
+
+STATUSES = ["🎉 提前出場\n(2025-03-03)", "👀 比價中\n⚠️ KI已破", "🔒 NC閉鎖期\n(至 2025-09-01)", "💰 到期獲利", "⏳ 未發行"]
+
+
+def _results(n):
+    rows = []
+    for i in range(n):
+        status = STATUSES[i % len(STATUSES)]
+        row = {"債券代號": f"ELN{i:04d}", "Name": "王小明" if i % 2 else "Amy Chen", "Type": "FCN",
+               "狀態": status, "狀態分類": status.split("\n")[0], "最差表現": f"{80 + i}%", "最差表現%": 80.0 + i,
+               "KI已破": i % 3 == 0, "DRA暫停": False, "NC月份": "3M",
+               "交易日": "-" if i == 4 else f"2024-01-{i + 1:02d}",
+               "T1_Code": "AAPL", "T1_Price": 190.5 + i, "T1_Perf": 95.25, "T1_KO": "", "T1_KI": ""}
+        if i % 2:  # 第二檔標的：一半的商品才有
+            row.update({"T2_Code": "2330.TW", "T2_Price": float('nan'), "T2_Perf": float('nan'),
+                        "T2_KO": "@600.00 (2024/02/01)", "T2_KI": ""})
+        rows.append(row)
+    return rows
+
+
+def _export(target, fmt, results, batch_rows=3):
+    columns = export_columns(book=True)
+    with ResultExporter(target, fmt, columns) as ex:
+        export_results(ex, results, book="A", batch_rows=batch_rows)
+    expected = results_frame(results)
+    expected.insert(0, 'Book', "A")
+    return ex, conform(expected, columns)
+
+
+def test_csv_round_trip(tmp_path):
+    path = str(tmp_path / "out.csv")
+    ex, expected = _export(path, "csv", _results(8))
+    assert ex.rows == 8
+    with open(path, "rb") as f: assert f.read(3) == "\ufeff".encode("utf-8")
+    got = pd.read_csv(path, encoding="utf-8-sig", keep_default_na=False, dtype=str)
+    # 表頭只在第一批寫一次
+    assert list(got.columns) == list(expected.columns) and len(got) == 8
+    assert list(got['債券代號']) == list(expected['債券代號'])
+    assert list(got['狀態']) == list(expected['狀態'])
+    assert list(got['交易日']) == [d.strftime("%Y-%m-%d") if pd.notna(d) else "" for d in expected['交易日']]
+    assert got['T1_Price'].astype(float).tolist() == expected['T1_Price'].tolist()
+
+
+def test_csv_to_buffer():
+    buf = io.BytesIO()
+    _export(buf, "csv", _results(4))
+    buf.seek(0)
+    assert len(pd.read_csv(buf, encoding="utf-8-sig")) == 4
+
+
+def test_parquet_round_trip(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "out.parquet")
+    ex, expected = _export(path, "parquet", _results(8))
+    table = pq.read_table(path)
+    # 每一批同一個 schema，逐批附加成多個 row group
+    assert table.schema.equals(arrow_schema(ex.columns))
+    assert pq.ParquetFile(path).metadata.num_row_groups == 3
+    got = table.to_pandas()
+    for df in (got, expected): df['交易日'] = df['交易日'].astype('datetime64[ns]')
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
+
+
+def test_xlsx_round_trip_with_conditional_formats(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    pytest.importorskip("xlsxwriter")
+    path = str(tmp_path / "out.xlsx")
+    ex, expected = _export(path, "xlsx", _results(8))
+    ws = openpyxl.load_workbook(path)["ELN"]
+    rows = list(ws.iter_rows(values_only=True))
+    assert list(rows[0]) == ex.columns
+    assert len(rows) == 9
+    cols = {c: j for j, c in enumerate(ex.columns)}
+    for got, (_, exp) in zip(rows[1:], expected.iterrows()):
+        assert got[cols['債券代號']] == exp['債券代號']
+        assert got[cols['狀態']] == exp['狀態']
+        assert got[cols['KI已破']] == exp['KI已破']
+        assert got[cols['T1_Price']] == exp['T1_Price']
+        # 缺值與空字串都不寫入
+        assert got[cols['T2_Price']] is None
+        assert got[cols['T2_KO']] == (exp['T2_KO'] or None)
+        if pd.isna(exp['交易日']): assert got[cols['交易日']] is None
+        else: assert got[cols['交易日']] == exp['交易日'].to_pydatetime()
+
+    # 燈號 / 狀態分類 / 狀態三欄各有整欄的條件式格式，涵蓋到最後一列
+    letters = {openpyxl.utils.get_column_letter(cols[c] + 1) for c in ('燈號', '狀態分類', '狀態')}
+    ranges = {str(cf.sqref) for cf in ws.conditional_formatting}
+    assert ranges == {f"{col}2:{col}9" for col in letters}
+    words = {rule.text for cf in ws.conditional_formatting for rule in cf.rules}
+    assert {"🟢", "🔴", "🟡", "提前", "KI", "NC"} <= words
+
+
+def test_empty_export_has_header_only(tmp_path):
+    pytest.importorskip("xlsxwriter")
+    openpyxl = pytest.importorskip("openpyxl")
+    path = str(tmp_path / "empty.xlsx")
+    ex, _ = _export(path, "xlsx", [])
+    ws = openpyxl.load_workbook(path)["ELN"]
+    assert ex.rows == 0 and ws.max_row == 1
+    assert not list(ws.conditional_formatting)
+
+
+def test_conform_fixes_types():
+    df = conform(pd.DataFrame({'KI已破': [True, np.nan], 'T1_Price': ["1.5", None], '交易日': ["2024-01-02", "-"]}),
+                 ['KI已破', 'T1_Price', '交易日', 'T1_Code'])
+    assert df['KI已破'].tolist() == [True, False]
+    assert df['T1_Price'].dtype == np.float64 and np.isnan(df['T1_Price'][1])
+    assert df['T1_Code'].tolist() == ["", ""]
+    assert pd.isna(df['交易日'][1])
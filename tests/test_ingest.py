@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.bench_ingest import rowwise_reference
+from benchmarks.synthetic import make_position_sheet
+from eln.ingest import (build_clean_df, clean_name_series, clean_name_str, clean_percentage,
+                        clean_percentage_series, clean_ticker_series, clean_ticker_symbol, nc_months_series,
+                        parse_nc_months)
+
+
+def _assert_same(got, ref):
+    # 缺值一律視為相同；日期、數字、字串分開比
+    if pd.api.types.is_datetime64_any_dtype(got) or pd.api.types.is_datetime64_any_dtype(ref):
+        pd.testing.assert_series_equal(pd.to_datetime(got), pd.to_datetime(ref), check_names=False, check_dtype=False)
+    elif pd.api.types.is_numeric_dtype(got) and pd.api.types.is_numeric_dtype(ref):
+        pd.testing.assert_series_equal(got.astype(float), ref.astype(float), check_names=False)
+    else:
+        assert got.astype(str).tolist() == ref.astype(str).tolist()
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_vectorized_matches_rowwise(seed):
+    df = make_position_sheet(400, seed=seed)
+    clean_df, _ = build_clean_df(df)
+    ref = rowwise_reference(df, clean_df)
+    for col in ref.columns:
+        _assert_same(clean_df[col], ref[col])
+
+
+@pytest.mark.parametrize("series_fn, scalar_fn, values", [
+    (clean_percentage_series, clean_percentage,
+     ["80%", "85", "1,00%", " 90 % ", 75.0, 0.8, None, "", "abc", np.nan, "nan"]),
+    (clean_ticker_series, clean_ticker_symbol,
+     ["AAPL UW", "2330 TT", "7203 JT", "0700 HK", "SPY", " msft un ", "", None, np.nan, 2330]),
+    (clean_name_series, clean_name_str, ["王小明", "李四 ", "", None, "nan", "Amy Chen", np.nan]),
+    (nc_months_series, parse_nc_months, ["NC3", "NC 1", "Daily", "", None, "lock:6", "Non-Call 2", np.nan]),
+])
+def test_series_helpers_match_scalar_versions(series_fn, scalar_fn, values):
+    s = pd.Series(values, dtype=object)
+    _assert_same(series_fn(s), s.apply(scalar_fn))
@@ -0,0 +1,97 @@
+import smtplib
+import socket
+import ssl
+
+import pytest
+
+from eln.mailer import is_transient
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (smtplib.SMTPServerDisconnected(), True),
+    (smtplib.SMTPConnectError(421, b"busy"), True),
+    (smtplib.SMTPDataError(451, b"try later"), True),
+    (smtplib.SMTPAuthenticationError(454, b"temporary"), True),
+    (smtplib.SMTPRecipientsRefused({"a@x.com": (450, b"mailbox busy")}), True),
+    (ConnectionResetError(), True),
+    (socket.timeout(), True),
+    (smtplib.SMTPAuthenticationError(535, b"bad credentials"), False),
+    (smtplib.SMTPDataError(554, b"rejected"), False),
+    (smtplib.SMTPRecipientsRefused({"a@x.com": (550, b"no such user")}), False),
+    (smtplib.SMTPNotSupportedError("no AUTH"), False),
+    (smtplib.SMTPException("other"), False),
+    (ssl.SSLError(), False),
+])
+def test_is_transient(exc, expected):
+    assert is_transient(exc) is expected
+
+
+class RecordingHandler:
+    # 本機 SMTP 替身：記下收到的信與連線數；fail 指定收件人 → 前幾次回覆的錯誤碼
+    def __init__(self, fail=None):
+        self.received = []
+        self.connections = 0
+        self.fail = dict(fail or {})
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        target = envelope.rcpt_tos[0]
+        codes = self.fail.get(target)
+        if codes: return codes.pop(0)
+        self.received.append(target)
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server():
+    controller_mod = pytest.importorskip("aiosmtpd.controller")
+    servers = []
+
+    def start(handler):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        controller = controller_mod.Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        servers.append(controller)
+        return port
+
+    yield start
+    for controller in servers: controller.stop()
+
+
+def _mailer(port, **kwargs):
+    from eln.mailer import Mailer
+    return Mailer("me@x.com", "", host="127.0.0.1", port=port, use_ssl=False, rate_per_sec=0, backoff=0, **kwargs)
+
+
+def test_send_many_reuses_pooled_sessions(smtp_server):
+    handler = RecordingHandler()
+    port = smtp_server(handler)
+    messages = [{'target': f"u{i}@x.com", 'subj': f"s{i}", 'msg': "hi"} for i in range(12)]
+    done = []
+    results = _mailer(port, workers=3).send_many(messages, on_result=lambda i, r: done.append(i))
+
+    assert all(r['ok'] and r['attempts'] == 1 for r in results)
+    assert sorted(handler.received) == sorted(m['target'] for m in messages)
+    assert sorted(done) == list(range(12))
+    # 每個 worker 一條連線重複使用
+    assert handler.connections <= 3
+
+
+def test_transient_errors_are_retried_and_permanent_ones_reported(smtp_server):
+    handler = RecordingHandler(fail={"busy@x.com": ["451 try again later"], "gone@x.com": ["550 no such user"]})
+    port = smtp_server(handler)
+    messages = [{'target': t, 'subj': "s", 'msg': "hi"} for t in ("ok@x.com", "busy@x.com", "gone@x.com", "not-an-address")]
+    results = {r['target']: r for r in _mailer(port, workers=2, max_retries=2).send_many(messages)}
+
+    assert results["ok@x.com"]['ok'] and results["ok@x.com"]['attempts'] == 1
+    assert results["busy@x.com"]['ok'] and results["busy@x.com"]['attempts'] == 2
+    assert not results["gone@x.com"]['ok'] and results["gone@x.com"]['attempts'] == 1
+    assert "550" in results["gone@x.com"]['error']
+    assert results["not-an-address"]['error'] == 'invalid address'
+    assert sorted(handler.received) == ["busy@x.com", "ok@x.com"]
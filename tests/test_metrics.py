@@ -0,0 +1,13 @@
+import sys
+
+from eln.metrics import RunProfiler
+
+
+def test_profiler_stop_is_idempotent():
+    profiler = RunProfiler().start()
+    assert profiler.running
+    sum(range(1000))
+    profiler.stop().stop()
+    assert not profiler.running
+    assert sys.getprofile() is None
+    assert profiler.report()[0] == "eln_profile.prof"
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import eln.montecarlo as mc
+from eln.history import PriceHistory
+from eln.montecarlo import PROB_COLUMNS, simulate_probabilities
+
+TODAY = pd.Timestamp("2025-06-30")
+
+
+def _product(codes, prices, initials, ko=1.0, ki=0.6, strike=0.8, is_aki=True, nc_end="2025-01-31",
+             valuation="2026-06-30", hit=None, locked=None):
+    p = {'row': {'ValuationDate': pd.Timestamp(valuation), 'MaturityDate': pd.Timestamp(valuation)},
+         'issue_date': pd.Timestamp("2024-06-28"), 'nc_end_date': pd.Timestamp(nc_end), 'codes': list(codes),
+         'assets': [{'code': c, 'price': float(px), 'initial': float(i)} for c, px, i in zip(codes, prices, initials)],
+         'ko_thresh': ko, 'ki_thresh': ki, 'strike_thresh': strike, 'is_aki': is_aki}
+    b = {'early_redemption_date': None,
+         'assets': [{'locked_ko': bool((locked or {}).get(c)), 'hit_ki': bool((hit or {}).get(c))} for c in codes]}
+    return p, b
+
+
+def _history(tickers, vol, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range("2024-01-02", TODAY)
+    steps = rng.normal(0, vol / np.sqrt(252), (len(index), len(tickers))) if vol else np.zeros((len(index), len(tickers)))
+    return PriceHistory.from_frame(pd.DataFrame(100 * np.exp(np.cumsum(steps, axis=0)), index=index, columns=tickers))
+
+
+@pytest.fixture
+def book():
+    # 四組標的組合，各幾檔商品 (同組共用路徑)
+    rng = np.random.default_rng(7)
+    groups = [["AAPL"], ["AAPL", "MSFT"], ["2330.TW", "0700.HK", "7203.T"], ["MSFT", "7203.T"]]
+    pairs = []
+    for n in range(12):
+        codes = groups[n % len(groups)]
+        pairs.append(_product(codes, rng.uniform(70, 110, len(codes)), [100.0] * len(codes),
+                              ko=float(rng.choice([1.0, 1.03])), ki=float(rng.choice([0.6, 0.7])),
+                              is_aki=bool(n % 3), valuation=f"2026-0{1 + n % 6}-15"))
+    products, barriers = map(list, zip(*pairs))
+    return products, barriers, _history(["AAPL", "MSFT", "2330.TW", "0700.HK", "7203.T"], vol=0.3)
+
+
+def test_same_seed_same_probabilities(book):
+    products, barriers, history = book
+    first = simulate_probabilities(products, barriers, history, TODAY, n_paths=500, seed=3, workers=1)
+    again = simulate_probabilities(products, barriers, history, TODAY, n_paths=500, seed=3, workers=1)
+    pd.testing.assert_frame_equal(first, again)
+    assert first.notna().all().all()
+    other = simulate_probabilities(products, barriers, history, TODAY, n_paths=500, seed=4, workers=1)
+    assert not first.equals(other)
+
+
+def test_independent_of_workers_and_batching(book, monkeypatch):
+    products, barriers, history = book
+    serial = simulate_probabilities(products, barriers, history, TODAY, n_paths=500, seed=1, workers=1)
+    parallel = simulate_probabilities(products, barriers, history, TODAY, n_paths=500, seed=1, workers=3)
+    pd.testing.assert_frame_equal(serial, parallel)
+    # 路徑分批大小不同，亂數依同樣順序取用，結果相同
+    monkeypatch.setattr(mc, "BATCH_PATHS", 37)
+    pd.testing.assert_frame_equal(serial, simulate_probabilities(products, barriers, history, TODAY, n_paths=500,
+                                                                 seed=1, workers=1))
+
+
+def test_product_order_does_not_change_its_probabilities(book):
+    products, barriers, history = book
+    probs = simulate_probabilities(products, barriers, history, TODAY, n_paths=300, seed=2, workers=1)
+    rev = simulate_probabilities(products[::-1], barriers[::-1], history, TODAY, n_paths=300, seed=2, workers=1)
+    pd.testing.assert_frame_equal(probs, rev.iloc[::-1].reset_index(drop=True))
+
+
+def test_zero_volatility_gives_deterministic_outcome():
+    cases = [
+        # (商品, 預期 KO% / KI% / 接股%)
+        (_product(["A", "B"], [100, 105], [100, 100]), [100.0, 0.0, 0.0]),                      # 已在 KO 之上
+        (_product(["A", "B"], [100, 105], [100, 100], nc_end="2026-12-31"), [0.0, 0.0, 0.0]),   # NC 到期後才結束
+        (_product(["A", "C"], [100, 50], [100, 100]), [0.0, 100.0, 100.0]),                     # AKI 明天就跌破
+        (_product(["A", "C"], [100, 50], [100, 100], is_aki=False), [0.0, 100.0, 100.0]),       # EKI 到期跌破
+        (_product(["A", "C"], [100, 70], [100, 100], strike=0.75, hit={"C": True}), [0.0, 100.0, 100.0]),  # 已破 KI
+        (_product(["A", "C"], [100, 90], [100, 100], hit={"C": True}), [0.0, 100.0, 0.0]),     # 已破 KI、高於執行價
+        (_product(["A", "C"], [100, 90], [100, 100]), [0.0, 0.0, 0.0]),
+        (_product(["A", "C"], [105, 90], [100, 100], locked={"C": True}), [100.0, 0.0, 0.0]),  # C 已鎖定
+    ]
+    products, barriers = map(list, zip(*[c[0] for c in cases]))
+    probs = simulate_probabilities(products, barriers, _history(["A", "B", "C"], vol=0), TODAY, n_paths=200,
+                                   workers=1)
+    assert probs[PROB_COLUMNS].values.tolist() == [c[1] for c in cases]
+
+
+def test_finished_products_are_nan():
+    live = _product(["A"], [90], [100])
+    matured = _product(["A"], [90], [100], valuation="2025-06-01")
+    redeemed = _product(["A"], [90], [100])
+    redeemed[1]['early_redemption_date'] = pd.Timestamp("2025-05-02")
+    products, barriers = map(list, zip(live, matured, redeemed))
+    probs = simulate_probabilities(products, barriers, _history(["A"], vol=0.2), TODAY, n_paths=100, workers=1)
+    assert probs.iloc[0].notna().all() and probs.iloc[1:].isna().all().all()
@@ -0,0 +1,107 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from eln.engine import build_digests
+from eln.outbox import Outbox, OutboxWorker, delivery_key
+
+TODAY = pd.Timestamp("2025-06-30")
+KI = "⚠️ 注意：KI 已跌破 (AAPL)"
+
+
+def _notice(target, pid, event=KI):
+    return {'target': target, 'subj': f"【ELN通知】{pid} 最新狀態", 'msg': f"{pid} {event}", 'id': pid,
+            'name': "王小明", 'event': event, 'section': f"■ {pid}\n【{event}】\n"}
+
+
+class FakeMailer:
+    # send_many 同 Mailer：逐封回呼 on_result；fail 的收件人回報失敗，寄到第 crash_at 封時整批丟例外
+    def __init__(self, log, fail=(), crash_at=None):
+        self.log = log
+        self.fail = set(fail)
+        self.crash_at = crash_at
+
+    def send_many(self, messages, on_result=None):
+        results = []
+        for i, m in enumerate(messages):
+            if self.crash_at is not None and len(self.log) >= self.crash_at:
+                raise ConnectionError("smtp down")
+            ok = m['target'] not in self.fail
+            if ok: self.log.append(m['target'])
+            results.append({'target': m['target'], 'subj': m['subj'], 'ok': ok, 'attempts': 1,
+                            'error': '' if ok else "550 mailbox unavailable"})
+            if on_result: on_result(i, results[-1])
+        return results
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(str(tmp_path / "outbox.sqlite"))
+
+
+def test_enqueue_skips_notifications_already_queued(outbox):
+    digests = build_digests([_notice("a@x.com", "P1"), _notice("a@x.com", "P2"), _notice("b@x.com", "P1")], TODAY)
+    assert outbox.enqueue(digests, TODAY) == 2
+    # Streamlit 重跑 / 重新按寄送：同一天同一事件不再排
+    assert outbox.enqueue(digests, TODAY) == 0
+    # 收件人大小寫、空白不同仍是同一則
+    assert delivery_key("P1", " A@X.com ", KI, "2025-06-30") == delivery_key("P1", "a@x.com", KI, "2025-06-30")
+    assert outbox.enqueue(build_digests([_notice(" A@X.com", "P1")], TODAY), TODAY) == 0
+    # 事件或日期不同就是新的一則
+    assert outbox.enqueue(build_digests([_notice("a@x.com", "P1", "🎉 恭喜！已提前出場 (KO)")], TODAY), TODAY) == 1
+    assert outbox.enqueue(digests, TODAY + pd.Timedelta(days=1)) == 2
+    assert outbox.progress()['pending'] == 5
+
+
+def test_partial_digest_is_rebuilt_from_new_parts(outbox):
+    outbox.enqueue(build_digests([_notice("a@x.com", "P1")], TODAY), TODAY)
+    assert outbox.enqueue(build_digests([_notice("a@x.com", "P1"), _notice("a@x.com", "P2")], TODAY), TODAY) == 1
+    second = outbox.claim()[1]
+    # 已排過的 P1 不再出現在第二封
+    assert "P2" in second['msg'] and "P1" not in second['msg']
+
+
+def test_recover_requeues_stale_sending_without_resending(outbox):
+    outbox.enqueue(build_digests([_notice(f"{c}@x.com", "P1") for c in "abc"], TODAY), TODAY)
+    claimed = outbox.claim()
+    # 寄出第一封後程式中斷：其餘兩封停在 sending
+    outbox.mark(claimed[0]['seq'], {'ok': True, 'attempts': 1})
+    assert outbox.recover() == 0  # 剛領出的不算中斷 (可能有別的寄送程序正在寄)
+    with sqlite3.connect(outbox.path) as con:
+        con.execute("UPDATE mails SET updated_at = '2000-01-01T00:00:00' WHERE status = 'sending'")
+
+    log = []
+    assert OutboxWorker(outbox, lambda: FakeMailer(log)).run() == (2, 0)
+    assert log == ["b@x.com", "c@x.com"]
+    assert outbox.progress()['sent'] == 3
+
+
+def test_mailer_exception_requeues_and_failed_can_be_retried(outbox):
+    outbox.enqueue(build_digests([_notice(f"{c}@x.com", "P1") for c in "abcd"], TODAY), TODAY)
+    log = []
+    worker = OutboxWorker(outbox, lambda: FakeMailer(log, fail={"a@x.com"}, crash_at=1))
+    worker.run()
+    # a 永久失敗、b 寄出，寄 c 時整批中斷：c、d 回到佇列，不是卡在 sending
+    assert log == ["b@x.com"]
+    assert "ConnectionError" in worker.last_error
+    assert outbox.progress() == {'pending': 2, 'sending': 0, 'sent': 1, 'failed': 1, 'total': 4}
+    assert [f['target'] for f in outbox.failures()] == ["a@x.com"]
+
+    assert outbox.retry_failed() == 1
+    assert OutboxWorker(outbox, lambda: FakeMailer(log)).run() == (3, 0)
+    assert sorted(log) == ["a@x.com", "b@x.com", "c@x.com", "d@x.com"]
+    assert outbox.progress()['sent'] == 4
+
+
+def test_second_run_sends_only_what_is_left(outbox):
+    notices = [_notice(f"{c}@x.com", pid) for c in "abcde" for pid in ("P1", "P2")]
+    outbox.enqueue(build_digests(notices, TODAY), TODAY)
+    log = []
+    OutboxWorker(outbox, lambda: FakeMailer(log, crash_at=2), claim_size=2).run()
+    assert log == ["a@x.com", "b@x.com"]
+
+    # 重開程式：同一批彙整信再排一次不會重複，第二輪只寄剩下的
+    assert outbox.enqueue(build_digests(notices, TODAY), TODAY) == 0
+    assert OutboxWorker(outbox, lambda: FakeMailer(log), claim_size=2).run() == (3, 0)
+    assert log == [f"{c}@x.com" for c in "abcde"]
@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_price_history, write_price_fixtures
+from eln.prices import NO_DATA, REFRESH_DAYS, CsvProvider, PriceStore, market_of
+
+TICKERS = ["AAPL", "MSFT", "2330.TW", "7203.T", "0700.HK"]
+START = pd.Timestamp("2024-01-02")
+TODAY = pd.Timestamp("2024-06-28")
+
+
+class FlakyProvider(CsvProvider):
+    # 前 fail_times 次請求中，含 bad 代號的那一批整批失敗
+    def __init__(self, folder, bad, fail_times=1):
+        super().__init__(folder)
+        self.bad = bad
+        self.fail_times = fail_times
+
+    def fetch(self, tickers, start, end):
+        if self.bad in tickers and self.fail_times > 0:
+            self.fail_times -= 1
+            self.calls.append((list(tickers), pd.Timestamp(start), pd.Timestamp(end)))
+            raise ConnectionError("feed down")
+        return super().fetch(tickers, start, end)
+
+
+@pytest.fixture
+def prices(tmp_path):
+    history = make_price_history(TICKERS, START, TODAY)
+    return history, write_price_fixtures(str(tmp_path / "px"), history)
+
+
+def test_second_run_only_fetches_recent_days(tmp_path, prices):
+    history, folder = prices
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=CsvProvider(folder), backoff=0)
+    first = store.get_history(TICKERS, START, TODAY)
+    assert store.last_download_rows == history.notna().sum().sum()
+    assert all(r['status'] == 'ok' for r in store.last_report)
+
+    store.provider.calls.clear()
+    second = store.get_history(TICKERS, START, TODAY)
+    # 第二次只重抓最後 REFRESH_DAYS 天，讀出的資料與第一次相同
+    assert store.provider.calls
+    assert all(s >= TODAY - pd.Timedelta(days=REFRESH_DAYS) for _, s, _ in store.provider.calls)
+    pd.testing.assert_frame_equal(first.to_frame(), second.to_frame())
+    for t in TICKERS:
+        expected = history[t].dropna()
+        assert list(second[t].index) == list(expected.index)
+        assert second[t].to_numpy() == pytest.approx(expected.to_numpy())
+
+
+def test_per_ticker_start_dates(tmp_path, prices):
+    _, folder = prices
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=CsvProvider(folder), backoff=0)
+    starts = {t: START for t in TICKERS}
+    starts["AAPL"] = pd.Timestamp("2024-05-01")
+    loaded = store.get_history(TICKERS, starts, TODAY)
+    assert loaded["AAPL"].index.min() >= pd.Timestamp("2024-05-01")
+    assert loaded["MSFT"].index.min() < pd.Timestamp("2024-01-10")
+
+
+def test_chunks_are_grouped_by_market(tmp_path, prices):
+    _, folder = prices
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=CsvProvider(folder), chunk_size=50, backoff=0)
+    store.get_history(TICKERS, START, TODAY)
+    for group, _, _ in store.provider.calls:
+        assert len({market_of(t) for t in group}) == 1
+
+
+def test_failed_chunk_is_retried_alone(tmp_path, prices):
+    _, folder = prices
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=FlakyProvider(folder, "7203.T"), backoff=0)
+    store.get_history(TICKERS, START, TODAY)
+    # 只有失敗的那批重抓，最後全部補齊
+    assert [c[0] for c in store.provider.calls].count(["7203.T"]) == 2
+    assert all(r['status'] == 'ok' for r in store.last_report)
+
+
+def test_coverage_report_lists_unrecoverable_tickers(tmp_path, prices):
+    _, folder = prices
+    provider = FlakyProvider(folder, "0700.HK", fail_times=99)
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=provider, max_retries=2, backoff=0)
+    loaded = store.get_history(TICKERS + ["NOPE"], START, TODAY)
+    report = {r['ticker']: r for r in store.last_report}
+    assert report["0700.HK"]['status'] == 'missing' and "ConnectionError" in report["0700.HK"]['error']
+    assert report["NOPE"]['status'] == 'missing' and report["NOPE"]['error'] == NO_DATA
+    assert report["NOPE"]['missing'] == [(START, TODAY)]
+    # 其他代號不受影響
+    assert all(report[t]['status'] == 'ok' for t in TICKERS if t != "0700.HK")
+    assert len(loaded["AAPL"]) > 100
+
+
+def test_missing_ticker_is_not_retried(tmp_path, prices, monkeypatch):
+    # 沒有資料 (下市、打錯) 是最終結果：不重抓、不等退避
+    _, folder = prices
+    sleeps = []
+    monkeypatch.setattr("eln.prices.time.sleep", sleeps.append)
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=CsvProvider(folder), max_retries=2, backoff=5)
+    store.get_history(TICKERS + ["NOPE"], START, TODAY)
+    assert sleeps == []
+    assert sum("NOPE" in c[0] for c in store.provider.calls) == 1
+    report = {r['ticker']: r for r in store.last_report}
+    assert report["NOPE"]['status'] == 'missing' and report["NOPE"]['error'] == NO_DATA
+
+
+def test_only_transient_failures_wait_and_retry(tmp_path, prices, monkeypatch):
+    _, folder = prices
+    sleeps = []
+    monkeypatch.setattr("eln.prices.time.sleep", sleeps.append)
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=FlakyProvider(folder, "7203.T"), max_retries=2, backoff=5)
+    store.get_history(TICKERS + ["NOPE"], START, TODAY)
+    # 7203.T 第一次連線失敗 → 等一次退避後補齊；同一輪沒資料的 NOPE 不跟著重抓
+    assert sleeps == [5]
+    assert [c[0] for c in store.provider.calls].count(["7203.T"]) == 2
+    assert sum("NOPE" in c[0] for c in store.provider.calls) == 1
+    report = {r['ticker']: r for r in store.last_report}
+    assert report["7203.T"]['status'] == 'ok' and report["NOPE"]['error'] == NO_DATA
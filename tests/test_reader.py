@@ -0,0 +1,86 @@
+import io
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import LAYOUTS, make_position_sheet
+from eln.ingest import build_clean_df, read_book
+from eln.reader import read_book_stream
+
+
+def _csv_bytes(sheet):
+    buf = io.StringIO()
+    sheet.to_csv(buf, index=False)
+    return buf.getvalue().encode("utf-8")
+
+
+def _xlsx_bytes(sheets):
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        for name, sheet in sheets.items(): sheet.to_excel(writer, sheet_name=name, index=False)
+    return buf.getvalue()
+
+
+def _reference(file_bytes):
+    # 舊版：pandas 整張讀進來再正規化
+    return build_clean_df(read_book(file_bytes))
+
+
+def _check(got, expected):
+    (got_df, got_email), (exp_df, exp_email) = got, expected
+    assert got_email == exp_email
+    pd.testing.assert_frame_equal(got_df, exp_df, check_dtype=False)
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_csv_matches_pandas(layout):
+    data = _csv_bytes(make_position_sheet(60, seed=5, layout=layout))
+    # chunk_rows 小於筆數：跨分塊的結果也要相同
+    _check(read_book_stream(data, chunk_rows=7), _reference(data))
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_xlsx_matches_pandas(layout):
+    pytest.importorskip("openpyxl")
+    data = _xlsx_bytes({"Book": make_position_sheet(60, seed=6, layout=layout)})
+    _check(read_book_stream(data, chunk_rows=7), _reference(data))
+
+
+def test_blank_rows_are_skipped():
+    sheet = make_position_sheet(20, seed=7, layout="subheader")
+    blank = pd.DataFrame([[None] * sheet.shape[1]] * 2, columns=sheet.columns)
+    sheet = pd.concat([blank, sheet.iloc[:10], blank, sheet.iloc[10:]], ignore_index=True)
+    data = _csv_bytes(sheet)
+    got, _ = read_book_stream(data, chunk_rows=4)
+    assert len(got) == 20
+    _check((got, "Email"), _reference(data))
+
+
+def test_all_sheets_matches_pandas_per_sheet():
+    pytest.importorskip("openpyxl")
+    sheets = {"A": make_position_sheet(25, seed=8), "B": make_position_sheet(15, seed=9, layout="subheader"),
+              "說明": pd.DataFrame({"備註": ["不是部位表"]})}
+    data = _xlsx_bytes(sheets)
+    got_df, got_email = read_book_stream(data, all_sheets=True, chunk_rows=6)
+
+    # 參考結果：逐張 pd.read_excel 後各自正規化，認不出的分頁略過
+    frames = []
+    for name, raw in pd.read_excel(io.BytesIO(data), sheet_name=None).items():
+        if raw.dropna(how='all').iloc[0].astype(str).str.contains("進場價").any():
+            raw = raw.dropna(how='all').iloc[1:].reset_index(drop=True)
+        try: clean_df, _ = build_clean_df(raw)
+        except ValueError: continue
+        clean_df['Sheet'] = name
+        frames.append(clean_df)
+    assert [f['Sheet'].iloc[0] for f in frames] == ["A", "B"]
+    assert got_email == "Email"
+    pd.testing.assert_frame_equal(got_df, pd.concat(frames, ignore_index=True), check_dtype=False)
+    # 只讀第一張
+    _check(read_book_stream(data), _reference(data))
+
+
+def test_no_recognisable_sheet_raises():
+    pytest.importorskip("openpyxl")
+    data = _xlsx_bytes({"說明": pd.DataFrame({"備註": ["不是部位表"]})})
+    with pytest.raises(ValueError, match="標的1"):
+        read_book_stream(data, all_sheets=True)
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from eln.scenarios import live_mask, shock_matrix, stress_book
+
+TODAY = pd.Timestamp("2025-06-30")
+
+
+def test_zero_shock_matches_build_notifications(sample_run):
+    products, barriers, today = sample_run['products'], sample_run['barrier_results'], sample_run['today_ts']
+    detail, summary = stress_book(products, barriers, shock_matrix(sample_run['tickers'], [-0.1, 0.0, 0.1]), today)
+    live = live_mask(products, barriers, today)
+    assert live.sum() > 20 and len(detail) == 3 * live.sum()
+
+    base = detail[detail['shock'] == 0.0].set_index('債券代號')
+    results = pd.DataFrame(sample_run['results']).set_index('債券代號')[live]
+    assert list(base.index) == list(results.index)
+    # 0% 情境 = 今天的狀態：最差表現、KI 已破、DRA 暫停計息都與通知流程一致
+    assert np.allclose(base['worst_perf'].round(2), results['最差表現%'])
+    assert (base['ki_hit'] == results['KI已破']).all()
+    is_dra = np.array([p['is_dra'] for p, k in zip(products, live) if k])
+    assert (base['dra_accrual'] == (is_dra & ~results['DRA暫停'].to_numpy())).all()
+    # 仍在比價中的商品今天的收盤價已回測過，不會在 0% 情境觸發 KO
+    assert not base['ko_trigger'].any()
+    assert summary.loc[0.0, 'ki_hit'] == results['KI已破'].sum()
+
+
+def _product(pid, codes, prices, ko=1.0, ki=0.6, nc_end="2025-01-31", locked=(), hit=()):
+    p = {'row': {'ID': pid, 'ValuationDate': pd.Timestamp("2026-06-30")}, 'issue_date': pd.Timestamp("2024-06-28"),
+         'nc_end_date': pd.Timestamp(nc_end), 'codes': list(codes),
+         'assets': [{'code': c, 'initial': 100.0, 'price': float(px)} for c, px in zip(codes, prices)],
+         'ko_thresh': ko, 'ki_thresh': ki, 'strike_thresh': 0.8, 'is_dra': False}
+    b = {'early_redemption_date': None,
+         'assets': [{'locked_ko': c in locked, 'hit_ki': c in hit} for c in codes]}
+    return p, b
+
+
+def test_known_shock_flips_ki_and_ko():
+    products, barriers = map(list, zip(
+        _product("P1", ["AAPL", "2330.TW"], [90, 95]),                          # 最差 90%：跌 33.3% 以上才 KI
+        _product("P2", ["AAPL", "MSFT"], [96, 98], ko=1.0),                     # 漲 4.2% 以上全部站上 KO
+        _product("P3", ["AAPL", "MSFT"], [96, 98], nc_end="2025-12-31"),        # 還在 NC 期，不能 KO
+        _product("P4", ["AAPL", "MSFT"], [96, 90], locked=("MSFT",)),           # MSFT 已鎖定，只看 AAPL
+    ))
+    levels = [-0.35, -0.3, 0.0, 0.04, 0.05]
+    detail, summary = stress_book(products, barriers, shock_matrix(["AAPL", "MSFT", "2330.TW"], levels), TODAY)
+    d = detail.set_index(['shock', '債券代號'])
+    assert not d.loc[(-0.3, "P1"), 'ki_hit'] and d.loc[(-0.35, "P1"), 'ki_hit']
+    assert not d.loc[(0.04, "P2"), 'ko_trigger'] and d.loc[(0.05, "P2"), 'ko_trigger']
+    assert not d.xs("P3", level=1)['ko_trigger'].any()
+    assert not d.loc[(0.0, "P4"), 'ko_trigger'] and d.loc[(0.05, "P4"), 'ko_trigger']
+    assert d.loc[(0.05, "P2"), 'ko_gap'] >= 0 > d.loc[(0.04, "P2"), 'ko_gap']
+    assert summary.loc[0.05, 'ko_trigger'] == 2 and summary.loc[-0.35, 'ki_hit'] == 2  # P1、P4 (最差 90%)
+
+    # 只衝擊台股：P1 的 2330.TW 跌 40% 也會 KI，美股商品不受影響
+    tw = stress_book(products, barriers, shock_matrix(["AAPL", "MSFT", "2330.TW"], [-0.4], target="TW"), TODAY)[0]
+    assert tw.set_index('債券代號')['ki_hit'].to_dict() == {"P1": True, "P2": False, "P3": False, "P4": False}
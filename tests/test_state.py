@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from eln.barriers import evaluate_barriers
+from eln.engine import backtest, settle_date
+from eln.state import BarrierStateStore, terms_key
+
+TODAY = pd.Timestamp("2024-02-14")
+
+
+def _prices(with_b=True):
+    index = pd.bdate_range("2024-01-02", TODAY)
+    frame = pd.DataFrame({'A': np.full(len(index), 100.0)}, index=index)
+    if with_b:
+        frame['B'] = 100.0
+        frame.loc["2024-01-08", 'B'] = 50.0  # 跌破 KI
+    return frame
+
+
+def _product(**terms):
+    p = {'row': {'ID': 'P1'}, 'codes': ['A', 'B'], 'initials': [100.0, 100.0],
+         'ko_thresh': 1.05, 'ki_thresh': 0.6, 'is_aki': True,
+         'issue_date': pd.Timestamp("2024-01-02"), 'nc_end_date': pd.Timestamp("2024-04-02")}
+    p.update(terms)
+    return p
+
+
+def test_checkpoint_does_not_pass_missing_ticker(tmp_path):
+    # 第一次 B 沒抓到：檢查點不能記到 settle 日，否則 B 補上後的 KI 永遠不會被發現
+    store = BarrierStateStore(str(tmp_path / "s.sqlite"))
+    product = _product()
+    first = backtest([product], _prices(with_b=False), TODAY, store)
+    assert not first[0]['assets'][1]['hit_ki']
+
+    resumed = backtest([product], _prices(), TODAY, store)
+    full = evaluate_barriers(_prices(), [product], TODAY)
+    assert resumed == full
+    assert resumed[0]['assets'][1]['hit_ki'] and resumed[0]['assets'][1]['ki_record'] == "@50.00 (2024/01/08)"
+    # 這次 B 有資料，檢查點才推進到 settle 日前最後一個交易日
+    state = store.load([terms_key(product)])[0]
+    assert state['last_date'] == pd.Timestamp("2024-02-09") and state['assets'][1]['hit_ki']
+
+
+def test_checkpoint_stops_at_last_available_close():
+    # B 只抓到一部分 (最後幾天沒有)：檢查點停在 B 的最後一筆收盤價
+    frame = _prices()
+    frame.loc["2024-02-01":, 'B'] = np.nan
+    res = evaluate_barriers(frame, [_product()], TODAY, settle_ts=settle_date(TODAY))
+    assert res[0]['state']['last_date'] == pd.Timestamp("2024-01-31")
+
+
+def test_changed_terms_drop_old_checkpoint(tmp_path):
+    store = BarrierStateStore(str(tmp_path / "s.sqlite"))
+    old = _product()
+    assert backtest([old], _prices(), TODAY, store)[0]['assets'][1]['hit_ki']
+
+    # KI 門檻改成 40%：key 不同，不沿用「已觸發 KI」的舊檢查點，整段重算
+    new = _product(ki_thresh=0.4)
+    assert terms_key(new) != terms_key(old)
+    assert store.load([terms_key(new)]) == [None]
+    res = backtest([new], _prices(), TODAY, store)
+    assert not res[0]['assets'][1]['hit_ki']
+    assert res == evaluate_barriers(_prices(), [new], TODAY)
@@ -0,0 +1,76 @@
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+from eln.engine import fetch_history
+from eln.prices import NO_DATA, PriceStore, YahooProvider
+from eln.symbols import SymbolMaster
+
+TODAY = pd.Timestamp("2025-06-30")
+START = pd.Timestamp("2025-01-01")
+
+
+class FakeTicker:
+    # 依代號模擬：FLAKY 連線失敗、DEAD 請求成功但沒有資料，其餘回一段收盤價
+    requests = []
+
+    def __init__(self, code):
+        self.code = code
+
+    def history(self, start, end, **kwargs):
+        FakeTicker.requests.append(self.code)
+        if self.code == "FLAKY": raise ConnectionError("connection reset")
+        if self.code == "DEAD": return pd.DataFrame(columns=['Close'], dtype=float)
+        days = pd.bdate_range(start, pd.Timestamp(end) - pd.Timedelta(days=1))
+        return pd.DataFrame({'Close': range(1, len(days) + 1)}, index=days, dtype=float)
+
+
+@pytest.fixture
+def fake_yfinance(monkeypatch):
+    FakeTicker.requests = []
+    monkeypatch.setitem(sys.modules, "yfinance", types.SimpleNamespace(Ticker=FakeTicker))
+    return FakeTicker
+
+
+def test_yahoo_provider_reports_errors_separately(fake_yfinance):
+    data = YahooProvider().fetch(["AAPL", "FLAKY", "DEAD"], START, TODAY)
+    assert data["AAPL"].notna().any()
+    assert set(data.attrs['errors']) == {"FLAKY"}
+
+
+def test_connection_errors_are_not_negative_cached(tmp_path, fake_yfinance):
+    store = PriceStore(str(tmp_path / "p.sqlite"), provider=YahooProvider(), backoff=0)
+    master = SymbolMaster(str(tmp_path / "s.sqlite"))
+    fetch_history(store, ["AAPL", "FLAKY", "DEAD"], START, TODAY, master)
+
+    report = {r['ticker']: r for r in store.last_report}
+    assert report["DEAD"]['error'] == NO_DATA
+    assert report["FLAKY"]['status'] == 'missing' and "ConnectionError" in report["FLAKY"]['error']
+    assert set(master.dead(["AAPL", "FLAKY", "DEAD"])) == {"DEAD"}
+
+    # 第二次：DEAD 在 TTL 內不再請求，FLAKY 照樣重試
+    fake_yfinance.requests = []
+    fetch_history(store, ["AAPL", "FLAKY", "DEAD"], START, TODAY, master)
+    assert "DEAD" not in fake_yfinance.requests and "FLAKY" in fake_yfinance.requests
+    assert {r['ticker']: r['status'] for r in store.last_report}["DEAD"] == 'skipped'
+
+    assert master.recheck() == 1
+    assert master.dead(["DEAD"]) == {}
+
+
+def test_overrides_apply_to_raw_and_resolved_codes(tmp_path):
+    master = SymbolMaster(str(tmp_path / "s.sqlite"))
+    df = pd.DataFrame({'T1_Code': ["XXXX", "AAPL", ""], 'T1_Raw': ["XXXX UW", "AAPL UW", ""],
+                       'T2_Code': ["TSLA", "OLD", ""], 'T2_Raw': ["TSLA US", "OLD US", ""]})
+    assert master.apply(df) is df
+
+    master.set_override("xxxx uw", "msft")
+    master.set_override("OLD", "NEW")
+    out = master.apply(df)
+    assert out['T1_Code'].tolist() == ["MSFT", "AAPL", ""]
+    assert out['T2_Code'].tolist() == ["TSLA", "NEW", ""]
+    assert df['T1_Code'].tolist() == ["XXXX", "AAPL", ""]
+    sources = dict(zip(master.resolved()['原始代號'], master.resolved()['來源']))
+    assert sources == {"XXXX UW": 'override', "AAPL UW": 'rule', "TSLA US": 'rule', "OLD US": 'override'}
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from eln.scenarios import live_mask
+from eln.watch import IntradayWatcher, ReplayFeed, UnderlyingIndex, run_watch
+
+
+def _levels(p):
+    return [a['initial'] * th for a in p['assets'] for th in (p['ko_thresh'], p['ki_thresh'], p['strike_thresh'])]
+
+
+def _expected(products, live, code, old, new):
+    # 暴力法：引用該代號、且有任一價位落在 [old, new] 的在比價商品
+    lo, hi = min(old, new), max(old, new)
+    return {j for j, p in enumerate(products) if live[j] and any(
+        a['code'] == code and lo <= a['initial'] * th <= hi
+        for a in p['assets'] for th in (p['ko_thresh'], p['ki_thresh'], p['strike_thresh']))}
+
+
+@pytest.fixture
+def watch(sample_run):
+    products, barriers, today = sample_run['products'], sample_run['barrier_results'], sample_run['today_ts']
+    watcher = IntradayWatcher(products, barriers, today)
+    live = live_mask(products, barriers, today)
+    # 目標：還沒破 KI 的 AKI 商品，拿它某檔標的的 KI 價位來穿越
+    target = next(j for j, (p, b) in enumerate(zip(products, barriers)) if live[j] and p['is_aki']
+                  and not any(a['hit_ki'] for a in b['assets']) and all(a['price'] > 0 for a in p['assets']))
+    code = products[target]['assets'][0]['code']
+    ki_level = products[target]['assets'][0]['initial'] * products[target]['ki_thresh']
+    return watcher, products, live, target, code, ki_level, today
+
+
+def test_index_matches_brute_force(sample_run):
+    products, barriers, today = sample_run['products'], sample_run['barrier_results'], sample_run['today_ts']
+    live = live_mask(products, barriers, today)
+    index = UnderlyingIndex(products, np.flatnonzero(live).tolist())
+    rng = np.random.default_rng(0)
+    for code in sample_run['tickers']:
+        for _ in range(20):
+            old, new = rng.uniform(10, 900, 2)
+            assert index.crossed(code, old, new) == _expected(products, live, code, old, new)
+    assert index.crossed("NOT.A.CODE", 1.0, 2.0) == set()
+
+
+def test_replay_only_crossed_products_are_reevaluated(watch):
+    watcher, products, live, target, code, ki_level, today = watch
+    base = watcher.evaluations
+    evaluated = []
+    original = watcher._evaluate
+    watcher._evaluate = lambda pos, ts: (evaluated.append(pos), original(pos, ts))[1]
+
+    old = watcher.last[code]
+    levels = np.sort([lv for j, p in enumerate(products) if live[j] for lv in _levels(p)
+                      if any(a['code'] == code for a in p['assets'])])
+    above = levels[levels > old]
+    quiet = (old + above[0]) / 2 if len(above) else old * 1.01  # 不碰到任何價位的小波動
+    ts = today.normalize() + pd.Timedelta(hours=10)
+    feed = ReplayFeed(pd.DataFrame([dict(watcher.last), {code: quiet}, {code: ki_level * 0.99}],
+                                   index=[ts, ts + pd.Timedelta(minutes=1), ts + pd.Timedelta(minutes=2)]))
+
+    # 報價沒變：什麼都不重算
+    t, quotes = feed.poll()
+    assert watcher.on_quotes(quotes, t) == [] and evaluated == []
+    # 小波動沒穿越任何價位：也不重算
+    t, quotes = feed.poll()
+    assert watcher.on_quotes(quotes, t) == [] and evaluated == []
+    assert watcher.last[code] == quiet
+
+    # 跌破目標商品的 KI：只重算價位落在 [新價, 舊價] 之間的商品
+    t, quotes = feed.poll()
+    events = watcher.on_quotes(quotes, t)
+    assert set(evaluated) == _expected(products, live, code, quiet, ki_level * 0.99) and target in evaluated
+    assert len(evaluated) == len(set(evaluated)) and watcher.evaluations == base + len(evaluated)
+    assert {ev['id'] for ev in events} <= {products[j]['row']['ID'] for j in evaluated}
+    hit = next(ev for ev in events if ev['id'] == products[target]['row']['ID'])
+    assert "KI" in hit['status'] and "盤中" in hit['result']['T1_KI']
+    assert feed.exhausted
+
+
+def test_run_watch_reports_each_event_once(watch):
+    watcher, products, live, target, code, ki_level, today = watch
+    ts = today.normalize() + pd.Timedelta(hours=10)
+    old = watcher.last[code]
+    # 跌破 → 回到原價 → 再跌破：KI 已記下，第二次不再產生同一個事件
+    quotes = pd.DataFrame({code: [ki_level * 0.99, old, ki_level * 0.99]},
+                          index=[ts + pd.Timedelta(minutes=i) for i in range(3)])
+    events = run_watch({"A": watcher}, ReplayFeed(quotes), interval=0)
+    target_id = products[target]['row']['ID']
+    assert [ev['id'] for ev in events].count(target_id) == 1
+    assert all(ev['book'] == "A" for ev in events)
+    # 盤中暫定結果不動到原本的回測結果
+    assert not any(a['hit_ki'] for a in products[target]['assets'])
+    assert any(a['hit_ki'] for a in watcher.products[target]['assets'])